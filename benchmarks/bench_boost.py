@@ -0,0 +1,142 @@
+"""Benchmarks for the overhead of BoostExecutor.
+
+Run with ``python benchmarks/bench_boost.py``. Use ``--help`` to see options.
+
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import AsyncIterator, Dict, List
+
+import boostedblob as bbb
+
+
+def report(name: str, n: int, duration: float, latencies: List[float]) -> None:
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e6
+
+    print(
+        f"{name:<24} {duration:6.2f}s  {duration / n * 1e6:6.2f}us/task  "
+        f"latency mean {statistics.mean(latencies) * 1e6:8.1f}us  "
+        f"p50 {percentile(0.5):8.1f}us  p99 {percentile(0.99):8.1f}us  "
+        f"p99.9 {percentile(0.999):8.1f}us  max {latencies[-1] * 1e6:8.1f}us"
+    )
+
+
+async def bench_map(n: int, concurrency: int) -> None:
+    """Many short tasks, e.g. deletes or small copies.
+
+    Latency is measured from when a task returns to when its result is yielded.
+
+    """
+    finished = [0.0] * n
+
+    async def task(i: int) -> int:
+        await asyncio.sleep(0)
+        finished[i] = time.perf_counter()
+        return i
+
+    latencies = []
+    start = time.perf_counter()
+    async with bbb.BoostExecutor(concurrency) as executor:
+        async for i in executor.map_unordered(task, iter(range(n))):
+            latencies.append(time.perf_counter() - finished[i])
+    report("map_unordered", n, time.perf_counter() - start, latencies)
+
+
+async def bench_map_eagerise(n: int, concurrency: int) -> None:
+    """Many short tasks fed by an async iterator, e.g. a listing.
+
+    Latency is measured from when an element is produced to when a task starts working on it.
+
+    """
+    produced = [0.0] * n
+    latencies = []
+
+    async def listing() -> AsyncIterator[int]:
+        for i in range(n):
+            if i % 1000 == 0:
+                # simulate waiting for the next page of a listing
+                await asyncio.sleep(0.001)
+            produced[i] = time.perf_counter()
+            yield i
+
+    async def task(i: int) -> None:
+        latencies.append(time.perf_counter() - produced[i])
+        await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    async with bbb.BoostExecutor(concurrency) as executor:
+        await bbb.boost.consume(executor.map_unordered(task, executor.eagerise(listing())))
+    report("map_unordered(eagerise)", n, time.perf_counter() - start, latencies)
+
+
+async def bench_unordered_dequeue(size: int, n: int = 10_000) -> None:
+    """Cost of a non-blocking dequeue from a map_unordered with ``size`` tasks in flight.
+
+    This is what happens when a boostable composed on top of a map_unordered is offered a boost.
+    We measure dequeues that find a task that has finished, and dequeues that find nothing ready.
+
+    """
+    loop = asyncio.get_running_loop()
+    futures: Dict[int, asyncio.Future[None]] = {}
+
+    async def task(i: int) -> int:
+        futures[i] = loop.create_future()
+        await futures[i]
+        return i
+
+    ready = 0.0
+    not_ready = 0.0
+    async with bbb.BoostExecutor(size + 1) as executor:
+        it = executor.map_unordered(task, iter(range(size + n)))
+        while len(futures) < size:
+            await asyncio.sleep(0)
+        for _ in range(n):
+            start = time.perf_counter()
+            assert isinstance(it.dequeue(), bbb.boost.NotReady)
+            not_ready += time.perf_counter() - start
+
+            futures.pop(random.choice(list(futures))).set_result(None)
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            start = time.perf_counter()
+            assert not isinstance(it.dequeue(), bbb.boost.NotReady)
+            ready += time.perf_counter() - start
+            while len(futures) < size:
+                await asyncio.sleep(0)
+        for f in futures.values():
+            f.set_result(None)
+        await bbb.boost.consume(it)
+    print(
+        f"dequeue with {size:>6} in flight  ready {ready / n * 1e6:8.2f}us  "
+        f"not ready {not_ready / n * 1e6:8.2f}us"
+    )
+
+
+BENCHMARKS = ["map", "map_eagerise", "unordered_dequeue"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmarks", nargs="*", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("-n", type=int, default=1_000_000, help="Number of tasks")
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    if "map" in args.benchmarks:
+        asyncio.run(bench_map(args.n, args.concurrency))
+    if "map_eagerise" in args.benchmarks:
+        asyncio.run(bench_map_eagerise(args.n, args.concurrency))
+    if "unordered_dequeue" in args.benchmarks:
+        for size in [10, 100, 1_000, 10_000]:
+            asyncio.run(bench_unordered_dequeue(size))
+
+
+if __name__ == "__main__":
+    main()
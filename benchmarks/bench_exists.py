@@ -0,0 +1,72 @@
+"""Benchmarks for how many requests uploading many small files takes.
+
+Uploads small files with ``overwrite=False`` to a cloud directory you have write access to, and
+reports the number of requests made per file, along with how many of those were spent checking
+whether the destination exists. For comparison, also times the checks the way we used to do them:
+a stat raced against a listing.
+
+Run with ``python benchmarks/bench_exists.py az://account/container/some/dir``. Use ``--help`` to
+see options. Files are written under a new subdirectory, which is removed afterwards.
+
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+import boostedblob as bbb
+from boostedblob.metrics import registry
+
+
+def report(name: str, n: int, duration: float) -> None:
+    requests = registry.counters.get("request.count", 0)
+    print(
+        f"{name:<24} {duration:6.2f}s  {n / duration:8.1f} files/s  "
+        f"{requests / n:5.2f} requests/file"
+    )
+    registry.reset()
+
+
+async def old_exists(path: bbb.BasePath) -> bool:
+    for fut in asyncio.as_completed([bbb.isfile(path), bbb.isdir(path)]):
+        if await fut:
+            return True
+    return False
+
+
+@bbb.ensure_session
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir")
+    parser.add_argument("-n", type=int, default=100_000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    base = bbb.BasePath.from_str(args.dir) / f"bench-{uuid.uuid4().hex[:8]}"
+    paths = [base / f"{i // 1000}" / f"{i}" for i in range(args.n)]
+
+    async with bbb.BoostExecutor(args.concurrency) as executor:
+        # warm up token caches and connections
+        await bbb.exists(base)
+        registry.reset()
+
+        start = time.perf_counter()
+        await bbb.boost.consume(executor.map_unordered(old_exists, iter(paths)))
+        report("stat + isdir", args.n, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await bbb.boost.consume(executor.map_unordered(bbb.exists, iter(paths)))
+        report("stat_or_isdir", args.n, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await bbb.boost.consume(
+            executor.map_unordered(lambda p: bbb.write.write_single(p, b"x"), iter(paths))
+        )
+        report("upload", args.n, time.perf_counter() - start)
+
+        await bbb.rmtree(base, executor)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+"""Benchmarks for downloading with readinto, compared to reading into new bytes objects.
+
+Serves a blob from a local aiohttp server in a separate process, then downloads it to a local file
+in chunks, either:
+
+- ``read``: the read_stream / write_stream path. Each chunk is read into a new bytes object and
+  then written to the file.
+- ``readinto``: the path copyfile uses for downloads. The file is mmapped and each chunk is read
+  straight into it.
+
+Each mode runs in a fresh process, so peak RSS is meaningful. CPU time excludes the server.
+
+Run with ``python benchmarks/bench_readinto.py``. Use ``--help`` to see options.
+
+"""
+
+import argparse
+import asyncio
+import itertools
+import mmap
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Iterator, Tuple
+
+import aiohttp.web
+
+import boostedblob as bbb
+from boostedblob.path import LocalPath
+from boostedblob.request import Request, execute_retrying_read, execute_retrying_readinto
+
+PORT = 8767
+
+
+def serve(size: int) -> None:
+    blob = os.urandom(16 * 2**20) * (size // (16 * 2**20) + 1)
+
+    async def handle(request: aiohttp.web.Request) -> aiohttp.web.Response:
+        start, end = request.headers["Range"].split("=")[1].split("-")
+        return aiohttp.web.Response(body=blob[int(start) : int(end) + 1], status=206)
+
+    app = aiohttp.web.Application()
+    app.router.add_get("/", handle)
+    aiohttp.web.run_app(app, port=PORT, print=None)
+
+
+def byte_ranges(size: int, chunk_size: int) -> Iterator[Tuple[int, int]]:
+    return itertools.zip_longest(
+        range(0, size, chunk_size), range(chunk_size, size, chunk_size), fillvalue=size
+    )
+
+
+def range_request(byte_range: Tuple[int, int]) -> Request:
+    start, end = byte_range
+    return Request(
+        "GET",
+        f"http://127.0.0.1:{PORT}/",
+        headers={"Range": f"bytes={start}-{end - 1}"},
+        success_codes=(206,),
+    )
+
+
+async def download_read(path: str, size: int, chunk_size: int, concurrency: int) -> None:
+    async with bbb.BoostExecutor(concurrency) as executor:
+        stream = executor.map_ordered(
+            lambda r: execute_retrying_read(range_request(r)), byte_ranges(size, chunk_size)
+        )
+        await bbb.write.write_stream(LocalPath(path), stream, executor, overwrite=True)
+
+
+async def download_readinto(path: str, size: int, chunk_size: int, concurrency: int) -> None:
+    async with bbb.BoostExecutor(concurrency) as executor:
+        with open(path, "w+b") as f:
+            f.truncate(size)
+            with mmap.mmap(f.fileno(), size) as mm:
+                view = memoryview(mm)
+
+                async def read_chunk(byte_range: Tuple[int, int]) -> None:
+                    start, end = byte_range
+                    await execute_retrying_readinto(range_request(byte_range), view[start:end])
+
+                await bbb.boost.consume(
+                    executor.map_unordered(read_chunk, byte_ranges(size, chunk_size))
+                )
+                view.release()
+
+
+@bbb.ensure_session
+async def run_mode(mode: str, size: int, chunk_size: int, concurrency: int) -> None:
+    download = download_read if mode == "read" else download_readinto
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "blob")
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        await download(path, size, chunk_size, concurrency)
+        duration = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        assert os.path.getsize(path) == size
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    gb = size / 2**30
+    print(
+        f"{mode:<10} {duration:6.2f}s  {gb / duration:5.2f} GB/s  cpu {cpu / gb:5.2f}s/GB  "
+        f"peak rss {peak_mb:7.1f} MB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--chunk-mb", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mode", choices=["read", "readinto"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    size = args.size_mb * 2**20
+    chunk_size = args.chunk_mb * 2**20
+
+    if args.mode is not None:
+        asyncio.run(run_mode(args.mode, size, chunk_size, args.concurrency))
+        return
+
+    server = multiprocessing.Process(target=serve, args=(size,), daemon=True)
+    server.start()
+    time.sleep(2)
+    try:
+        for mode in ["read", "readinto"]:
+            subprocess.run([sys.executable, *sys.argv, "--mode", mode], check=True)
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
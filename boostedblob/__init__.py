@@ -10,8 +10,11 @@ if "pkg_resources" not in sys.modules:
 
     del sys.modules["pkg_resources"]
 
+from . import blocking as blocking
+from . import metrics as metrics
 from . import read as read
 from . import share as share
+from . import tracing as tracing
 from . import write as write
 from .boost import BoostExecutor as BoostExecutor
 from .copying import copyfile as copyfile
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import base64
 import datetime
+import functools
 import hmac
 import json
 import os
@@ -397,27 +398,42 @@ async def get_storage_account_key(
     )
 
 
-def sign_request_with_shared_key(request: Request, key: str) -> str:
-    # https://docs.microsoft.com/en-us/rest/api/storageservices/authorize-with-shared-key
+@functools.lru_cache(maxsize=4096)
+def _canonicalized_url(url: str) -> Tuple[str, str]:
+    """Returns the storage account and canonicalised resource path for ``url``."""
     from yarl import URL
 
     # Figuring out that shared key authorisation sometimes breaks because aiohttp is a little over
     # clever about canonicalising URLs was not fun; preemptively canonicalise
-    parsed_url = urllib.parse.urlparse(str(URL(request.url)))
+    parsed_url = urllib.parse.urlparse(str(URL(url)))
     storage_account = parsed_url.netloc.split(".")[0]
     blob = parsed_url.path[1:]
+    return storage_account, f"/{storage_account}/{blob}"
+
+
+@functools.lru_cache(maxsize=16)
+def _decode_key(key: str) -> bytes:
+    return base64.b64decode(key)
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def sign_request_with_shared_key(request: Request, key: str) -> str:
+    # https://docs.microsoft.com/en-us/rest/api/storageservices/authorize-with-shared-key
+    # Parsing the URL and decoding the key are cached, since we sign every chunk we upload
+    storage_account, canonical_url = _canonicalized_url(request.url)
 
     def canonicalized_resource() -> str:
         params_to_sign = sorted(f"{name.lower()}:{value}" for name, value in request.params.items())
-        canonical_url = f"/{storage_account}/{blob}"
         return "\n".join([canonical_url] + params_to_sign)
 
     def canonicalized_headers() -> str:
         headers_to_sign = []
         for name, value in request.headers.items():
             canonical_name = name.lower()
-            canonical_value = re.sub(r"\s+", " ", value).strip()
             if canonical_name.startswith("x-ms-"):
+                canonical_value = _WHITESPACE_RE.sub(" ", value).strip()
                 headers_to_sign.append(f"{canonical_name}:{canonical_value}")
         return "\n".join(sorted(headers_to_sign))
 
@@ -445,7 +461,7 @@ def sign_request_with_shared_key(request: Request, key: str) -> str:
     string_to_sign = "\n".join(parts_to_sign)
 
     signature = base64.b64encode(
-        hmac.digest(base64.b64decode(key), string_to_sign.encode("utf8"), "sha256")
+        hmac.digest(_decode_key(key), string_to_sign.encode("utf8"), "sha256")
     ).decode("utf8")
 
     return f"SharedKey {storage_account}:{signature}"
@@ -0,0 +1,248 @@
+"""A blocking interface to boostedblob, for use from synchronous code.
+
+Every call is run on a single event loop in a background thread. Threads calling into this module
+therefore share a connection pool, cached tokens and a BoostExecutor, instead of each paying for
+their own event loop, session and TLS handshakes.
+
+This module is named ``blocking`` because ``boostedblob.sync`` is the function that syncs
+directory trees.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import inspect
+import os
+import threading
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import aiohttp
+
+from .boost import Boostable, BoostExecutor, BoostUnderlying, iter_underlying
+from .copying import copyfile
+from .globals import _create_session, _loop_sessions, set_event_loop_exception_handler
+from .listing import listdir as _listdir
+from .path import BasePath, Stat
+from .path import stat as _stat
+from .read import read_single
+from .write import write_single
+
+T = TypeVar("T")
+
+DEFAULT_CONCURRENCY = int(os.environ.get("BBB_DEFAULT_CONCURRENCY", 100))
+
+IterableFactory = Callable[
+    [BoostExecutor],
+    Union[
+        BoostUnderlying[T],
+        AsyncIterable[T],
+        Awaitable[Union[BoostUnderlying[T], AsyncIterable[T]]],
+    ],
+]
+
+
+class _LoopThread:
+    """An event loop running forever in a daemon thread, with its own session and executor."""
+
+    def __init__(
+        self, concurrency: int, max_rps: Optional[float] = None, bwlimit: Optional[float] = None
+    ) -> None:
+        self.concurrency = concurrency
+        self.max_rps = max_rps
+        self.bwlimit = bwlimit
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="boostedblob-blocking", daemon=True
+        )
+        self.thread.start()
+        self.session, self.executor = self.run(self.setup())
+
+    async def setup(self) -> Tuple[aiohttp.ClientSession, BoostExecutor]:
+        set_event_loop_exception_handler()
+        session = _create_session()
+        _loop_sessions[self.loop] = session
+        executor = BoostExecutor(self.concurrency, max_rps=self.max_rps, bwlimit=self.bwlimit)
+        await executor.__aenter__()
+        return session, executor
+
+    async def teardown(self) -> None:
+        try:
+            await self.executor.__aexit__(None, None, None)
+        finally:
+            del _loop_sessions[self.loop]
+            await self.session.close()
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        if threading.current_thread() is self.thread:
+            coro.close()
+            raise RuntimeError("Cannot make blocking boostedblob calls from its own event loop")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self) -> None:
+        try:
+            self.run(self.teardown())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+
+
+_loop_thread: Optional[_LoopThread] = None
+_loop_thread_lock = threading.Lock()
+
+
+def _get_loop_thread() -> _LoopThread:
+    global _loop_thread
+    with _loop_thread_lock:
+        if _loop_thread is None:
+            _loop_thread = _LoopThread(DEFAULT_CONCURRENCY)
+        return _loop_thread
+
+
+def _run(fn: Callable[[BoostExecutor], Coroutine[Any, Any, T]]) -> T:
+    loop_thread = _get_loop_thread()
+    return loop_thread.run(fn(loop_thread.executor))
+
+
+def start(
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_rps: Optional[float] = None,
+    bwlimit: Optional[float] = None,
+) -> None:
+    """Start the background event loop.
+
+    This happens automatically on first use, so you only need to call this to configure the
+    executor shared by all blocking calls.
+
+    :param concurrency: The concurrency of the shared executor.
+    :param max_rps: Limit on requests per second made by the shared executor.
+    :param bwlimit: Limit on bytes per second transferred by the shared executor.
+
+    """
+    global _loop_thread
+    with _loop_thread_lock:
+        if _loop_thread is None:
+            _loop_thread = _LoopThread(concurrency, max_rps=max_rps, bwlimit=bwlimit)
+        elif _loop_thread.concurrency != concurrency:
+            raise RuntimeError(
+                f"Already started with concurrency {_loop_thread.concurrency}, call shutdown first"
+            )
+
+
+def shutdown() -> None:
+    """Stop the background event loop, closing its session.
+
+    Any later blocking call will start a new one.
+
+    """
+    global _loop_thread
+    with _loop_thread_lock:
+        loop_thread, _loop_thread = _loop_thread, None
+    if loop_thread is not None:
+        loop_thread.close()
+
+
+def _reset_after_fork() -> None:
+    # The loop thread doesn't survive a fork, so the child needs to start its own
+    global _loop_thread, _loop_thread_lock
+    _loop_thread = None
+    _loop_thread_lock = threading.Lock()
+
+
+atexit.register(shutdown)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# ==============================
+# API
+# ==============================
+
+
+def read(path: Union[BasePath, str]) -> bytes:
+    """Blocking version of :func:`boostedblob.read.read_single`."""
+    return _run(lambda executor: read_single(path))
+
+
+def write(path: Union[BasePath, str], data: bytes, overwrite: bool = False) -> None:
+    """Blocking version of :func:`boostedblob.write.write_single`."""
+    _run(lambda executor: write_single(path, data, overwrite=overwrite))
+
+
+def copy(src: Union[BasePath, str], dst: Union[BasePath, str], overwrite: bool = False) -> None:
+    """Blocking version of :func:`boostedblob.copyfile`, using the shared executor."""
+    _run(lambda executor: copyfile(src, dst, executor, overwrite=overwrite))
+
+
+def listdir(path: Union[BasePath, str]) -> List[BasePath]:
+    """Blocking version of :func:`boostedblob.listdir`."""
+
+    async def collect(executor: BoostExecutor) -> List[BasePath]:
+        return [p async for p in _listdir(path)]
+
+    return _run(collect)
+
+
+def stat(path: Union[BasePath, str]) -> Stat:
+    """Blocking version of :func:`boostedblob.stat`."""
+    return _run(lambda executor: _stat(path))
+
+
+def iterate(fn: IterableFactory[T]) -> Iterator[T]:
+    """Iterate over something produced on the background event loop.
+
+    For instance, ``iterate(lambda e: read_stream(path, e))`` or
+    ``iterate(lambda e: e.map_unordered(fn, items))``.
+
+    :param fn: Called on the background event loop with the shared executor. Should return a
+        Boostable, an iterator, an async iterable or an awaitable of one of those.
+    :return: A blocking iterator over the elements. Elements are dequeued one at a time, so
+        this is best suited to fairly coarse elements, like chunks of a file.
+
+    """
+    loop_thread = _get_loop_thread()
+    sentinel: Any = object()
+
+    async def make() -> AsyncIterator[T]:
+        it = fn(loop_thread.executor)
+        if inspect.isawaitable(it):
+            it = await it
+        if isinstance(it, (Boostable, Iterator)):
+            return iter_underlying(it)
+        assert isinstance(it, AsyncIterable)
+        return it.__aiter__()
+
+    async def anext(ait: AsyncIterator[T]) -> T:
+        try:
+            return await ait.__anext__()
+        except StopAsyncIteration:
+            return sentinel
+
+    async def aclose(ait: AsyncIterator[T]) -> None:
+        if hasattr(ait, "aclose"):
+            await ait.aclose()
+
+    ait = loop_thread.run(make())
+    try:
+        while True:
+            item = loop_thread.run(anext(ait))
+            if item is sentinel:
+                return
+            yield item
+    finally:
+        loop_thread.run(aclose(ait))
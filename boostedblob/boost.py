@@ -1,6 +1,13 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import contextvars
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import (
     Any,
     AsyncIterable,
@@ -9,6 +16,7 @@ from typing import (
     Callable,
     Collection,
     Deque,
+    Dict,
     Generic,
     Iterator,
     List,
@@ -20,6 +28,8 @@ from typing import (
     Union,
 )
 
+from . import tracing
+
 A = TypeVar("A")
 T = TypeVar("T")
 R = TypeVar("R")
@@ -30,6 +40,127 @@ async def consume(iterable: AsyncIterable[Any]) -> None:
         pass
 
 
+_current_executor: contextvars.ContextVar[Optional[BoostExecutor]] = contextvars.ContextVar(
+    "current_executor", default=None
+)
+# The task that holds a unit of the current executor's concurrency. Tasks inherit the context of
+# the task that created them, so we need this to know if the current task is the one holding a unit.
+_unit_holder: contextvars.ContextVar[Optional[asyncio.Task[Any]]] = contextvars.ContextVar(
+    "unit_holder", default=None
+)
+
+
+def default_weight(item: Any) -> int:
+    """Estimate how many bytes of memory an item holds on to, for the purposes of backpressure."""
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return len(item)
+    if isinstance(item, tuple):
+        return sum(default_weight(x) for x in item)
+    return 0
+
+
+@dataclass(frozen=True)
+class BoostableStats:
+    name: str
+    priority: int
+    # Number of elements the boostable has started and finished computing
+    started: int
+    finished: int
+    # Number of elements buffered, including those still being computed
+    queue_depth: int
+    # Total time the boostable has spent unable to make use of boosts offered to it, either because
+    # it's applying backpressure or because its underlying has nothing ready
+    not_ready_time: float
+
+
+@dataclass(frozen=True)
+class ExecutorStats:
+    elapsed: float
+    concurrency: int
+    limit: int
+    active: int
+    # Average fraction of our units of concurrency in use over the executor's lifetime. Doesn't
+    # count the unit of concurrency donated by our foreground
+    utilization: float
+    started: int
+    finished: int
+    # Tasks finished per second over the executor's lifetime
+    throughput: float
+    buffered_bytes: int
+    # Stats for the boostables the executor is currently boosting
+    boostables: List[BoostableStats]
+
+
+def current_executor() -> Optional[BoostExecutor]:
+    """Return the executor running the current task, if any.
+
+    This lets the request layer report back to the executor that's driving it.
+
+    """
+    return _current_executor.get()
+
+
+class ConcurrencyPool:
+    """A budget of concurrency shared by several BoostExecutors.
+
+    Each executor still has its own limit, but tasks started by an executor's runner must also
+    borrow a unit from the pool. This way, the total number of tasks running across all executors
+    using the pool is roughly bounded by the pool's size, even if each executor is created
+    independently.
+
+    To preserve our reentrancy guarantees (see BoostExecutor.__init__), tasks started on behalf of
+    an executor's foreground don't borrow from the pool. So the bound is loose by one unit for each
+    executor whose boostables are being iterated over. Similarly, executors that are shutting down
+    don't borrow from the pool, since whoever holds the pool's units may be waiting on them.
+
+    """
+
+    def __init__(self, size: int) -> None:
+        assert size > 0
+        self.size = size
+        self.in_use = 0
+        # Executors whose runners are waiting for a unit to become available
+        self.waiters: Set[BoostExecutor] = set()
+
+    def try_acquire(self, executor: BoostExecutor) -> bool:
+        """Borrow a unit if one is available, otherwise notify ``executor`` when one might be."""
+        if self.in_use < self.size:
+            self.in_use += 1
+            return True
+        self.waiters.add(executor)
+        return False
+
+    def release(self) -> None:
+        self.in_use -= 1
+        # Wake everyone, rather than trying to pick who gets the unit. Runners that miss out will
+        # just wait again.
+        waiters, self.waiters = self.waiters, set()
+        for executor in waiters:
+            executor.notify_runner()
+
+
+_default_pool: Optional[ConcurrencyPool] = None
+
+
+def set_default_pool(pool: Optional[ConcurrencyPool]) -> None:
+    """Set the pool used by BoostExecutors that aren't explicitly given one."""
+    global _default_pool
+    _default_pool = pool
+
+
+async def run_threaded(func: Callable[..., R], *args: Any) -> R:
+    """Run a blocking function in the thread pool of the current executor.
+
+    Falls back to the event loop's default thread pool if we're not running on an executor.
+
+    """
+    executor = current_executor()
+    if executor is not None:
+        return await executor.run_threaded(func, *args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+
 class BoostExecutor:
     """BoostExecutor implements a concurrent.futures-like interface for running async tasks.
 
@@ -53,9 +184,52 @@ class BoostExecutor:
     That is, using ``BoostExecutor(1)`` would make the above example function approximately similar
     to the serial code.
 
+    If ``adaptive`` is True, the number supplied is instead treated as a maximum, and the executor
+    will grow and shrink the concurrency it actually uses based on how the storage service is
+    coping. See AdaptiveConcurrency for details.
+
+    Requests made by tasks running on the executor are also subject to per-partition limits, where
+    a partition is a storage account (e.g. "az://account"), a bucket (e.g. "gs://bucket") or
+    otherwise a hostname. ``partition_concurrency`` sets a default limit for every partition, and
+    ``set_partition_limit`` sets the limit for a specific partition. These are sub-limits of the
+    overall concurrency; a task waiting on a busy partition gives back its unit of concurrency
+    while it waits, so the executor can keep scheduling work for other partitions.
+
+    Boostables apply backpressure when they have many results buffered. If ``memory_budget`` is
+    specified, boostables will also apply backpressure when the total size of buffered and
+    in-flight items across the executor exceeds that many bytes. The size of an item is determined
+    by the ``weight`` function passed when creating a boostable, which defaults to the total length
+    of any bytes it contains.
+
+    If ``pool`` is specified, or a default pool has been set using ``set_default_pool``, the
+    executor borrows concurrency from a ConcurrencyPool shared with other executors, so a process
+    can bound its total concurrency.
+
+    Blocking work, like file I/O or hashing, can be run in a thread pool of at most
+    ``thread_concurrency`` threads using ``run_threaded`` or ``map_threaded``. Note that tasks
+    started by ``map_threaded`` also hold a unit of the executor's concurrency while they run.
+
+    ``max_rps`` and ``bwlimit`` limit the number of requests per second and the number of bytes per
+    second transferred by requests made by tasks running on the executor. ``set_host_rate_limit``
+    additionally limits requests to a specific host. See RateLimiter for details.
+
+    Call ``stats`` for a snapshot of what the executor is doing. If ``stats_interval`` is
+    specified, the executor will also print this to stderr every that many seconds.
+
     """
 
-    def __init__(self, concurrency: int) -> None:
+    def __init__(
+        self,
+        concurrency: int,
+        adaptive: bool = False,
+        partition_concurrency: Optional[int] = None,
+        memory_budget: Optional[int] = None,
+        stats_interval: Optional[float] = None,
+        thread_concurrency: Optional[int] = None,
+        max_rps: Optional[float] = None,
+        bwlimit: Optional[float] = None,
+        pool: Optional[ConcurrencyPool] = None,
+    ) -> None:
         assert concurrency > 0
         self.concurrency = concurrency
         # Okay, so this is a little tricky. We take away one unit of concurrency now, and give it
@@ -76,126 +250,445 @@ class BoostExecutor:
         # that would have to be something complicated and would have to use contextvars.
         self.semaphore = asyncio.Semaphore(concurrency - 1)
         self.boostables: Deque[Boostable[Any]] = Deque()
+        # If any boostable has a priority, we use stride scheduling instead of round robin to decide
+        # which boostable gets a boost. See find_boost.
+        self.prioritised = False
+        self.vtime = 0.0
+
+        # The semaphore is what keeps us safe from deadlocks, but we can further restrict how much
+        # concurrency we use by only giving out boosts while fewer than ``limit`` units of
+        # concurrency are active. Note this is a soft limit: tasks started by our foreground aren't
+        # held back by it.
+        self.limit = concurrency
+        self.active = 0
+        self.adaptive = AdaptiveConcurrency(self) if adaptive else None
+        self.pool = pool if pool is not None else _default_pool
+
+        self.partition_concurrency = partition_concurrency
+        self.partition_limits: Dict[str, int] = {}
+        self.partitions: Dict[str, asyncio.Semaphore] = {}
+
+        self.memory_budget = memory_budget
+        self.buffered_bytes = 0
+
+        self.request_limiter = RateLimiter(max_rps) if max_rps is not None else None
+        self.byte_limiter = RateLimiter(bwlimit) if bwlimit is not None else None
+        self.host_request_limiters: Dict[str, RateLimiter] = {}
+        self.host_byte_limiters: Dict[str, RateLimiter] = {}
+
+        # Same default as concurrent.futures.ThreadPoolExecutor
+        self.thread_concurrency = thread_concurrency or min(32, (os.cpu_count() or 1) + 4)
+        self.thread_pool: Optional[ThreadPoolExecutor] = None
+
+        # Counters for stats. We keep track of the integral of active over time, so that we can
+        # compute utilization without sampling
+        self.start_time = time.monotonic()
+        self.started = 0
+        self.finished = 0
+        self.busy_time = 0.0
+        self.last_active_change = self.start_time
+        self.stats_interval = stats_interval
+        self.reporter: Optional[asyncio.Task[None]] = None
 
         self.waiter: Optional[asyncio.Future[None]] = None
         self.runner: Optional[asyncio.Task[None]] = None
         self.shutdown: bool = False
+        # Tasks the runner has started and already acquired a unit of concurrency for
+        self.handoffs: Set[asyncio.Task[Any]] = set()
+        # Tasks the runner has started that hold a unit borrowed from our pool
+        self.borrowed: Set[asyncio.Task[Any]] = set()
 
     async def __aenter__(self) -> BoostExecutor:
+        self.start_time = self.last_active_change = time.monotonic()
         self.runner = asyncio.create_task(self.run())
+        if self.adaptive is not None:
+            self.adaptive.start()
+        if self.stats_interval is not None:
+            self.reporter = asyncio.create_task(self.report_stats(self.stats_interval))
         return self
 
     async def __aexit__(
         self, exc_type: Optional[Type[BaseException]], exc_value: Any, traceback: Any
     ) -> None:
         self.shutdown = True
+        if self.adaptive is not None:
+            self.adaptive.stop()
+        if self.reporter is not None:
+            self.reporter.cancel()
+            self.reporter = None
         if exc_type:
             # If there was an exception, let it propagate and don't block on the runner exiting.
             # Also cancel the runner.
             assert self.runner is not None
             self.runner.cancel()
+            self.shutdown_thread_pool()
             return
         self.notify_runner()
         assert self.runner is not None
         await self.runner
+        self.shutdown_thread_pool()
 
-    def eagerise(self, iterator: AsyncIterator[T]) -> EageriseBoostable[T]:
-        ret = EageriseBoostable(iterator, self)
-        self.boostables.appendleft(ret)
-        self.notify_runner()
+    def eagerise(
+        self, iterator: AsyncIterator[T], weight: Optional[Callable[[T], int]] = None
+    ) -> EageriseBoostable[T]:
+        ret = EageriseBoostable(iterator, self, weight=weight)
+        self.add_boostable(ret)
         return ret
 
     def map_ordered(
-        self, func: Callable[[A], Awaitable[T]], iterable: BoostUnderlying[A]
+        self,
+        func: Callable[[A], Awaitable[T]],
+        iterable: BoostUnderlying[A],
+        weight: Optional[Callable[[Any], int]] = None,
+        priority: int = 0,
     ) -> OrderedMappingBoostable[A, T]:
-        ret = OrderedMappingBoostable(func, iterable, self)
-        self.boostables.appendleft(ret)
-        self.notify_runner()
+        ret = OrderedMappingBoostable(func, iterable, self, weight=weight, priority=priority)
+        self.add_boostable(ret)
         return ret
 
     def map_unordered(
-        self, func: Callable[[A], Awaitable[T]], iterable: BoostUnderlying[A]
+        self,
+        func: Callable[[A], Awaitable[T]],
+        iterable: BoostUnderlying[A],
+        weight: Optional[Callable[[Any], int]] = None,
+        priority: int = 0,
     ) -> UnorderedMappingBoostable[A, T]:
-        ret = UnorderedMappingBoostable(func, iterable, self)
-        self.boostables.appendleft(ret)
-        self.notify_runner()
+        ret = UnorderedMappingBoostable(func, iterable, self, weight=weight, priority=priority)
+        self.add_boostable(ret)
+        return ret
+
+    def map_threaded(
+        self,
+        func: Callable[[A], T],
+        iterable: BoostUnderlying[A],
+        ordered: bool = True,
+        weight: Optional[Callable[[Any], int]] = None,
+        priority: int = 0,
+    ) -> MappingBoostable[A, T]:
+        """Like map_ordered or map_unordered, but for a blocking function.
+
+        Calls to ``func`` are run in the executor's thread pool.
+
+        """
+
+        async def run(arg: A) -> T:
+            return await self.run_threaded(func, arg)
+
+        ret: MappingBoostable[A, T]
+        if ordered:
+            ret = self.map_ordered(run, iterable, weight=weight, priority=priority)
+        else:
+            ret = self.map_unordered(run, iterable, weight=weight, priority=priority)
+        ret.name = f"{type(ret).__name__}({getattr(func, '__qualname__', repr(func))})"
         return ret
 
+    def shutdown_thread_pool(self) -> None:
+        if self.thread_pool is not None:
+            # Don't block the event loop joining threads. If someone uses us after we've exited,
+            # they'll just get a new thread pool.
+            self.thread_pool.shutdown(wait=False)
+            self.thread_pool = None
+
+    async def run_threaded(self, func: Callable[..., R], *args: Any) -> R:
+        """Run a blocking function in the executor's thread pool."""
+        if self.thread_pool is None:
+            self.thread_pool = ThreadPoolExecutor(
+                max_workers=self.thread_concurrency, thread_name_prefix="boostedblob"
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_pool, func, *args)
+
     def enumerate(self, iterable: BoostUnderlying[T]) -> EnumerateBoostable[T]:
         ret = EnumerateBoostable(iterable, self)
-        self.boostables.appendleft(ret)
-        self.notify_runner()
+        self.add_boostable(ret)
         return ret
 
     def filter(
         self, filter_fn: Optional[Callable[[T], bool]], iterable: BoostUnderlying[T]
     ) -> FilterBoostable[T]:
         ret = FilterBoostable(filter_fn, iterable, self)
-        self.boostables.appendleft(ret)
-        self.notify_runner()
+        self.add_boostable(ret)
         return ret
 
+    def batch(
+        self, iterable: BoostUnderlying[T], max_items: int, max_delay: float
+    ) -> BatchBoostable[T]:
+        ret = BatchBoostable(iterable, self, max_items=max_items, max_delay=max_delay)
+        self.add_boostable(ret)
+        return ret
+
+    def add_boostable(self, boostable: Boostable[Any]) -> None:
+        # Don't let new boostables make up for time they weren't around for
+        boostable.vtime = self.vtime
+        if boostable.priority != 0:
+            self.prioritised = True
+        self.boostables.appendleft(boostable)
+        self.notify_runner()
+
     def notify_runner(self) -> None:
         if self.waiter and not self.waiter.done():
             self.waiter.set_result(None)
 
-    async def run(self) -> None:
+    def update_busy_time(self) -> None:
+        now = time.monotonic()
+        self.busy_time += self.active * (now - self.last_active_change)
+        self.last_active_change = now
+
+    def task_started(self) -> None:
+        """Called when a task acquires a unit of concurrency."""
+        self.update_busy_time()
+        self.active += 1
+        self.trace_active()
+
+    def task_finished(self) -> None:
+        """Called when a task gives back its unit of concurrency."""
+        self.update_busy_time()
+        self.active -= 1
+        self.trace_active()
+        if self.active == self.limit - 1:
+            # we may have been holding back boosts because we were at our limit
+            self.notify_runner()
+
+    def trace_active(self) -> None:
+        tracer = tracing.current_tracer()
+        if tracer is not None:
+            tracer.counter(
+                f"executor {id(self):x} concurrency", {"active": self.active, "limit": self.limit}
+            )
+
+    def set_limit(self, limit: int) -> None:
+        """Change the number of units of concurrency we'll make use of."""
+        self.limit = max(1, min(self.concurrency, limit))
+        self.notify_runner()
+
+    def set_partition_limit(self, key: str, limit: int) -> None:
+        """Limit the number of concurrent requests to the partition ``key``.
+
+        Takes effect for requests that haven't yet started waiting on the partition.
+
+        """
+        assert limit > 0
+        self.partition_limits[key] = limit
+        self.partitions.pop(key, None)
+
+    def over_memory_budget(self) -> bool:
+        return self.memory_budget is not None and self.buffered_bytes >= self.memory_budget
+
+    def set_host_rate_limit(
+        self, host: str, max_rps: Optional[float] = None, bwlimit: Optional[float] = None
+    ) -> None:
+        """Limit requests per second and bytes per second transferred to and from ``host``."""
+        if max_rps is not None:
+            self.host_request_limiters[host] = RateLimiter(max_rps)
+        if bwlimit is not None:
+            self.host_byte_limiters[host] = RateLimiter(bwlimit)
+
+    def has_rate_limits(self) -> bool:
+        return (
+            self.request_limiter is not None
+            or self.byte_limiter is not None
+            or bool(self.host_request_limiters)
+            or bool(self.host_byte_limiters)
+        )
+
+    async def rate_limit(self, host: Optional[str], requests: int = 0, nbytes: int = 0) -> None:
+        """Wait until we're allowed to make ``requests`` requests transferring ``nbytes`` bytes."""
+        limiters: List[Tuple[Optional[RateLimiter], int]] = [
+            (self.request_limiter, requests),
+            (self.byte_limiter, nbytes),
+        ]
+        if host is not None:
+            limiters.append((self.host_request_limiters.get(host), requests))
+            limiters.append((self.host_byte_limiters.get(host), nbytes))
+        # Make all reservations before waiting, so that waits on different limiters overlap
+        delay = max((lim.reserve(n) for lim, n in limiters if lim is not None and n), default=0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def has_partitions(self) -> bool:
+        return self.partition_concurrency is not None or bool(self.partition_limits)
+
+    @contextlib.asynccontextmanager
+    async def partition(self, key: str) -> AsyncIterator[None]:
+        """Hold a unit of the partition ``key``'s concurrency."""
+        semaphore = self.partitions.get(key)
+        if semaphore is None:
+            limit = self.partition_limits.get(key, self.partition_concurrency)
+            if limit is None:
+                yield
+                return
+            semaphore = self.partitions[key] = asyncio.Semaphore(limit)
+
+        if semaphore.locked() and _unit_holder.get() is asyncio.current_task():
+            # Don't tie up a unit of our overall concurrency while we wait on a busy partition
+            self.semaphore.release()
+            self.task_finished()
+            try:
+                await semaphore.acquire()
+            finally:
+                await self.semaphore.acquire()
+                self.task_started()
+        else:
+            await semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def stats(self) -> ExecutorStats:
+        """Return a snapshot of what the executor is doing.
+
+        This is cheap; the executor only maintains counters, so it's fine to call this often.
+
+        """
+        self.update_busy_time()
+        elapsed = time.monotonic() - self.start_time
+        return ExecutorStats(
+            elapsed=elapsed,
+            concurrency=self.concurrency,
+            limit=self.limit,
+            active=self.active,
+            utilization=self.busy_time / (elapsed * self.concurrency) if elapsed else 0.0,
+            started=self.started,
+            finished=self.finished,
+            throughput=self.finished / elapsed if elapsed else 0.0,
+            buffered_bytes=self.buffered_bytes,
+            boostables=[boostable.stats() for boostable in self.boostables],
+        )
+
+    async def report_stats(self, interval: float) -> None:
+        last_finished = 0
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.stats()
+            print(
+                f"[boostedblob] {stats.active}/{stats.limit} active, "
+                f"{stats.utilization:.0%} utilization, "
+                f"{(stats.finished - last_finished) / interval:.1f} tasks/s, "
+                f"{stats.buffered_bytes / 2**20:.1f} MiB buffered",
+                file=sys.stderr,
+            )
+            for b in stats.boostables:
+                print(
+                    f"[boostedblob]   {b.name}: {b.queue_depth} queued, "
+                    f"{b.started - b.finished} in flight, {b.finished} finished, "
+                    f"{b.not_ready_time:.1f}s not ready",
+                    file=sys.stderr,
+                )
+            last_finished = stats.finished
+
+    async def wait_for_notification(self) -> None:
         loop = asyncio.get_running_loop()
-        exhausted_boostables: List[Boostable[Any]] = []
-        not_ready_boostables: Deque[Boostable[Any]] = Deque()
+        self.waiter = loop.create_future()
+        await self.waiter
+        self.waiter = None
+
+    def take_handoff(self, task: Optional[asyncio.Task[Any]]) -> bool:
+        """Returns True if the runner handed ``task`` a unit of concurrency when starting it."""
+        if task in self.handoffs:
+            self.handoffs.remove(task)
+            return True
+        return False
+
+    def return_borrowed(self, task: Optional[asyncio.Task[Any]]) -> None:
+        """Give back the unit ``task`` borrowed from our pool, if any."""
+        if task in self.borrowed:
+            self.borrowed.remove(task)
+            assert self.pool is not None
+            self.pool.release()
+
+    def find_boost(self, exhausted_boostables: List[Boostable[Any]]) -> Optional[asyncio.Task[Any]]:
+        if self.prioritised:
+            return self.find_prioritised_boost(exhausted_boostables)
+        # We round robin the boostables until one of them makes use of a boost, or they're all
+        # either exhausted or not ready
+        for _ in range(len(self.boostables)):
+            boostable = self.boostables[0]
+            task = boostable.provide_boost()
+            boostable.record_ready(not isinstance(task, NotReady))
+            if isinstance(task, NotReady):
+                self.boostables.rotate(-1)
+                continue
+            if isinstance(task, Exhausted):
+                exhausted_boostables.append(self.boostables.popleft())
+                continue
+            self.boostables.rotate(-1)
+            assert isinstance(task, asyncio.Task)
+            return task
+        return None
+
+    def find_prioritised_boost(
+        self, exhausted_boostables: List[Boostable[Any]]
+    ) -> Optional[asyncio.Task[Any]]:
+        # This is stride scheduling. Each boostable has a virtual time, which advances by
+        # 2 ** -priority every time it gets a boost, and we offer boosts in order of virtual time.
+        # So when several boostables can make use of boosts, a boostable with priority p gets 2 ** p
+        # boosts for every boost a boostable with priority 0 gets. This protects low priority
+        # boostables from starvation. Boostables that aren't ready don't accumulate credit, so they
+        # can't hog boosts once they become ready.
+        for boostable in sorted(self.boostables, key=lambda b: b.vtime):
+            task = boostable.provide_boost()
+            boostable.record_ready(not isinstance(task, NotReady))
+            if isinstance(task, NotReady):
+                boostable.vtime = max(boostable.vtime, self.vtime)
+                continue
+            if isinstance(task, Exhausted):
+                self.boostables.remove(boostable)
+                exhausted_boostables.append(boostable)
+                continue
+            self.vtime = boostable.vtime
+            boostable.vtime += 2.0**-boostable.priority
+            assert isinstance(task, asyncio.Task)
+            return task
+        return None
 
-        MIN_TIMEOUT = 0.01
-        MAX_TIMEOUT = 0.1
-        timeout = MIN_TIMEOUT
+    async def run(self) -> None:
+        exhausted_boostables: List[Boostable[Any]] = []
 
         if self.concurrency == 1:
             return
 
+        # Note that this loop never polls. Whenever it waits, something is guaranteed to wake it
+        # up when it could make progress: either a unit of concurrency being released, or a call
+        # to notify_runner. Boostables that return NotReady must call notify_runner when they may
+        # be able to make use of a boost.
         while True:
-            await self.semaphore.acquire()
-            self.semaphore.release()
-
-            while self.boostables:
-                # We round robin the boostables until they're either all exhausted or not ready
-                task = self.boostables[0].provide_boost()
-                if isinstance(task, NotReady):
-                    not_ready_boostables.append(self.boostables.popleft())
-                    continue
-                if isinstance(task, Exhausted):
-                    exhausted_boostables.append(self.boostables.popleft())
-                    continue
-                assert isinstance(task, asyncio.Task)
-
-                await asyncio.sleep(0)
-                self.boostables.rotate(-1)
-                if self.semaphore.locked():
-                    break
-            else:
-                self.boostables = not_ready_boostables
-                not_ready_boostables = Deque()
+            if self.active >= self.limit:
+                # We're using as much concurrency as we're currently allowed, so wait until a task
+                # finishes or our limit is raised
+                await self.wait_for_notification()
+                continue
 
-            if self.semaphore.locked():
-                # If we broke out of the inner loop due to a lack of available concurrency, go to
-                # the top of the outer loop and wait for concurrency
+            await self.semaphore.acquire()
+            # Borrow a unit from our pool, if we have one. If we're shutting down, we don't, since
+            # whoever holds the pool's units may be waiting on us to finish.
+            pool = self.pool if not self.shutdown else None
+            if pool is not None and not pool.try_acquire(self):
+                # The pool will notify us when a unit is released. Don't hold on to our own unit in
+                # the meantime, since our foreground may need it to make progress.
+                self.semaphore.release()
+                await self.wait_for_notification()
+                continue
+            task = self.find_boost(exhausted_boostables)
+            if task is not None:
+                # Hand the unit of concurrency we just acquired over to the task. This way we know
+                # exactly how much concurrency we have left without having to wait for the task to
+                # start running and acquire it itself.
+                self.handoffs.add(task)
+                if pool is not None:
+                    self.borrowed.add(task)
+                self.task_started()
                 continue
+            self.semaphore.release()
+            if pool is not None:
+                pool.release()
 
             if self.shutdown and not self.boostables:
                 # If we've been told to shutdown and we have nothing more to boost, exit
                 break
 
-            self.waiter = loop.create_future()
-            try:
-                # If we still have boostables (because they're currently not ready), timeout in
-                # case they become ready
-                # Otherwise, (since we have available concurrency), wait for us to be notified in
-                # case of more work
-                await asyncio.wait_for(self.waiter, timeout if self.boostables else None)
-                # If we were waiting for boostables to become ready, increase how long we'd wait
-                # the next time. Otherwise, reset the timeout duration.
-                timeout = min(MAX_TIMEOUT, timeout * 2) if self.boostables else MIN_TIMEOUT
-            except asyncio.TimeoutError:
-                pass
-            self.waiter = None
+            # Wait to be notified of more work or of boostables becoming ready
+            await self.wait_for_notification()
 
         # It's somewhat unintuitive that we can shutdown an executor while Boostables are still
         # being iterated over. So wait for them to finish as a courtesy (but not a guarantee).
@@ -207,6 +700,156 @@ class BoostExecutor:
         await asyncio.sleep(0)
 
 
+class AdaptiveConcurrency:
+    """Grows and shrinks the concurrency a BoostExecutor makes use of at runtime.
+
+    This is additive increase / multiplicative decrease (AIMD), as used by TCP congestion control.
+    The request layer reports every request it makes to the executor running it. Every ``interval``
+    seconds we look at the requests made since we last checked:
+    - if any were throttled (e.g., HTTP 429 or 503), we multiplicatively decrease the limit
+    - if request latency has inflated well beyond the best we've seen, we also decrease the limit,
+      since requests are likely queueing somewhere
+    - if the last increase made throughput worse, we undo it
+    - otherwise, we increase the limit. Until we first see signs of congestion, we double the limit
+      ("slow start"), after which we increase it additively
+
+    """
+
+    def __init__(
+        self,
+        executor: BoostExecutor,
+        minimum: int = 1,
+        initial: int = 16,
+        interval: float = 1.0,
+        increase: int = 4,
+        decrease_factor: float = 0.7,
+        latency_tolerance: float = 3.0,
+        report: bool = False,
+    ) -> None:
+        self.executor = executor
+        self.minimum = max(1, min(minimum, executor.concurrency))
+        self.initial = max(self.minimum, min(initial, executor.concurrency))
+        self.interval = interval
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.report = report
+
+        self.slow_start = True
+        self.best_latency: Optional[float] = None
+        self.last_throughput: Optional[float] = None
+        self.last_increase = 0
+
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        self.window_throttled = 0
+        self.window_latency = 0.0
+
+        self.history: List[Tuple[float, int]] = []
+        self.controller: Optional[asyncio.Task[None]] = None
+
+    def start(self) -> None:
+        self.update_limit(self.initial)
+        self.window_start = time.monotonic()
+        self.controller = asyncio.create_task(self.control())
+
+    def stop(self) -> None:
+        if self.controller is not None:
+            self.controller.cancel()
+            self.controller = None
+
+    def record_request(self, latency: float, throttled: bool) -> None:
+        """Called by the request layer for each request made on behalf of the executor."""
+        self.window_requests += 1
+        self.window_latency += latency
+        if throttled:
+            self.window_throttled += 1
+
+    def next_limit(self, elapsed: float) -> int:
+        """Decide the new limit, based on what happened in the last window of requests."""
+        limit = self.executor.limit
+        requests = self.window_requests
+        throttled = self.window_throttled
+        latency = self.window_latency / requests if requests else 0.0
+        self.window_requests = 0
+        self.window_throttled = 0
+        self.window_latency = 0.0
+
+        last_increase = self.last_increase
+        self.last_increase = 0
+        if throttled:
+            self.slow_start = False
+            return int(limit * self.decrease_factor)
+        if not requests:
+            # no signal, so leave things as they are
+            return limit
+
+        throughput = requests / elapsed
+        last_throughput = self.last_throughput
+        self.last_throughput = throughput
+        if self.best_latency is None or latency < self.best_latency:
+            self.best_latency = latency
+        if latency > self.latency_tolerance * self.best_latency:
+            self.slow_start = False
+            return int(limit * self.decrease_factor)
+        if last_increase and last_throughput is not None and throughput < 0.9 * last_throughput:
+            # using more concurrency didn't help, so give it back
+            self.slow_start = False
+            return limit - last_increase
+
+        self.last_increase = limit if self.slow_start else self.increase
+        return limit + self.last_increase
+
+    def update_limit(self, limit: int) -> None:
+        previous = self.executor.limit
+        self.executor.set_limit(max(self.minimum, limit))
+        limit = self.executor.limit
+        self.last_increase = max(0, min(self.last_increase, limit - previous))
+        if not self.history or limit != previous:
+            self.history.append((time.monotonic(), limit))
+            if self.report:
+                print(f"[boostedblob] Concurrency limit: {limit}", file=sys.stderr)
+
+    async def control(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.update_limit(self.next_limit(now - self.window_start))
+            self.window_start = now
+
+
+class RateLimiter:
+    """A token bucket, limiting some quantity to ``rate`` per second on average.
+
+    Up to ``burst`` (by default, one second's worth) can be used at once after a quiet period.
+
+    Rather than tracking tokens and waking up waiters, each use reserves its share of the rate
+    ahead of time and sleeps until its reservation is due (this is sometimes called the generic
+    cell rate algorithm). This is cheap and first come first served. A single use of more than
+    ``burst`` is allowed, the cost is borne by whoever comes next.
+
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        assert rate > 0
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        # The time at which the bucket would be full again, given the reservations made so far
+        self.full_at = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """Reserve ``amount`` and return how long to wait before using it."""
+        now = time.monotonic()
+        full_at = max(self.full_at, now)
+        self.full_at = full_at + amount / self.rate
+        return full_at - now - self.burst / self.rate
+
+    async def acquire(self, amount: float = 1) -> None:
+        delay = self.reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
 class Exhausted:
     pass
 
@@ -229,13 +872,46 @@ class Boostable(Generic[T]):
 
     """
 
-    def __init__(self, executor: BoostExecutor) -> None:
+    def __init__(self, executor: BoostExecutor, priority: int = 0) -> None:
         self.executor = executor
+        self.priority = priority
+        self.vtime = 0.0
+        self.name = type(self).__name__
+        self.started = 0
+        self.finished = 0
+        self.not_ready_time = 0.0
+        self.not_ready_since: Optional[float] = None
+
+    def queue_depth(self) -> int:
+        return 0
+
+    def record_ready(self, ready: bool) -> None:
+        """Keep track of how long we spend not ready to make use of boosts."""
+        if not ready:
+            if self.not_ready_since is None:
+                self.not_ready_since = time.monotonic()
+        elif self.not_ready_since is not None:
+            self.not_ready_time += time.monotonic() - self.not_ready_since
+            self.not_ready_since = None
+
+    def stats(self) -> BoostableStats:
+        not_ready_time = self.not_ready_time
+        if self.not_ready_since is not None:
+            not_ready_time += time.monotonic() - self.not_ready_since
+        return BoostableStats(
+            name=self.name,
+            priority=self.priority,
+            started=self.started,
+            finished=self.finished,
+            queue_depth=self.queue_depth(),
+            not_ready_time=not_ready_time,
+        )
 
     def provide_boost(self) -> Union[NotReady, Exhausted, asyncio.Task[Any]]:
         """Start an asyncio task to help speed up this boostable.
 
-        Returns NotReady if we can't make use of a boost currently.
+        Returns NotReady if we can't make use of a boost currently. In this case, the Boostable must
+        call ``executor.notify_runner`` when it may be able to make use of a boost again.
         Returns Exhausted if we're done. This causes the BoostExecutor to stop attempting to provide
         boosts to this Boostable.
 
@@ -302,6 +978,10 @@ class MappingBoostable(Boostable[T], Generic[A, T]):
     Note that both kinds of MappingBoostables will, of course, dequeue from the underlying iterable
     in whatever order the underlying provides. This means we'll start tasks in order (but not
     necessarily finish them in order, which is kind of the point).
+
+    If the executor has a memory budget, the weight of an in-flight task is the weight of its
+    argument plus an estimate of the weight of its result (the weight of the last result we saw).
+    Once the task finishes, its weight is the weight of its result, until it's dequeued.
     """
 
     buffer: Collection[Awaitable[T]]
@@ -311,15 +991,49 @@ class MappingBoostable(Boostable[T], Generic[A, T]):
         func: Callable[[A], Awaitable[T]],
         iterable: BoostUnderlying[A],
         executor: BoostExecutor,
+        weight: Optional[Callable[[Any], int]] = None,
+        priority: int = 0,
     ) -> None:
-        super().__init__(executor)
+        super().__init__(executor, priority=priority)
 
         if not isinstance(iterable, (Iterator, Boostable)):
             raise ValueError("Underlying iterable must be an Iterator or Boostable")
 
+        self.name = f"{type(self).__name__}({getattr(func, '__qualname__', repr(func))})"
+        self.weight = weight or default_weight
+        self.weight_estimate = 0
+
         async def wrapper(arg: A) -> T:
-            async with self.executor.semaphore:
-                return await func(arg)
+            executor = self.executor
+            task = asyncio.current_task()
+            _current_executor.set(executor)
+            _unit_holder.set(task)
+            charge = 0
+            if executor.memory_budget is not None:
+                charge = self.weight(arg) + self.weight_estimate
+                executor.buffered_bytes += charge
+            if not executor.take_handoff(task):
+                await executor.semaphore.acquire()
+                executor.task_started()
+            tracer = tracing.current_tracer()
+            span = tracer.begin("tasks") if tracer is not None else None
+            try:
+                ret = await func(arg)
+            except BaseException:
+                executor.buffered_bytes -= charge
+                raise
+            finally:
+                if tracer is not None and span is not None:
+                    tracer.end("tasks", self.name, *span)
+                executor.semaphore.release()
+                executor.task_finished()
+                executor.return_borrowed(task)
+                executor.finished += 1
+                self.finished += 1
+            if executor.memory_budget is not None:
+                self.weight_estimate = self.weight(ret)
+                executor.buffered_bytes += self.weight_estimate - charge
+            return ret
 
         self.func = wrapper
         self.iterable = iterable
@@ -328,8 +1042,13 @@ class MappingBoostable(Boostable[T], Generic[A, T]):
         if self.buffer:
             await asyncio.wait(self.buffer)
 
+    def queue_depth(self) -> int:
+        return len(self.buffer)
+
     def provide_boost(self) -> Union[NotReady, Exhausted, asyncio.Task[Any]]:
-        if not self.executor.shutdown and len(self.buffer) > 2 * self.executor.concurrency:
+        if not self.executor.shutdown and (
+            len(self.buffer) > 2 * self.executor.concurrency or self.executor.over_memory_budget()
+        ):
             # if we have a lot of stuff ready to go, apply backpressure by not accepting the boost
             # the main effect of this is to reduce memory usage
             # always accept boosts if the executor is shutting down to prevent hangs on misuse
@@ -351,6 +1070,12 @@ class MappingBoostable(Boostable[T], Generic[A, T]):
         """Start and return an asyncio task based on an element from the underlying."""
         raise NotImplementedError
 
+    def release_weight(self, result: T) -> T:
+        """Stop counting the weight of a result against the memory budget once it's dequeued."""
+        if self.executor.memory_budget is not None:
+            self.executor.buffered_bytes -= self.weight(result)
+        return result
+
 
 class OrderedMappingBoostable(MappingBoostable[A, T]):
     def __init__(
@@ -358,20 +1083,29 @@ class OrderedMappingBoostable(MappingBoostable[A, T]):
         func: Callable[[A], Awaitable[T]],
         iterable: BoostUnderlying[A],
         executor: BoostExecutor,
+        weight: Optional[Callable[[Any], int]] = None,
+        priority: int = 0,
     ) -> None:
-        super().__init__(func, iterable, executor)
+        super().__init__(func, iterable, executor, weight=weight, priority=priority)
         self.buffer: Deque[asyncio.Task[T]] = Deque()
 
+    def done_callback(self, task: asyncio.Task[T]) -> None:
+        self.executor.notify_runner()
+
     def enqueue(self, arg: A) -> asyncio.Task[T]:
+        self.started += 1
+        self.executor.started += 1
         task = asyncio.create_task(self.func(arg))
         self.buffer.append(task)
+        task.add_done_callback(self.done_callback)
         return task
 
     def dequeue(self) -> Union[NotReady, T]:
         if not self.buffer or not self.buffer[0].done():
             return NotReady()
         task = self.buffer.popleft()
-        return task.result()
+        self.executor.notify_runner()
+        return self.release_weight(task.result())
 
     async def blocking_dequeue(self) -> T:
         while True:
@@ -393,49 +1127,52 @@ class UnorderedMappingBoostable(MappingBoostable[A, T]):
         func: Callable[[A], Awaitable[T]],
         iterable: BoostUnderlying[A],
         executor: BoostExecutor,
+        weight: Optional[Callable[[Any], int]] = None,
+        priority: int = 0,
     ) -> None:
-        super().__init__(func, iterable, executor)
+        super().__init__(func, iterable, executor, weight=weight, priority=priority)
+        # buffer contains all tasks that have not yet been dequeued, while ready contains the subset
+        # of those that have finished, in order of completion. This lets us dequeue in constant time,
+        # regardless of how many tasks are outstanding.
         self.buffer: Set[asyncio.Task[T]] = set()
-        self.waiter: Optional[asyncio.Future[asyncio.Task[T]]] = None
+        self.ready: Deque[asyncio.Task[T]] = Deque()
+        self.waiter: Optional[asyncio.Future[None]] = None
 
     def done_callback(self, task: asyncio.Task[T]) -> None:
+        self.ready.append(task)
         if self.waiter and not self.waiter.done():
-            self.waiter.set_result(task)
+            self.waiter.set_result(None)
+        self.executor.notify_runner()
 
     def enqueue(self, arg: A) -> asyncio.Task[T]:
+        self.started += 1
+        self.executor.started += 1
         task = asyncio.create_task(self.func(arg))
         self.buffer.add(task)
         task.add_done_callback(self.done_callback)
         return task
 
-    def dequeue(self, hint: Optional[asyncio.Task[T]] = None) -> Union[NotReady, T]:
-        # hint is a task that we suspect is dequeuable, which allows us to skip the linear check
-        # against all outstanding tasks in the happy case.
-        if hint is not None and hint in self.buffer and hint.done():
-            task = hint
-        else:
-            try:
-                task = next(t for t in self.buffer if t.done())
-            except StopIteration:
-                return NotReady()
+    def dequeue(self) -> Union[NotReady, T]:
+        if not self.ready:
+            return NotReady()
+        task = self.ready.popleft()
         self.buffer.remove(task)
-        return task.result()
+        self.executor.notify_runner()
+        return self.release_weight(task.result())
 
     async def blocking_dequeue(self) -> T:
-        task = None
         loop = asyncio.get_running_loop()
         while True:
             if not self.buffer:
                 arg = await blocking_dequeue_underlying(self.iterable)
-                task = self.enqueue(arg)
-            ret = self.dequeue(hint=task)
+                self.enqueue(arg)
+            ret = self.dequeue()
             if not isinstance(ret, NotReady):
                 return ret
-            # note that dequeues are racy, so the task we get from self.waiter may already have been
-            # dequeued. in the happy case, however, it's probably the task we want to return, so we
-            # use it as the hint for the next dequeue.
+            # dequeues are racy, so by the time we wake up, someone else may have dequeued the task
+            # that woke us. so we loop back around instead of assuming the ready queue is non-empty.
             self.waiter = loop.create_future()
-            task = await self.waiter
+            await self.waiter
             self.waiter = None
 
 
@@ -494,10 +1231,109 @@ class EnumerateBoostable(Boostable[Tuple[int, T]]):
         return ret
 
 
+class BatchBoostable(Boostable[List[T]]):
+    """Groups elements of the underlying into lists.
+
+    A batch is ready once it has ``max_items`` elements, or ``max_delay`` seconds after we got its
+    first element, whichever comes first. This is useful for APIs that operate on many items at
+    once.
+
+    """
+
+    def __init__(
+        self, inner: BoostUnderlying[T], executor: BoostExecutor, max_items: int, max_delay: float
+    ):
+        super().__init__(executor)
+        assert max_items > 0
+        self.inner = inner
+        self.max_items = max_items
+        self.max_delay = max_delay
+
+        self.batch: List[T] = []
+        self.deadline = 0.0
+        # Wakes the runner when the current batch becomes ready due to max_delay
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # A blocking dequeue from the inner that we started but haven't used yet. We don't cancel
+        # these, since that could cancel tasks of the inner.
+        self.pending: Optional[asyncio.Future[T]] = None
+        self.exhausted = False
+
+    def provide_boost(self) -> Union[NotReady, Exhausted, asyncio.Task[Any]]:
+        if isinstance(self.inner, Boostable):
+            return self.inner.provide_boost()
+        return Exhausted()
+
+    def queue_depth(self) -> int:
+        return len(self.batch)
+
+    def add(self, item: T) -> None:
+        if not self.batch:
+            self.deadline = time.monotonic() + self.max_delay
+            loop = asyncio.get_running_loop()
+            self.timer = loop.call_at(loop.time() + self.max_delay, self.executor.notify_runner)
+        self.batch.append(item)
+
+    def fill(self) -> None:
+        """Non-blockingly dequeue as many elements from the inner as we can use."""
+        while len(self.batch) < self.max_items and not self.exhausted:
+            if self.pending is not None:
+                if not self.pending.done():
+                    return
+                pending, self.pending = self.pending, None
+                try:
+                    self.add(pending.result())
+                except StopAsyncIteration:
+                    self.exhausted = True
+                continue
+            ret = dequeue_underlying(self.inner)
+            if isinstance(ret, NotReady):
+                return
+            if isinstance(ret, Exhausted):
+                self.exhausted = True
+                return
+            self.add(ret)
+
+    def dequeue(self) -> Union[NotReady, Exhausted, List[T]]:
+        self.fill()
+        if not self.batch:
+            return Exhausted() if self.exhausted else NotReady()
+        if (
+            len(self.batch) < self.max_items
+            and not self.exhausted
+            and time.monotonic() < self.deadline
+        ):
+            return NotReady()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        ret, self.batch = self.batch, []
+        return ret
+
+    async def blocking_dequeue(self) -> List[T]:
+        while True:
+            ret = self.dequeue()
+            if isinstance(ret, Exhausted):
+                raise StopAsyncIteration
+            if not isinstance(ret, NotReady):
+                return ret
+            if self.pending is None:
+                self.pending = asyncio.ensure_future(blocking_dequeue_underlying(self.inner))
+                self.pending.add_done_callback(lambda _: self.executor.notify_runner())
+            timeout = max(0.0, self.deadline - time.monotonic()) if self.batch else None
+            await asyncio.wait([self.pending], timeout=timeout)
+
+
 class EageriseBoostable(Boostable[T]):
-    def __init__(self, iterable: AsyncIterator[T], executor: BoostExecutor) -> None:
+    def __init__(
+        self,
+        iterable: AsyncIterator[T],
+        executor: BoostExecutor,
+        weight: Optional[Callable[[T], int]] = None,
+    ) -> None:
         super().__init__(executor)
         self.iterable = iterable
+        self.name = f"{type(self).__name__}({getattr(iterable, '__qualname__', repr(iterable))})"
+        self.weight = weight or default_weight
         self.buffer: Deque[asyncio.Task[T]] = Deque()
         self.done: bool = False
 
@@ -514,6 +1350,9 @@ class EageriseBoostable(Boostable[T]):
     async def wait(self) -> None:
         await self.buffer_task
 
+    def queue_depth(self) -> int:
+        return len(self.buffer)
+
     def dequeue(self) -> Union[NotReady, Exhausted, T]:
         if not self.buffer:
             return Exhausted() if self.done else NotReady()
@@ -523,8 +1362,12 @@ class EageriseBoostable(Boostable[T]):
         if self.waiter_backpressure:
             self.waiter_backpressure.set_result(None)
             self.waiter_backpressure = None
+        self.executor.notify_runner()
 
-        return task.result()
+        ret = task.result()
+        if self.executor.memory_budget is not None:
+            self.executor.buffered_bytes -= self.weight(ret)
+        return ret
 
     async def blocking_dequeue(self) -> T:
         loop = asyncio.get_running_loop()
@@ -540,6 +1383,7 @@ class EageriseBoostable(Boostable[T]):
 
     async def eagerly_buffer(self) -> None:
         loop = asyncio.get_running_loop()
+        _current_executor.set(self.executor)
         async with self.executor.semaphore:
             # We can't use async for because we need to preserve exceptions
             it = self.iterable.__aiter__()
@@ -547,20 +1391,29 @@ class EageriseBoostable(Boostable[T]):
                 # I guess in theory, __anext__ isn't guaranteed to be a coroutine
                 # https://github.com/hauntsaninja/boostedblob/pull/12
                 task: asyncio.Task[T] = asyncio.create_task(it.__anext__())  # type: ignore [arg-type]
+                self.started += 1
                 try:
-                    await task
+                    ret = await task
+                    if self.executor.memory_budget is not None:
+                        self.executor.buffered_bytes += self.weight(ret)
                 except StopAsyncIteration:
+                    self.started -= 1
                     break
                 except Exception:
                     pass
+                self.finished += 1
                 self.buffer.append(task)
 
                 if self.waiter_buffer:
                     self.waiter_buffer.set_result(None)
                     self.waiter_buffer = None
+                self.executor.notify_runner()
 
                 # apply backpressure
-                if not self.executor.shutdown and len(self.buffer) > 10 * self.executor.concurrency:
+                if not self.executor.shutdown and (
+                    len(self.buffer) > 10 * self.executor.concurrency
+                    or self.executor.over_memory_budget()
+                ):
                     self.executor.semaphore.release()
                     self.waiter_backpressure = loop.create_future()
                     await self.waiter_backpressure
@@ -570,6 +1423,7 @@ class EageriseBoostable(Boostable[T]):
             if self.waiter_buffer:
                 self.waiter_buffer.set_result(None)
                 self.waiter_buffer = None
+            self.executor.notify_runner()
 
 
 # see docstring of Boostable
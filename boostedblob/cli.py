@@ -1,18 +1,33 @@
 import argparse
 import asyncio
+import contextlib
 import functools
 import os
 import shlex
 import subprocess
 import sys
 import tempfile
-from typing import Any, AsyncIterator, Callable, Coroutine, Dict, List, Optional, TypeVar, cast
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Optional,
+    TypeVar,
+    cast,
+)
 
 import boostedblob as bbb
 
 F = TypeVar("F", bound=Callable[..., Any])
 T = TypeVar("T")
 
+# Set by --metrics
+MONITOR_EVENT_LOOP = False
+
 
 def syncify(fn: Callable[..., Coroutine[T, None, None]]) -> Callable[..., T]:
     @functools.wraps(fn)
@@ -26,11 +41,21 @@ def syncify(fn: Callable[..., Coroutine[T, None, None]]) -> Callable[..., T]:
                 uvloop.install()
         except ImportError:
             pass
-        return asyncio.run(fn(*args, **kwargs))
+        return asyncio.run(run_monitored(fn(*args, **kwargs)))
 
     return wrapper
 
 
+async def run_monitored(coro: Awaitable[T]) -> T:
+    if not MONITOR_EVENT_LOOP:
+        return await coro
+    monitor = asyncio.create_task(bbb.metrics.monitor_event_loop())
+    try:
+        return await coro
+    finally:
+        monitor.cancel()
+
+
 def sync_with_session(fn: F) -> F:
     return syncify(bbb.ensure_session(fn))  # type: ignore[return-value]
 
@@ -38,10 +63,41 @@ def sync_with_session(fn: F) -> F:
 DEFAULT_CONCURRENCY = int(os.environ.get("BBB_DEFAULT_CONCURRENCY", 100))
 
 
+def create_executor(
+    concurrency: int,
+    adaptive_concurrency: bool = False,
+    quiet: bool = False,
+    memory_budget: Optional[int] = None,
+    stats_interval: Optional[float] = None,
+    max_rps: Optional[float] = None,
+    bwlimit: Optional[int] = None,
+) -> bbb.BoostExecutor:
+    executor = bbb.BoostExecutor(
+        concurrency,
+        adaptive=adaptive_concurrency,
+        memory_budget=memory_budget,
+        stats_interval=stats_interval,
+        max_rps=max_rps,
+        bwlimit=bwlimit,
+    )
+    if executor.adaptive is not None:
+        executor.adaptive.report = not quiet
+    return executor
+
+
 def is_glob(path: str) -> bool:
     return "*" in path
 
 
+def parse_size(size: str) -> int:
+    """Parse a size like "512M" or "2G" into a number of bytes."""
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    size = size.strip().upper().rstrip("IB")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
 async def print_long(it: AsyncIterator[bbb.listing.DirEntry], human_readable: bool) -> None:
     total = 0
     num_files = 0
@@ -168,9 +224,22 @@ async def _dud1(path: str) -> None:
 
 
 @sync_with_session
-async def cat(path: str, concurrency: int = DEFAULT_CONCURRENCY) -> None:
+async def cat(
+    path: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    memory_budget: Optional[int] = None,
+    stats_interval: Optional[float] = None,
+    max_rps: Optional[float] = None,
+    bwlimit: Optional[int] = None,
+) -> None:
     loop = asyncio.get_running_loop()
-    async with bbb.BoostExecutor(concurrency) as executor:
+    async with create_executor(
+        concurrency,
+        memory_budget=memory_budget,
+        stats_interval=stats_interval,
+        max_rps=max_rps,
+        bwlimit=bwlimit,
+    ) as executor:
         stream = await bbb.read.read_stream(path, executor)
         async for data in bbb.boost.iter_underlying(stream):
             await loop.run_in_executor(None, sys.stdout.buffer.write, data)
@@ -178,12 +247,22 @@ async def cat(path: str, concurrency: int = DEFAULT_CONCURRENCY) -> None:
 
 @sync_with_session
 async def cp(
-    srcs: List[str], dst: str, quiet: bool = False, concurrency: int = DEFAULT_CONCURRENCY
+    srcs: List[str],
+    dst: str,
+    quiet: bool = False,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    adaptive_concurrency: bool = False,
+    memory_budget: Optional[int] = None,
+    stats_interval: Optional[float] = None,
+    max_rps: Optional[float] = None,
+    bwlimit: Optional[int] = None,
 ) -> None:
     dst_obj = bbb.BasePath.from_str(dst)
     dst_is_dirlike = dst_obj.is_directory_like() or await bbb.isdir(dst_obj)
 
-    async with bbb.BoostExecutor(concurrency) as executor:
+    async with create_executor(
+        concurrency, adaptive_concurrency, quiet, memory_budget, stats_interval, max_rps, bwlimit
+    ) as executor:
         if len(srcs) > 1 and not dst_is_dirlike:
             raise NotADirectoryError(dst_obj)
 
@@ -207,11 +286,22 @@ async def cp(
 
 @sync_with_session
 async def cptree(
-    src: str, dst: str, quiet: bool = False, concurrency: int = DEFAULT_CONCURRENCY
+    src: str,
+    dst: str,
+    quiet: bool = False,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    adaptive_concurrency: bool = False,
+    memory_budget: Optional[int] = None,
+    stats_interval: Optional[float] = None,
+    max_rps: Optional[float] = None,
+    bwlimit: Optional[int] = None,
+    workers: int = 1,
 ) -> None:
     src_obj = bbb.BasePath.from_str(src)
-    async with bbb.BoostExecutor(concurrency) as executor:
-        async for p in bbb.copying.copytree_iterator(src_obj, dst, executor):
+    async with create_executor(
+        concurrency, adaptive_concurrency, quiet, memory_budget, stats_interval, max_rps, bwlimit
+    ) as executor:
+        async for p in bbb.copying.copytree_iterator(src_obj, dst, executor, workers=workers):
             if not quiet:
                 print(p)
 
@@ -235,9 +325,19 @@ async def rm(paths: List[str], quiet: bool = False, concurrency: int = DEFAULT_C
 
 
 @sync_with_session
-async def rmtree(path: str, quiet: bool = False, concurrency: int = DEFAULT_CONCURRENCY) -> None:
+async def rmtree(
+    path: str,
+    quiet: bool = False,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    adaptive_concurrency: bool = False,
+    stats_interval: Optional[float] = None,
+    max_rps: Optional[float] = None,
+    workers: int = 1,
+) -> None:
     path_obj = bbb.BasePath.from_str(path)
-    async with bbb.BoostExecutor(concurrency) as executor:
+    async with create_executor(
+        concurrency, adaptive_concurrency, quiet, stats_interval=stats_interval, max_rps=max_rps
+    ) as executor:
         if is_glob(path):
             # this will fail if the glob matches a directory, which is a little contra the spirit of
             # rmtree. but maybe the best way to do that (and least likely to result in accidents) is
@@ -246,7 +346,7 @@ async def rmtree(path: str, quiet: bool = False, concurrency: int = DEFAULT_CONC
                 if not quiet:
                     print(p)
         elif isinstance(path_obj, bbb.CloudPath):
-            async for p in bbb.delete.rmtree_iterator(path_obj, executor):
+            async for p in bbb.delete.rmtree_iterator(path_obj, executor, workers=workers):
                 if not quiet:
                     print(p)
         else:
@@ -279,6 +379,12 @@ async def sync(
     exclude: Optional[str] = None,
     quiet: bool = False,
     concurrency: int = DEFAULT_CONCURRENCY,
+    adaptive_concurrency: bool = False,
+    memory_budget: Optional[int] = None,
+    stats_interval: Optional[float] = None,
+    max_rps: Optional[float] = None,
+    bwlimit: Optional[int] = None,
+    workers: int = 1,
 ) -> None:
     src_obj = bbb.BasePath.from_str(src)
     dst_obj = bbb.BasePath.from_str(dst)
@@ -286,8 +392,12 @@ async def sync(
     src_is_dirlike = src_obj.is_directory_like() or await bbb.isdir(src_obj)
     if not src_is_dirlike:
         raise ValueError(f"{src_obj} is not a directory")
-    async with bbb.BoostExecutor(concurrency) as executor:
-        async for p in bbb.sync(src_obj, dst_obj, executor, delete=delete, exclude=exclude):
+    async with create_executor(
+        concurrency, adaptive_concurrency, quiet, memory_budget, stats_interval, max_rps, bwlimit
+    ) as executor:
+        async for p in bbb.sync(
+            src_obj, dst_obj, executor, delete=delete, exclude=exclude, workers=workers
+        ):
             if not quiet:
                 print(p)
 
@@ -394,6 +504,16 @@ async def complete_command(shell: str, index: int, partial_command: List[str]) -
 def parse_options(args: List[str]) -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("--version", action="version", version=f"boostedblob {bbb.__version__}")
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Print request timings and other metrics to stderr when the command finishes",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Record a timeline of requests and tasks to FILE, viewable in ui.perfetto.dev",
+    )
     subparsers = parser.add_subparsers(required=True)
 
     concurrency_kwargs: Dict[str, Any] = dict(
@@ -402,6 +522,49 @@ def parse_options(args: List[str]) -> argparse.Namespace:
         default=DEFAULT_CONCURRENCY,
         help="Number of concurrent requests to use",
     )
+    adaptive_concurrency_kwargs: Dict[str, Any] = dict(
+        action="store_true",
+        help=(
+            "Adjust concurrency at runtime based on throttling, latency and throughput, "
+            "using --concurrency as the maximum"
+        ),
+    )
+    memory_budget_kwargs: Dict[str, Any] = dict(
+        type=parse_size,
+        metavar="SIZE",
+        help=(
+            "Approximate limit on memory used to buffer data, e.g. 512M or 2G. Note that at least "
+            "one chunk per file is always buffered"
+        ),
+    )
+    stats_kwargs: Dict[str, Any] = dict(
+        dest="stats_interval",
+        nargs="?",
+        type=float,
+        const=5.0,
+        metavar="SECONDS",
+        help=(
+            "Periodically print executor stats to stderr: concurrency in use, throughput and the "
+            "state of each boostable. Defaults to every 5 seconds"
+        ),
+    )
+    max_rps_kwargs: Dict[str, Any] = dict(
+        type=float, metavar="N", help="Limit the average number of requests made per second"
+    )
+    bwlimit_kwargs: Dict[str, Any] = dict(
+        type=parse_size,
+        metavar="SIZE",
+        help="Limit the average bytes per second uploaded and downloaded, e.g. 100M",
+    )
+    workers_kwargs: Dict[str, Any] = dict(
+        type=int,
+        metavar="N",
+        default=1,
+        help=(
+            "Split the work across N processes, each with its own event loop. Useful if a single "
+            "core is the bottleneck. Concurrency and rate limits are shared between them"
+        ),
+    )
 
     ls_desc = """\
 `bbb ls` lists the immediate contents of a directory (both files and
@@ -590,6 +753,10 @@ eval "$(bbb complete init zsh)"
     subparser.set_defaults(command=cat)
     subparser.add_argument("path", help="File whose contents to print")
     subparser.add_argument("--concurrency", **concurrency_kwargs)
+    subparser.add_argument("--memory-budget", **memory_budget_kwargs)
+    subparser.add_argument("--stats", **stats_kwargs)
+    subparser.add_argument("--max-rps", **max_rps_kwargs)
+    subparser.add_argument("--bwlimit", **bwlimit_kwargs)
 
     subparser = subparsers.add_parser(
         "cp",
@@ -602,6 +769,11 @@ eval "$(bbb complete init zsh)"
     subparser.add_argument("dst", help="File or directory to copy to")
     subparser.add_argument("-q", "--quiet", action="store_true")
     subparser.add_argument("--concurrency", **concurrency_kwargs)
+    subparser.add_argument("--adaptive-concurrency", **adaptive_concurrency_kwargs)
+    subparser.add_argument("--memory-budget", **memory_budget_kwargs)
+    subparser.add_argument("--stats", **stats_kwargs)
+    subparser.add_argument("--max-rps", **max_rps_kwargs)
+    subparser.add_argument("--bwlimit", **bwlimit_kwargs)
 
     subparser = subparsers.add_parser(
         "cptree",
@@ -615,6 +787,12 @@ eval "$(bbb complete init zsh)"
     subparser.add_argument("dst", help="Directory to copy to")
     subparser.add_argument("-q", "--quiet", action="store_true")
     subparser.add_argument("--concurrency", **concurrency_kwargs)
+    subparser.add_argument("--adaptive-concurrency", **adaptive_concurrency_kwargs)
+    subparser.add_argument("--memory-budget", **memory_budget_kwargs)
+    subparser.add_argument("--stats", **stats_kwargs)
+    subparser.add_argument("--max-rps", **max_rps_kwargs)
+    subparser.add_argument("--bwlimit", **bwlimit_kwargs)
+    subparser.add_argument("--workers", **workers_kwargs)
 
     subparser = subparsers.add_parser(
         "edit",
@@ -647,6 +825,10 @@ eval "$(bbb complete init zsh)"
     subparser.add_argument("path", help="Directory to delete")
     subparser.add_argument("-q", "--quiet", action="store_true")
     subparser.add_argument("--concurrency", **concurrency_kwargs)
+    subparser.add_argument("--adaptive-concurrency", **adaptive_concurrency_kwargs)
+    subparser.add_argument("--stats", **stats_kwargs)
+    subparser.add_argument("--max-rps", **max_rps_kwargs)
+    subparser.add_argument("--workers", **workers_kwargs)
 
     subparser = subparsers.add_parser(
         "share",
@@ -679,6 +861,12 @@ eval "$(bbb complete init zsh)"
     )
     subparser.add_argument("-q", "--quiet", action="store_true")
     subparser.add_argument("--concurrency", **concurrency_kwargs)
+    subparser.add_argument("--adaptive-concurrency", **adaptive_concurrency_kwargs)
+    subparser.add_argument("--memory-budget", **memory_budget_kwargs)
+    subparser.add_argument("--stats", **stats_kwargs)
+    subparser.add_argument("--max-rps", **max_rps_kwargs)
+    subparser.add_argument("--bwlimit", **bwlimit_kwargs)
+    subparser.add_argument("--workers", **workers_kwargs)
 
     subparser = subparsers.add_parser("_xrp")
     subparser.set_defaults(command=_xxx_recoverprefix)
@@ -715,10 +903,20 @@ eval "$(bbb complete init zsh)"
 
 
 def run_bbb(argv: List[str]) -> None:
+    global MONITOR_EVENT_LOOP
+
+    metrics = False
     try:
         args = parse_options(argv)
         command = args.__dict__.pop("command")
-        command(**args.__dict__)
+        metrics = MONITOR_EVENT_LOOP = args.__dict__.pop("metrics")
+        trace = args.__dict__.pop("trace")
+        with bbb.tracing.record_trace(trace) if trace else contextlib.nullcontext():
+            command(**args.__dict__)
     except Exception as e:
         print(f"ERROR: {type(e).__name__}: {e}", file=sys.stderr)
         raise
+    finally:
+        bbb.path.metadata_cache.save()
+        if metrics:
+            bbb.metrics.registry.dump()
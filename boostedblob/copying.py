@@ -1,5 +1,7 @@
 import asyncio
+import functools
 import itertools
+import mmap
 import os
 import shutil
 import sys
@@ -17,14 +19,26 @@ from .path import (
     LocalPath,
     exists,
     getsize,
+    metadata_cache,
     pathdispatch,
     url_format,
 )
-from .read import ByteRange, byte_range_to_str, read_single, read_stream, read_stream_unordered
+from .read import (
+    ByteRange,
+    byte_range_to_str,
+    read_byte_range_into,
+    read_single,
+    read_stream,
+    read_stream_unordered,
+)
 from .request import Request, azurify_request, exponential_sleep_generator, googlify_request
+from .sharding import sharded_map
 from .write import (
     AZURE_BLOCK_COUNT_LIMIT,
+    AZURE_IF_NOT_EXISTS,
+    GOOGLE_IF_NOT_EXISTS,
     azure_put_block_list,
+    exists_failure_exceptions,
     get_block_id,
     get_upload_id,
     prepare_block_blob_write,
@@ -78,8 +92,7 @@ async def _cloudpath_copyfile(
             await write_single(dst, await read_single(src), overwrite=overwrite)
             return
 
-        stream = await read_stream(src, executor, size=size)
-        await write_stream(dst, stream, executor, overwrite=overwrite)
+        await _download_copyfile(src, dst, executor, overwrite=overwrite, size=size)
         return
     if isinstance(dst, CloudPath):
         if type(src) is type(dst):
@@ -119,7 +132,7 @@ async def _localpath_copyfile(
             if await exists(dst):
                 raise FileExistsError(dst)
         os.makedirs(dst.parent, exist_ok=True)
-        shutil.copyfile(src, dst)
+        await executor.run_threaded(shutil.copyfile, src, dst)
         return
     if isinstance(dst, CloudPath):
         if size is not None and size <= config.chunk_size:
@@ -133,6 +146,51 @@ async def _localpath_copyfile(
     raise ValueError(f"Unsupported path: {dst}")
 
 
+async def _download_copyfile(
+    src: CloudPath,
+    dst: LocalPath,
+    executor: BoostExecutor,
+    overwrite: bool = False,
+    size: Optional[int] = None,
+) -> None:
+    # We mmap the destination and read each chunk straight into it. Compared to read_stream and
+    # write_stream, this saves allocating a bytes object per chunk and copying it into the file,
+    # and lets us write chunks in whatever order they arrive.
+    if size is None:
+        size = await getsize(src)
+    if not overwrite:
+        if await exists(dst):
+            raise FileExistsError(dst)
+    os.makedirs(dst.parent, exist_ok=True)
+
+    byte_ranges = itertools.zip_longest(
+        range(0, size, config.chunk_size),
+        range(config.chunk_size, size, config.chunk_size),
+        fillvalue=size,
+    )
+    with open(dst, "w+b") as f:
+        if size == 0:
+            return
+        f.truncate(size)
+        mm = mmap.mmap(f.fileno(), size)
+        try:
+            view = memoryview(mm)
+
+            async def read_chunk(byte_range: ByteRange) -> None:
+                start, end = byte_range
+                await read_byte_range_into(src, byte_range, view[start:end])
+
+            await consume(executor.map_unordered(read_chunk, byte_ranges))
+            view.release()
+        finally:
+            try:
+                mm.close()
+            except BufferError:
+                # If we're raising, a traceback may still reference a view of mm. It'll be
+                # unmapped once that's garbage collected.
+                pass
+
+
 # ==============================
 # cloud_copyfile
 # ==============================
@@ -189,9 +247,6 @@ async def _azure_cloud_copyfile_via_block_urls(
 ) -> None:
     if overwrite:
         await prepare_block_blob_write(dst)
-    else:
-        if await exists(dst):
-            raise FileExistsError(dst)
 
     copy_source, _ = await azure_auth.generate_signed_url(src)
     if size is None:
@@ -222,17 +277,13 @@ async def _azure_cloud_copyfile_via_block_urls(
     await consume(executor.map_unordered(upload_chunk, enumerate(byte_ranges)))
 
     blocklist = [get_block_id(upload_id, i) for i in range(max_block_index + 1)]
-    await azure_put_block_list(dst, blocklist)
+    await azure_put_block_list(dst, blocklist, overwrite=overwrite)
 
 
 async def _azure_cloud_copyfile_via_copy(
     src: AzurePath, dst: AzurePath, overwrite: bool = False
 ) -> None:
     assert isinstance(dst, AzurePath)
-    if not overwrite:
-        if await exists(dst):
-            raise FileExistsError(dst)
-
     if src.account == dst.account:
         copy_source = src.format_url("https://{account}.blob.core.windows.net/{container}/{blob}")
     else:
@@ -241,9 +292,9 @@ async def _azure_cloud_copyfile_via_copy(
         Request(
             method="PUT",
             url=dst.format_url("https://{account}.blob.core.windows.net/{container}/{blob}"),
-            headers={"x-ms-copy-source": copy_source},
+            headers={"x-ms-copy-source": copy_source, **({} if overwrite else AZURE_IF_NOT_EXISTS)},
             success_codes=(202,),
-            failure_exceptions={404: FileNotFoundError(src)},
+            failure_exceptions={404: FileNotFoundError(src), **exists_failure_exceptions(dst)},
         )
     )
 
@@ -302,6 +353,7 @@ async def _azure_cloud_copyfile(
         await _azure_cloud_copyfile_via_block_urls(
             src, dst, executor, overwrite=overwrite, size=size
         )
+    metadata_cache.invalidate(dst)
 
 
 @cloud_copyfile.register  # type: ignore
@@ -309,10 +361,7 @@ async def _google_cloud_copyfile(
     src: GooglePath, dst: GooglePath, executor: BoostExecutor, overwrite: bool = False
 ) -> None:
     assert isinstance(dst, GooglePath)
-    if not overwrite:
-        if await exists(dst):
-            raise FileExistsError(dst)
-    params: Dict[str, Any] = {}
+    params: Dict[str, Any] = {} if overwrite else dict(GOOGLE_IF_NOT_EXISTS)
 
     sleep = exponential_sleep_generator(
         initial=config.backoff_initial,
@@ -334,12 +383,13 @@ async def _google_cloud_copyfile(
                     dst_blob=dst.blob,
                 ),
                 params=params,
-                failure_exceptions={404: FileNotFoundError(src)},
+                failure_exceptions={404: FileNotFoundError(src), **exists_failure_exceptions(dst)},
             )
         )
         async with request.execute() as resp:
             result = await resp.json()
         if result["done"]:
+            metadata_cache.invalidate(dst)
             return
         params["rewriteToken"] = result["rewriteToken"]
         await asyncio.sleep(next(sleep))
@@ -350,8 +400,21 @@ async def _google_cloud_copyfile(
 # ==============================
 
 
+async def _copytree_entry(
+    src: BasePath, dst: BasePath, entry: DirEntry, executor: BoostExecutor
+) -> BasePath:
+    if entry.is_dir:
+        # Filter out directory marker files
+        return entry.path
+    size = entry.stat.size if entry.stat else None
+    await copyfile(
+        entry.path, dst / (entry.path.relative_to(src)), executor, size=size, overwrite=True
+    )
+    return entry.path
+
+
 async def copytree_iterator(
-    src: BasePath, dst: Union[BasePath, str], executor: BoostExecutor
+    src: BasePath, dst: Union[BasePath, str], executor: BoostExecutor, workers: int = 1
 ) -> AsyncIterator[BasePath]:
     """Copies the tree rooted at ``src`` to ``dst``.
 
@@ -360,6 +423,8 @@ async def copytree_iterator(
     :param src: The root of the tree to copy from.
     :param dst: The root of the tree to copy to.
     :param executor: An executor.
+    :param workers: If more than one, split the copies across this many worker processes. See
+        ``sharding.sharded_map``.
 
     """
     if isinstance(dst, str):
@@ -368,18 +433,14 @@ async def copytree_iterator(
     if isinstance(src, LocalPath):
         src = LocalPath(os.path.abspath(src.path))
 
-    async def copy_wrapper(entry: DirEntry) -> BasePath:
-        assert isinstance(dst, BasePath)
-        if entry.is_dir:
-            # Filter out directory marker files
-            return entry.path
-        size = entry.stat.size if entry.stat else None
-        await copyfile(
-            entry.path, dst / (entry.path.relative_to(src)), executor, size=size, overwrite=True
-        )
-        return entry.path
+    copy_entry = functools.partial(_copytree_entry, src, dst)
+    entries = executor.eagerise(scantree(src))
+    if workers > 1:
+        async for path in sharded_map(executor, workers, copy_entry, entries):
+            yield path
+        return
 
-    async for path in executor.map_unordered(copy_wrapper, executor.eagerise(scantree(src))):
+    async for path in executor.map_unordered(lambda e: copy_entry(e, executor), entries):
         yield path
 
 
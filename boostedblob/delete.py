@@ -1,12 +1,23 @@
 import asyncio
 import os
 import shutil
-from typing import AsyncIterator, Optional, Union
+from typing import AsyncIterable, AsyncIterator, Optional, Union
 
 from .boost import BoostExecutor, consume
 from .listing import glob_scandir, listtree
-from .path import AzurePath, BasePath, CloudPath, GooglePath, LocalPath, isdir, isfile, pathdispatch
+from .path import (
+    AzurePath,
+    BasePath,
+    CloudPath,
+    GooglePath,
+    LocalPath,
+    invalidates_metadata,
+    isdir,
+    isfile,
+    pathdispatch,
+)
 from .request import Request, azurify_request, googlify_request
+from .sharding import sharded_map
 
 # ==============================
 # remove
@@ -24,6 +35,7 @@ async def remove(path: Union[BasePath, str]) -> BasePath:
 
 
 @remove.register  # type: ignore
+@invalidates_metadata
 async def _azure_remove(path: AzurePath) -> AzurePath:
     request = await azurify_request(
         Request(
@@ -44,6 +56,7 @@ async def _azure_remove(path: AzurePath) -> AzurePath:
 
 
 @remove.register  # type: ignore
+@invalidates_metadata
 async def _google_remove(path: GooglePath) -> GooglePath:
     request = await googlify_request(
         Request(
@@ -94,13 +107,21 @@ async def glob_remove(
 # ==============================
 
 
-async def rmtree_iterator(path: CloudPath, executor: BoostExecutor) -> AsyncIterator[BasePath]:
+async def _rmtree_remove(path: BasePath, executor: BoostExecutor) -> BasePath:
+    return await remove(path)
+
+
+async def rmtree_iterator(
+    path: CloudPath, executor: BoostExecutor, workers: int = 1
+) -> AsyncIterator[BasePath]:
     """Delete the directory ``path``.
 
     Yields the deleted paths as they are deleted.
 
     :param path: The path to delete.
     :param executor: An executor.
+    :param workers: If more than one, split the deletes across this many worker processes. See
+        ``sharding.sharded_map``.
 
     """
     # Note that this function almost works for LocalPath, except that we wouldn't remove empty
@@ -119,7 +140,13 @@ async def rmtree_iterator(path: CloudPath, executor: BoostExecutor) -> AsyncIter
     marker_task = asyncio.create_task(remove_directory_marker())
 
     try:
-        async for subpath in executor.map_unordered(remove, executor.eagerise(listtree(dirpath))):
+        subpaths = executor.eagerise(listtree(dirpath))
+        removed: AsyncIterable[BasePath]
+        if workers > 1:
+            removed = sharded_map(executor, workers, _rmtree_remove, subpaths)
+        else:
+            removed = executor.map_unordered(remove, subpaths)
+        async for subpath in removed:
             yield subpath
     except FileNotFoundError:
         if await isfile(path):
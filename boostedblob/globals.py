@@ -7,6 +7,7 @@ import json
 import os
 import sys
 import time
+import weakref
 from dataclasses import dataclass, field
 from typing import (
     Any,
@@ -14,6 +15,7 @@ from typing import (
     Awaitable,
     Callable,
     Dict,
+    FrozenSet,
     Generic,
     Iterator,
     Optional,
@@ -23,7 +25,7 @@ from typing import (
 
 import aiohttp
 
-from . import azure_auth, google_auth
+from . import azure_auth, google_auth, metrics
 
 MB = 2**20
 
@@ -122,6 +124,35 @@ class Config:
     backoff_max: float = 60.0
     backoff_jitter_fraction: float = 0.9
     retry_limit: int = 25
+    # Retries are limited to this fraction of recent requests, plus retry_budget_min_per_second, so
+    # that retries don't snowball when a service is struggling. None disables the budget.
+    retry_budget_ratio: Optional[float] = 0.2
+    retry_budget_min_per_second: float = 10.0
+    # If at least this fraction of recent requests to a host fail, requests to that host are paused
+    # for a while, or fail immediately if circuit_breaker_fail_fast is set. None disables this.
+    circuit_breaker_threshold: Optional[float] = 0.5
+    circuit_breaker_fail_fast: bool = False
+
+    # If set, range reads and block uploads that take longer than this percentile of recent ones
+    # are sent again, and we use whichever response comes back first. At most hedge_max_overhead
+    # of requests are hedged.
+    hedge_percentile: Optional[float] = None
+    hedge_max_overhead: float = 0.05
+
+    # Call types (any of "stat" and "isdir") for which concurrent calls on the same path share a
+    # single request and its result. isfile, exists and getsize are built on these.
+    coalesce_requests: FrozenSet[str] = frozenset()
+
+    # If set, stat and isdir results for cloud paths are cached for this many seconds, including
+    # results seen in listings. Up to metadata_cache_size results are kept. If metadata_cache_file
+    # is set, the CLI saves the cache there, so it persists across invocations.
+    metadata_cache_ttl: Optional[float] = (
+        float(os.environ["BBB_METADATA_CACHE_TTL"])
+        if os.environ.get("BBB_METADATA_CACHE_TTL")
+        else None
+    )
+    metadata_cache_size: int = 100_000
+    metadata_cache_file: Optional[str] = os.environ.get("BBB_METADATA_CACHE_FILE") or None
 
     token_early_expiration_seconds: int = 300
 
@@ -139,6 +170,19 @@ class Config:
 config: Config = Config()
 
 
+# Sessions for specific event loops. These take precedence over config.session, which lets us run
+# an event loop in another thread (see blocking.py) without interfering with the caller's loop.
+_loop_sessions: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, aiohttp.ClientSession
+] = weakref.WeakKeyDictionary()
+
+
+def get_session() -> Optional[aiohttp.ClientSession]:
+    """Return the session requests on the running event loop should use."""
+    session = _loop_sessions.get(asyncio.get_running_loop())
+    return session if session is not None else config.session
+
+
 @contextlib.contextmanager
 def configure(**kwargs: Any) -> Iterator[None]:
     original = {k: getattr(config, k) for k in kwargs}
@@ -163,12 +207,12 @@ def _create_session() -> aiohttp.ClientSession:
     # While the sleep suggested doesn't work, it does indicate that this is a problem for
     # aiohttp in general.
     connector = aiohttp.TCPConnector(limit=0, ttl_dns_cache=60)
-    return aiohttp.ClientSession(connector=connector)
+    return aiohttp.ClientSession(connector=connector, trace_configs=[metrics.create_trace_config()])
 
 
 @contextlib.asynccontextmanager
 async def session_context() -> AsyncIterator[None]:
-    if config.session is None:
+    if get_session() is None:
         set_event_loop_exception_handler()  # there could be a better place for this
         session = _create_session()
         async with session:
@@ -4,9 +4,10 @@ import configparser
 import datetime
 import os
 import re
-from typing import Any, AsyncIterator, Iterator, Mapping, NamedTuple, Optional, Union
+from typing import Any, AsyncIterator, Iterator, List, Mapping, NamedTuple, Optional, Union
 
 from . import google_auth
+from .boost import run_threaded
 from .path import (
     AzurePath,
     AzureStat,
@@ -18,6 +19,7 @@ from .path import (
     LocalStat,
     Stat,
     isfile,
+    metadata_cache,
     pathdispatch,
 )
 from .request import Request, azure_page_iterator, google_page_iterator
@@ -114,6 +116,7 @@ async def _azure_list_blobs(
 
     async for result in it:
         for entry in _azure_get_entries(prefix.account, prefix.container, result):
+            metadata_cache.seed(entry.path, entry.stat)
             yield entry
 
 
@@ -145,6 +148,7 @@ async def _google_list_blobs(
 
     async for result in it:
         for entry in _google_get_entries(prefix.bucket, result):
+            metadata_cache.seed(entry.path, entry.stat)
             yield entry
 
 
@@ -264,20 +268,33 @@ async def _cloud_scantree(path: CloudPath) -> AsyncIterator[DirEntry]:
 async def _local_scantree(path: LocalPath) -> AsyncIterator[DirEntry]:
     path_absolute = os.path.abspath(path)
 
-    def inner(current: str) -> Iterator[DirEntry]:
-        entries = list(os.scandir(current))
-        for entry in entries:
+    def scan(current: str) -> List[Union[str, DirEntry]]:
+        # Returns the files in current, and the paths of subdirectories of current
+        ret: List[Union[str, DirEntry]] = []
+        for entry in os.scandir(current):
             if entry.is_dir():
-                yield from inner(entry.path)
+                ret.append(entry.path)
             else:
-                yield DirEntry(
-                    path=LocalPath(entry.path),
-                    is_dir=False,
-                    is_file=True,
-                    stat=_os_safe_stat(entry),
+                ret.append(
+                    DirEntry(
+                        path=LocalPath(entry.path),
+                        is_dir=False,
+                        is_file=True,
+                        stat=_os_safe_stat(entry),
+                    )
                 )
+        return ret
+
+    async def inner(current: str) -> AsyncIterator[DirEntry]:
+        # Listing and statting happen in a thread, so we don't block the event loop on big trees
+        for entry in await run_threaded(scan, current):
+            if isinstance(entry, str):
+                async for subentry in inner(entry):
+                    yield subentry
+            else:
+                yield entry
 
-    for entry in inner(path_absolute):
+    async for entry in inner(path_absolute):
         yield entry
 
 
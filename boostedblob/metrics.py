@@ -0,0 +1,277 @@
+"""An in-process registry of counters and histograms, and the request timings that fill it.
+
+Request timings come from aiohttp's tracing hooks (see ``create_trace_config``), which our session
+installs. Each request records:
+
+- ``request.dns``: time spent resolving the hostname, if it wasn't cached
+- ``request.connect``: time spent creating a new connection, including the TLS handshake. aiohttp
+  has no hook that separates the two.
+- ``request.ttfb``: time from starting the request to receiving response headers
+- ``request.body``: time from receiving response headers to receiving the last chunk of the body
+- ``request.total``: time from starting the request to being done with the response
+- ``request.bytes_out`` and ``request.bytes_in``: the size of the request and response bodies
+
+along with counters for requests, statuses, retries and new and reused connections. Comparing
+these with ``loop.lag`` (see ``monitor_event_loop``) tells you whether slowness comes from the
+network, the service, or our own event loop.
+
+Example usage:
+```
+print(metrics.registry.histogram("request.ttfb").percentile(0.99))
+metrics.registry.dump()
+```
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import sys
+import time
+import types
+from typing import Any, Dict, Optional, TextIO
+
+import aiohttp
+
+# Buckets grow by this factor, so percentiles are accurate to within about 10%
+BUCKET_BASE = 2**0.25
+
+
+class Histogram:
+    """A histogram with logarithmically sized buckets, so it can take any number of samples."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zeros += 1
+            return
+        bucket = math.floor(math.log(value, BUCKET_BASE))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Returns an estimate of the ``p`` percentile, where ``p`` is between 0 and 1."""
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen > rank:
+                # Use the middle of the bucket, clamped to what we've actually seen
+                estimate = BUCKET_BASE ** (bucket + 0.5)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min,
+            "p50": self.percentile(0.5) or 0.0,
+            "p90": self.percentile(0.9) or 0.0,
+            "p99": self.percentile(0.99) or 0.0,
+            "max": self.max,
+        }
+
+
+class MetricsRegistry:
+    """Named counters and histograms."""
+
+    def __init__(self) -> None:
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+
+    def increment(self, name: str, amount: float = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def observe(self, name: str, value: float) -> None:
+        self.histogram(name).observe(value)
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.histograms.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the current metrics, in a form that can be serialised as JSON."""
+        return {
+            "counters": dict(self.counters),
+            "histograms": {name: h.summary() for name, h in self.histograms.items()},
+        }
+
+    def dump(self, file: TextIO = sys.stderr) -> None:
+        """Prints a human readable summary of the current metrics."""
+        for name in sorted(self.counters):
+            print(f"{name}: {self.counters[name]:g}", file=file)
+        for name in sorted(self.histograms):
+            s = self.histograms[name].summary()
+            if not s["count"]:
+                continue
+            unit = "B" if name.endswith("bytes_in") or name.endswith("bytes_out") else "s"
+            fmt = "{:.0f}" if unit == "B" else "{:.4f}"
+            stats = ", ".join(
+                f"{k}={fmt.format(s[k])}{unit}" for k in ("mean", "p50", "p90", "p99", "max")
+            )
+            print(f"{name}: count={s['count']}, {stats}", file=file)
+
+
+registry = MetricsRegistry()
+
+
+# ==============================
+# request timing
+# ==============================
+
+
+class RequestTiming:
+    """Filled in by our trace hooks over the course of a single request."""
+
+    __slots__ = ("start", "headers_at", "last_chunk_at", "bytes_in", "bytes_out", "status")
+
+    def __init__(self) -> None:
+        self.start = time.monotonic()
+        self.headers_at: Optional[float] = None
+        self.last_chunk_at: Optional[float] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.status: Optional[int] = None
+
+    def finish(self, attempt: int) -> None:
+        """Record the request in the registry, once we're done with its response."""
+        now = time.monotonic()
+        registry.increment("request.count")
+        if attempt > 0:
+            registry.increment("request.retries")
+        registry.increment(f"request.status.{self.status or 'error'}")
+        registry.observe("request.total", now - self.start)
+        registry.observe("request.bytes_out", self.bytes_out)
+        if self.headers_at is not None:
+            registry.observe("request.ttfb", self.headers_at - self.start)
+            registry.observe("request.bytes_in", self.bytes_in)
+            if self.last_chunk_at is not None:
+                registry.observe("request.body", self.last_chunk_at - self.headers_at)
+
+
+def _timing(ctx: types.SimpleNamespace) -> Optional[RequestTiming]:
+    timing = ctx.trace_request_ctx
+    return timing if isinstance(timing, RequestTiming) else None
+
+
+async def _on_dns_resolvehost_start(
+    session: aiohttp.ClientSession, ctx: types.SimpleNamespace, params: Any
+) -> None:
+    ctx.dns_start = time.monotonic()
+
+
+async def _on_dns_resolvehost_end(
+    session: aiohttp.ClientSession, ctx: types.SimpleNamespace, params: Any
+) -> None:
+    registry.observe("request.dns", time.monotonic() - ctx.dns_start)
+
+
+async def _on_connection_create_start(
+    session: aiohttp.ClientSession, ctx: types.SimpleNamespace, params: Any
+) -> None:
+    ctx.connect_start = time.monotonic()
+
+
+async def _on_connection_create_end(
+    session: aiohttp.ClientSession, ctx: types.SimpleNamespace, params: Any
+) -> None:
+    registry.increment("request.new_connections")
+    registry.observe("request.connect", time.monotonic() - ctx.connect_start)
+
+
+async def _on_connection_reuseconn(
+    session: aiohttp.ClientSession, ctx: types.SimpleNamespace, params: Any
+) -> None:
+    registry.increment("request.reused_connections")
+
+
+async def _on_request_chunk_sent(
+    session: aiohttp.ClientSession, ctx: types.SimpleNamespace, params: Any
+) -> None:
+    timing = _timing(ctx)
+    if timing is not None:
+        timing.bytes_out += len(params.chunk)
+
+
+async def _on_request_end(
+    session: aiohttp.ClientSession, ctx: types.SimpleNamespace, params: Any
+) -> None:
+    timing = _timing(ctx)
+    if timing is not None:
+        timing.headers_at = time.monotonic()
+        timing.status = params.response.status
+
+
+async def _on_response_chunk_received(
+    session: aiohttp.ClientSession, ctx: types.SimpleNamespace, params: Any
+) -> None:
+    timing = _timing(ctx)
+    if timing is not None:
+        timing.last_chunk_at = time.monotonic()
+        timing.bytes_in += len(params.chunk)
+
+
+def create_trace_config() -> aiohttp.TraceConfig:
+    """Returns a TraceConfig that records request timings in ``registry``.
+
+    Pass a RequestTiming as ``trace_request_ctx`` to a request to record timings for the request
+    as a whole, rather than just for DNS and connections.
+
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(_on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(_on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(_on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    trace_config.on_request_chunk_sent.append(_on_request_chunk_sent)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_response_chunk_received.append(_on_response_chunk_received)
+    return trace_config
+
+
+# ==============================
+# event loop lag
+# ==============================
+
+
+async def monitor_event_loop(interval: float = 0.1) -> None:
+    """Record how late the event loop wakes us up, as ``loop.lag``. Runs until cancelled.
+
+    If this is high, time spent in our own code is inflating the other timings.
+
+    """
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        registry.observe("loop.lag", time.monotonic() - start - interval)
@@ -2,15 +2,28 @@ from __future__ import annotations
 
 import asyncio
 import base64
+import collections
 import datetime
 import email.utils
 import functools
+import json
 import os
+import stat as stat_module
+import sys
+import time
 import urllib.parse
 from dataclasses import dataclass
-from typing import Any, Callable, Mapping, Optional, TypeVar, Union
-
-from .request import Request, azure_page_iterator, azurify_request, googlify_request
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple, TypeVar, Union
+
+from .globals import config
+from .metrics import registry
+from .request import (
+    Request,
+    azure_page_iterator,
+    azurify_request,
+    google_page_iterator,
+    googlify_request,
+)
 
 T = TypeVar("T")
 
@@ -259,6 +272,219 @@ def pathdispatch(fn: F) -> F:
     return ret
 
 
+# Shared by all event loops, since the key includes the loop
+_in_flight: Dict[Tuple[str, BasePath, asyncio.AbstractEventLoop], asyncio.Future[Any]] = {}
+
+
+def single_flight(name: str) -> Callable[[F], F]:
+    """Coalesce concurrent calls on the same path, if ``name`` is in ``config.coalesce_requests``.
+
+    The first call does the work, in a task of its own so that cancelling it doesn't affect
+    other callers. Calls made while it's in flight wait for it and get the same result or
+    exception. Counts calls in ``coalesce.{name}.requests`` and calls that didn't need a request
+    of their own in ``coalesce.{name}.saved``.
+
+    """
+
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        async def wrapper(path: BasePath, *args: Any, **kwargs: Any) -> Any:
+            if name not in config.coalesce_requests or args or kwargs:
+                return await fn(path, *args, **kwargs)
+            key = (name, path, asyncio.get_running_loop())
+            task = _in_flight.get(key)
+            registry.increment(f"coalesce.{name}.requests")
+            if task is None:
+                task = asyncio.ensure_future(fn(path))
+                _in_flight[key] = task
+
+                def on_done(t: asyncio.Future[Any]) -> None:
+                    del _in_flight[key]
+                    # Avoid "exception was never retrieved" if every caller was cancelled
+                    if not t.cancelled():
+                        t.exception()
+
+                task.add_done_callback(on_done)
+            else:
+                registry.increment(f"coalesce.{name}.saved")
+            return await asyncio.shield(task)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+# ==============================
+# metadata cache
+# ==============================
+
+# Stands in for FileNotFoundError in the cache
+_MISSING = object()
+
+
+class MetadataCache:
+    """A least recently used cache of stat and isdir results for cloud paths.
+
+    Disabled unless ``config.metadata_cache_ttl`` is set. Listings add what they find, and our own
+    writes and deletes remove what they affect. Changes made by others show up once entries expire.
+    If ``config.metadata_cache_file`` is set, the cache is loaded from it when first used, and
+    ``save`` writes it back, so that it can be shared by CLI invocations.
+
+    """
+
+    def __init__(self) -> None:
+        self.entries: collections.OrderedDict[
+            Tuple[str, BasePath], Tuple[float, Any]
+        ] = collections.OrderedDict()
+        # Incremented on every invalidation. Results of requests that were in flight during an
+        # invalidation may be outdated, so we don't cache them.
+        self.generation = 0
+        self.loaded = False
+
+    def get(self, kind: str, path: BasePath) -> Any:
+        """Returns the cached result, _MISSING for a cached FileNotFoundError, or None."""
+        if not self.loaded:
+            self.load()
+        key = (kind, path)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, kind: str, path: BasePath, value: Any) -> None:
+        ttl = config.metadata_cache_ttl
+        if ttl is None:
+            return
+        if not self.loaded:
+            self.load()
+        key = (kind, path)
+        self.entries[key] = (time.time() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > config.metadata_cache_size:
+            self.entries.popitem(last=False)
+
+    def seed(self, path: BasePath, stat: Optional[Stat]) -> None:
+        """Add a listing entry, where ``stat`` is None for directories."""
+        if config.metadata_cache_ttl is None:
+            return
+        if stat is None:
+            self.put("isdir", path.ensure_directory_like(), True)
+        else:
+            self.put("stat", path, stat)
+
+    def invalidate(self, path: BasePath) -> None:
+        """Forget what we know about ``path``, and whether its parents are directories."""
+        self.generation += 1
+        if not self.entries:
+            return
+        self.entries.pop(("stat", path), None)
+        while True:
+            dirpath = path.ensure_directory_like()
+            self.entries.pop(("isdir", dirpath), None)
+            self.entries.pop(("stat_or_isdir", path), None)
+            self.entries.pop(("stat_or_isdir", dirpath), None)
+            parent = path.parent
+            if parent == path:
+                break
+            path = parent
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.entries.clear()
+
+    def load(self) -> None:
+        self.loaded = True
+        if config.metadata_cache_file is None:
+            return
+        try:
+            with open(config.metadata_cache_file) as f:
+                state = json.load(f)
+            if state.get("__version__") != 1:
+                return
+        except Exception as e:
+            if config.debug_mode:
+                print(f"[boostedblob] Error while loading metadata cache: {e}", file=sys.stderr)
+            return
+        now = time.time()
+        for kind, path, expiration, value in state["entries"]:
+            if expiration < now:
+                continue
+            if kind == "stat":
+                value = _MISSING if value is None else CachedStat(**value)
+            self.entries.setdefault((kind, BasePath.from_str(path)), (expiration, value))
+
+    def save(self) -> None:
+        """Write unexpired entries to ``config.metadata_cache_file``, if it's set."""
+        if config.metadata_cache_file is None or not self.loaded:
+            return
+        now = time.time()
+        entries = []
+        for (kind, path), (expiration, value) in self.entries.items():
+            if expiration < now or kind not in ("stat", "isdir"):
+                continue
+            if kind == "stat":
+                value = None if value is _MISSING else CachedStat.to_dict(value)
+            entries.append([kind, str(path), expiration, value])
+        os.makedirs(os.path.dirname(os.path.abspath(config.metadata_cache_file)), exist_ok=True)
+        tmp_file = f"{config.metadata_cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"__version__": 1, "entries": entries}, f)
+        os.replace(tmp_file, config.metadata_cache_file)
+
+
+metadata_cache = MetadataCache()
+
+
+def metadata_cached(kind: str) -> Callable[[F], F]:
+    """Serve calls from ``metadata_cache``, and fill it with their results."""
+
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        async def wrapper(path: BasePath, *args: Any, **kwargs: Any) -> Any:
+            if config.metadata_cache_ttl is None or args or kwargs:
+                return await fn(path, *args, **kwargs)
+            # isdir treats "a/b" and "a/b/" the same
+            key = path.ensure_directory_like() if kind == "isdir" else path
+            value = metadata_cache.get(kind, key)
+            if value is not None:
+                registry.increment(f"metadata_cache.{kind}.hits")
+                if value is _MISSING:
+                    raise FileNotFoundError(path)
+                return value
+            registry.increment(f"metadata_cache.{kind}.misses")
+            generation = metadata_cache.generation
+            try:
+                value = await fn(path)
+            except FileNotFoundError:
+                if metadata_cache.generation == generation:
+                    metadata_cache.put(kind, key, _MISSING)
+                raise
+            if metadata_cache.generation == generation:
+                metadata_cache.put(kind, key, value)
+            return value
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def invalidates_metadata(fn: F) -> F:
+    """Remove the path ``fn`` modifies from ``metadata_cache``, once ``fn`` is done."""
+
+    @functools.wraps(fn)
+    async def wrapper(path: BasePath, *args: Any, **kwargs: Any) -> Any:
+        try:
+            return await fn(path, *args, **kwargs)
+        finally:
+            metadata_cache.invalidate(path)
+
+    return wrapper  # type: ignore[return-value]
+
+
 # ==============================
 # stat
 # ==============================
@@ -324,6 +550,25 @@ class GoogleStat(Stat):
         self.version = item["generation"]
 
 
+class CachedStat(Stat):
+    """A Stat loaded from a persisted metadata cache."""
+
+    def __init__(
+        self, size: int, mtime: float, ctime: float, md5: Optional[str], version: Optional[str]
+    ) -> None:
+        self.size = size
+        self.mtime = mtime
+        self.ctime = ctime
+        self.md5 = md5
+        self.version = version
+
+    @staticmethod
+    def to_dict(stat: Stat) -> Dict[str, Any]:
+        return dict(
+            size=stat.size, mtime=stat.mtime, ctime=stat.ctime, md5=stat.md5, version=stat.version
+        )
+
+
 class LocalStat(Stat):
     def __init__(self, item: os.stat_result) -> None:
         self.size = item.st_size
@@ -339,6 +584,8 @@ async def stat(path: Union[BasePath, str]) -> Stat:
 
 
 @stat.register  # type: ignore
+@metadata_cached("stat")
+@single_flight("stat")
 async def _azure_stat(path: AzurePath) -> AzureStat:
     if not path.blob:
         raise FileNotFoundError(path)
@@ -354,6 +601,8 @@ async def _azure_stat(path: AzurePath) -> AzureStat:
 
 
 @stat.register  # type: ignore
+@metadata_cached("stat")
+@single_flight("stat")
 async def _google_stat(path: GooglePath) -> GoogleStat:
     if not path.blob:
         raise FileNotFoundError(path)
@@ -403,6 +652,8 @@ async def isdir(path: Union[BasePath, str], raise_on_missing: bool = False) -> b
 
 
 @isdir.register  # type: ignore
+@metadata_cached("isdir")
+@single_flight("isdir")
 async def _azure_isdir(path: AzurePath) -> bool:
     try:
         if path.blob:
@@ -447,6 +698,8 @@ async def _azure_isdir(path: AzurePath) -> bool:
 
 
 @isdir.register  # type: ignore
+@metadata_cached("isdir")
+@single_flight("isdir")
 async def _google_isdir(path: GooglePath) -> bool:
     try:
         if path.blob:
@@ -507,6 +760,130 @@ async def _local_isfile(path: LocalPath) -> bool:
     return os.path.isfile(path)
 
 
+# ==============================
+# stat_or_isdir
+# ==============================
+
+# Blobs like "name.txt" sort between "name" and "name/", so we may need to skip a few entries
+_STAT_OR_ISDIR_PAGE_SIZE = 20
+
+
+@pathdispatch
+async def stat_or_isdir(path: Union[BasePath, str]) -> Tuple[Optional[Stat], bool]:
+    """Find out whether ``path`` is a file, a directory, both or neither.
+
+    For cloud paths, this uses a single listing request, instead of a stat and a listing. It may
+    need more if there are a lot of blobs that start with the name of ``path``.
+
+    :param path: The path to check.
+    :return: The stat of ``path`` if it's a file, otherwise None, and whether it's a directory.
+
+    """
+    raise ValueError(f"Unsupported path: {path}")
+
+
+def _classify_listed_name(blob: str, name: str) -> Optional[str]:
+    """Returns how ``name``, listed with prefix ``blob`` and delimiter "/", relates to ``blob``."""
+    if name == blob:
+        return "file"
+    dir_prefix = blob if blob.endswith("/") else blob + "/"
+    if name.startswith(dir_prefix):
+        return "dir"
+    if name > dir_prefix:
+        # Listings are sorted, so there's nothing relevant after this
+        return "past"
+    return None
+
+
+@stat_or_isdir.register  # type: ignore
+@metadata_cached("stat_or_isdir")
+async def _azure_stat_or_isdir(path: AzurePath) -> Tuple[Optional[Stat], bool]:
+    if not path.blob:
+        return None, await isdir(path)
+    it = azure_page_iterator(
+        Request(
+            method="GET",
+            url=path.format_url("https://{account}.blob.core.windows.net/{container}"),
+            params=dict(
+                comp="list",
+                restype="container",
+                prefix=path.blob,
+                delimiter="/",
+                maxresults=str(_STAT_OR_ISDIR_PAGE_SIZE),
+            ),
+            failure_exceptions={404: FileNotFoundError()},
+        )
+    )
+    stat: Optional[Stat] = None
+    is_dir = False
+    try:
+        async for result in it:
+            blobs = result.find("Blobs")
+            assert blobs is not None
+            done = False
+            for el in blobs:
+                kind = _classify_listed_name(path.blob, el.findtext("Name"))  # type: ignore
+                if kind == "file" and el.tag == "Blob":
+                    props = {p.tag: p.text for p in el.find("Properties")}  # type: ignore
+                    stat = AzureStat(props)
+                    # A directory marker blob means the directory exists
+                    is_dir = is_dir or path.blob.endswith("/")
+                elif kind is not None:
+                    is_dir = is_dir or kind == "dir"
+                    done = done or kind == "past"
+            if is_dir or done:
+                break
+    except FileNotFoundError:
+        # the storage account or container doesn't exist
+        return None, False
+    return stat, is_dir
+
+
+@stat_or_isdir.register  # type: ignore
+@metadata_cached("stat_or_isdir")
+async def _google_stat_or_isdir(path: GooglePath) -> Tuple[Optional[Stat], bool]:
+    if not path.blob:
+        return None, await isdir(path)
+    it = google_page_iterator(
+        Request(
+            method="GET",
+            url=path.format_url("https://storage.googleapis.com/storage/v1/b/{bucket}/o"),
+            params=dict(prefix=path.blob, delimiter="/", maxResults=str(_STAT_OR_ISDIR_PAGE_SIZE)),
+        )
+    )
+    stat: Optional[Stat] = None
+    is_dir = False
+    async for result in it:
+        done = False
+        for prefix in result.get("prefixes", []):
+            kind = _classify_listed_name(path.blob, prefix)
+            is_dir = is_dir or kind in ("dir", "file")
+            done = done or kind == "past"
+        for item in result.get("items", []):
+            kind = _classify_listed_name(path.blob, item["name"])
+            if kind == "file":
+                stat = GoogleStat(item)
+                # A directory marker blob means the directory exists
+                is_dir = is_dir or path.blob.endswith("/")
+            else:
+                is_dir = is_dir or kind == "dir"
+                done = done or kind == "past"
+        if is_dir or done:
+            break
+    return stat, is_dir
+
+
+@stat_or_isdir.register  # type: ignore
+async def _local_stat_or_isdir(path: LocalPath) -> Tuple[Optional[Stat], bool]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None, False
+    if stat_module.S_ISDIR(st.st_mode):
+        return None, True
+    return LocalStat(st), False
+
+
 # ==============================
 # exists
 # ==============================
@@ -519,11 +896,8 @@ async def exists(path: Union[BasePath, str]) -> int:
 
 @exists.register  # type: ignore
 async def _cloud_exists(path: CloudPath) -> int:
-    # TODO: this is two network requests, make it one
-    for fut in asyncio.as_completed([isfile(path), isdir(path)]):
-        if await fut:
-            return True
-    return False
+    stat, is_dir = await stat_or_isdir(path)
+    return stat is not None or is_dir
 
 
 @exists.register  # type: ignore
@@ -536,8 +910,14 @@ async def _local_exists(path: LocalPath) -> int:
 # ==============================
 
 
+@functools.lru_cache(maxsize=4096)
+def _url_quote(value: str) -> str:
+    # We format a URL for every chunk we transfer, often for the same blob
+    return urllib.parse.quote(value, safe="")
+
+
 def url_format(template: str, **data: Any) -> str:
-    escaped_data = {k: urllib.parse.quote(v, safe="") for k, v in data.items()}
+    escaped_data = {k: _url_quote(v) for k, v in data.items()}
     return template.format(**escaped_data)
 
 
@@ -1,17 +1,26 @@
 from __future__ import annotations
 
 import itertools
-from typing import Any, Iterator, Optional, Tuple, Union
+from typing import Any, Optional, Tuple, Union
 
 from .boost import (
     BoostExecutor,
     BoostUnderlying,
+    MappingBoostable,
     OrderedMappingBoostable,
     UnorderedMappingBoostable,
+    run_threaded,
 )
 from .globals import config
 from .path import AzurePath, BasePath, CloudPath, GooglePath, LocalPath, getsize, pathdispatch
-from .request import Request, azurify_request, execute_retrying_read, googlify_request
+from .request import (
+    Request,
+    azurify_request,
+    execute_retrying_read,
+    execute_retrying_readinto,
+    googlify_request,
+    hedge,
+)
 
 ByteRange = Tuple[int, int]
 OptByteRange = Tuple[Optional[int], Optional[int]]
@@ -35,37 +44,107 @@ async def read_byte_range(path: Union[CloudPath, str], byte_range: OptByteRange)
 
 @read_byte_range.register  # type: ignore
 async def _azure_read_byte_range(path: AzurePath, byte_range: OptByteRange) -> bytes:
+    request = _azure_read_request(path, byte_range)
+    return await hedge(
+        "read_byte_range", lambda: execute_retrying_read(request, sign=azurify_request)
+    )
+
+
+@read_byte_range.register  # type: ignore
+async def _google_read_byte_range(path: GooglePath, byte_range: OptByteRange) -> bytes:
+    request = _google_read_request(path, byte_range)
+    return await hedge(
+        "read_byte_range", lambda: execute_retrying_read(request, sign=googlify_request)
+    )
+
+
+def _azure_read_request(path: AzurePath, byte_range: OptByteRange) -> Request:
     range_str = byte_range_to_str(byte_range)
     range_header = {"Range": range_str} if range_str is not None else {}
     success_codes = (206,) if range_header else (200,)
-    request = await azurify_request(
-        Request(
-            method="GET",
-            url=path.format_url("https://{account}.blob.core.windows.net/{container}/{blob}"),
-            headers=range_header,
-            success_codes=success_codes,
-            failure_exceptions={404: FileNotFoundError(path)},
-        )
+    return Request(
+        method="GET",
+        url=path.format_url("https://{account}.blob.core.windows.net/{container}/{blob}"),
+        headers=range_header,
+        success_codes=success_codes,
+        failure_exceptions={404: FileNotFoundError(path)},
     )
-    return await execute_retrying_read(request)
 
 
-@read_byte_range.register  # type: ignore
-async def _google_read_byte_range(path: GooglePath, byte_range: OptByteRange) -> bytes:
+def _google_read_request(path: GooglePath, byte_range: OptByteRange) -> Request:
     range_str = byte_range_to_str(byte_range)
     range_header = {"Range": range_str} if range_str is not None else {}
     success_codes = (206,) if range_header else (200,)
-    request = await googlify_request(
-        Request(
-            method="GET",
-            url=path.format_url("https://storage.googleapis.com/storage/v1/b/{bucket}/o/{blob}"),
-            params=dict(alt="media"),
-            headers=range_header,
-            success_codes=success_codes,
-            failure_exceptions={404: FileNotFoundError(path)},
-        )
+    return Request(
+        method="GET",
+        url=path.format_url("https://storage.googleapis.com/storage/v1/b/{bucket}/o/{blob}"),
+        params=dict(alt="media"),
+        headers=range_header,
+        success_codes=success_codes,
+        failure_exceptions={404: FileNotFoundError(path)},
+    )
+
+
+# ==============================
+# read_byte_range_into
+# ==============================
+
+
+@pathdispatch
+async def read_byte_range_into(
+    path: Union[BasePath, str], byte_range: ByteRange, buffer: Union[bytearray, memoryview]
+) -> memoryview:
+    """Read the content of ``path`` in the given byte range into ``buffer``.
+
+    Unlike ``read_byte_range``, this doesn't allocate a new bytes object for each read, so you can
+    reuse buffers or read straight into your destination, e.g., an mmap of a file.
+
+    :param path: The path to read from.
+    :param byte_range: The byte range to read.
+    :param buffer: The buffer to read into. Must be large enough to hold the byte range.
+    :return: A view of the part of ``buffer`` that was read into.
+
+    """
+    raise ValueError(f"Unsupported path: {path}")
+
+
+# Note that if we hedge, both attempts read into the same buffer. That's okay, since the bytes we
+# write are the same.
+
+
+@read_byte_range_into.register  # type: ignore
+async def _azure_read_byte_range_into(
+    path: AzurePath, byte_range: ByteRange, buffer: Union[bytearray, memoryview]
+) -> memoryview:
+    request = _azure_read_request(path, byte_range)
+    return await hedge(
+        "read_byte_range", lambda: execute_retrying_readinto(request, buffer, sign=azurify_request)
     )
-    return await execute_retrying_read(request)
+
+
+@read_byte_range_into.register  # type: ignore
+async def _google_read_byte_range_into(
+    path: GooglePath, byte_range: ByteRange, buffer: Union[bytearray, memoryview]
+) -> memoryview:
+    request = _google_read_request(path, byte_range)
+    return await hedge(
+        "read_byte_range", lambda: execute_retrying_readinto(request, buffer, sign=googlify_request)
+    )
+
+
+@read_byte_range_into.register  # type: ignore
+async def _local_read_byte_range_into(
+    path: LocalPath, byte_range: ByteRange, buffer: Union[bytearray, memoryview]
+) -> memoryview:
+    start, end = byte_range
+    view = memoryview(buffer).cast("B")[: end - start]
+
+    def readinto() -> int:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.readinto(view)
+
+    return view[: await run_threaded(readinto)]
 
 
 # ==============================
@@ -101,13 +180,18 @@ async def _local_read_single(path: LocalPath) -> bytes:
 
 @pathdispatch
 async def read_stream(
-    path: Union[BasePath, str], executor: BoostExecutor, size: Optional[int] = None
+    path: Union[BasePath, str],
+    executor: BoostExecutor,
+    size: Optional[int] = None,
+    priority: int = 0,
 ) -> BoostUnderlying[bytes]:
     """Read the content of ``path``.
 
     :param path: The path to read from.
     :param executor: An executor.
     :param size: If specified, will save a network call.
+    :param priority: The priority of the read relative to other work on the executor. Use a
+        positive priority for latency sensitive reads.
     :return: The stream of bytes, chunking determined by ``config.chunk_size``.
 
     """
@@ -116,7 +200,7 @@ async def read_stream(
 
 @read_stream.register  # type: ignore
 async def _cloud_read_stream(
-    path: CloudPath, executor: BoostExecutor, size: Optional[int] = None
+    path: CloudPath, executor: BoostExecutor, size: Optional[int] = None, priority: int = 0
 ) -> OrderedMappingBoostable[Any, bytes]:
     if size is None:
         size = await getsize(path)
@@ -130,23 +214,35 @@ async def _cloud_read_stream(
     # Note that we purposefully don't do
     # https://docs.aiohttp.org/en/stable/client_quickstart.html#streaming-response-content
     # Doing that would stream data as we needed it, which is a little too lazy for our purposes
-    chunks = executor.map_ordered(lambda byte_range: read_byte_range(path, byte_range), byte_ranges)
+    chunks = executor.map_ordered(
+        lambda byte_range: read_byte_range(path, byte_range), byte_ranges, priority=priority
+    )
     return chunks
 
 
 @read_stream.register  # type: ignore
 async def _local_read_stream(
-    path: LocalPath, executor: BoostExecutor, size: Optional[int] = None
-) -> Iterator[bytes]:
-    def iterator() -> Iterator[bytes]:
+    path: LocalPath, executor: BoostExecutor, size: Optional[int] = None, priority: int = 0
+) -> MappingBoostable[Any, bytes]:
+    if size is None:
+        size = await getsize(path)
+
+    byte_ranges = itertools.zip_longest(
+        range(0, size, config.chunk_size),
+        range(config.chunk_size, size, config.chunk_size),
+        fillvalue=size,
+    )
+
+    def read_local_byte_range(byte_range: ByteRange) -> bytes:
+        start, end = byte_range
         with open(path, "rb") as f:
-            while True:
-                data = f.read(config.chunk_size)
-                if not data:
-                    return
-                yield data
+            f.seek(start)
+            return f.read(end - start)
 
-    return iterator()
+    # File reads release the GIL, so reading chunks in the executor's thread pool lets us read
+    # several chunks in parallel without blocking the event loop
+    chunks = executor.map_threaded(read_local_byte_range, byte_ranges, priority=priority)
+    return chunks
 
 
 # ==============================
@@ -1,20 +1,49 @@
 import asyncio
+import collections
 import contextlib
+import dataclasses
 import datetime
+import email.utils
+import functools
 import json
 import random
+import re
 import socket
 import sys
 import time
 import urllib.parse
 from dataclasses import dataclass, field
-from typing import Any, AsyncIterator, Dict, Iterator, Mapping, Optional, Sequence, Tuple
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import aiohttp
 
-from .globals import config
+from .azure_auth import OAUTH_TOKEN, SHARED_KEY, sign_request_with_shared_key
+from .boost import current_executor, default_weight
+from .globals import config, get_session
+from .metrics import RequestTiming
+from .tracing import current_tracer
 from .xml import dict_to_xml, etree
 
+T = TypeVar("T")
+
+# Status codes storage services use to tell us we're sending requests too fast
+THROTTLE_CODES = (429, 503)
+
 
 class MissingSession(Exception):
     pass
@@ -47,6 +76,18 @@ class Request:
 
         """
 
+        executor = current_executor()
+        adaptive = executor.adaptive if executor is not None else None
+        partition_key = (
+            get_partition_key(self.url)
+            if executor is not None and executor.has_partitions()
+            else None
+        )
+        host = get_hostname(self.url)
+        breaker = get_circuit_breaker(host)
+        budget = get_retry_budget()
+        if budget is not None:
+            budget.record_request()
         for attempt, backoff in enumerate(
             exponential_sleep_generator(
                 initial=config.backoff_initial,
@@ -54,9 +95,17 @@ class Request:
                 jitter_fraction=config.backoff_jitter_fraction,
             )
         ):
+            await wait_for_host(host)
+            if breaker is not None:
+                await breaker.wait(self)
+            throttle_delay = None
             async with contextlib.AsyncExitStack() as stack:
+                if partition_key is not None:
+                    assert executor is not None
+                    await stack.enter_async_context(executor.partition(partition_key))
                 try:
-                    resp = await stack.enter_async_context(self._raw_execute())
+                    start = time.monotonic()
+                    resp = await stack.enter_async_context(self._raw_execute(attempt))
                 except aiohttp.ClientConnectionError as e:
                     if isinstance(e, aiohttp.ClientConnectorError):
                         # azure accounts have unique urls and it's hard to tell apart
@@ -67,7 +116,15 @@ class Request:
                             if await _bad_hostname_check(hostname):
                                 raise FileNotFoundError(hostname) from None
                     error = RequestFailure(reason=type(e).__name__ + ": " + str(e), request=self)
+                    if breaker is not None:
+                        breaker.record(ok=False)
                 else:
+                    if adaptive is not None:
+                        adaptive.record_request(
+                            time.monotonic() - start, resp.status in THROTTLE_CODES
+                        )
+                    if breaker is not None:
+                        breaker.record(ok=resp.status not in self.retry_codes)
                     if resp.status in self.success_codes:
                         yield resp
                         return
@@ -80,17 +137,28 @@ class Request:
                     error = RequestFailure(reason=reason, request=self, status=resp.status)
                     if resp.status not in self.retry_codes:
                         raise self.failure_exceptions.get(resp.status, error)
+                    throttle_delay = get_throttle_delay(resp, backoff)
 
             if attempt >= config.retry_limit:
                 raise error
+            if budget is not None and not budget.try_retry():
+                error.reason += "\nNot retried, since too many requests are failing (retry budget)"
+                raise error
 
+            if throttle_delay is not None:
+                backoff = throttle_delay
             if config.debug_mode or attempt + 1 >= 3:
                 print(
                     f"[boostedblob] Error when executing request on attempt {attempt + 1}, "
                     f"sleeping for {backoff:.1f}s before retrying. Details:\n{error}",
                     file=sys.stderr,
                 )
-            await asyncio.sleep(backoff)
+            if throttle_delay is not None:
+                # The service is throttling us, so back off together with every other request to
+                # this host. We wait for the host at the start of the next attempt.
+                pause_host(host, throttle_delay)
+            else:
+                await asyncio.sleep(backoff)
 
     async def execute_reponseless(self) -> None:
         """Helper to execute the request when we don't have further need of the response."""
@@ -98,13 +166,26 @@ class Request:
             pass
 
     @contextlib.asynccontextmanager
-    async def _raw_execute(self) -> AsyncIterator[aiohttp.ClientResponse]:
-        """Actually execute the request, with no extra fluff."""
-        if config.session is None:
+    async def _raw_execute(self, attempt: int = 0) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Actually execute the request, with no extra fluff.
+
+        ``attempt`` is only used to count retries in our metrics.
+
+        """
+        session = get_session()
+        if session is None:
             raise MissingSession(
                 "No session available, use `async with session_context()` or `@ensure_session`"
             )
-        ctx = config.session.request(
+        executor = current_executor()
+        if executor is not None and executor.has_rate_limits():
+            await executor.rate_limit(
+                get_hostname(self.url), requests=1, nbytes=default_weight(self.data)
+            )
+        timing = RequestTiming()
+        tracer = current_tracer()
+        span = tracer.begin("requests") if tracer is not None else None
+        ctx = session.request(
             method=self.method,
             url=self.url,
             params=self.params,
@@ -117,18 +198,26 @@ class Request:
             # Figuring out that some requests break because aiohttp adds some headers
             # automatically was not fun
             skip_auto_headers={"Content-Type"},
+            trace_request_ctx=timing,
         )
         if config.debug_mode:
             print(f"[boostedblob] Making request: {self}", file=sys.stderr)
             now = time.time()
-        async with ctx as resp:
-            if config.debug_mode:
-                duration = time.time() - now
-                print(
-                    f"[boostedblob] Completed request, took {duration:.3f}s: {self}",
-                    file=sys.stderr,
-                )
-            yield resp
+        try:
+            async with ctx as resp:
+                if config.debug_mode:
+                    duration = time.time() - now
+                    print(
+                        f"[boostedblob] Completed request, took {duration:.3f}s: {self}",
+                        file=sys.stderr,
+                    )
+                yield resp
+        finally:
+            timing.finish(attempt)
+            if tracer is not None and span is not None:
+                name = f"{self.method} {get_hostname(self.url)}"
+                args = {"status": timing.status, "attempt": attempt}
+                tracer.end("requests", name, *span, args=args)
 
 
 class RequestFailure(Exception):
@@ -140,12 +229,78 @@ class RequestFailure(Exception):
     def __str__(self) -> str:
         return f"Reason: {self.reason}\nRequest: {self.request}\nStatus: {self.status}"
 
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # Make sure we can be sent back from worker processes (see sharding.py). Leave out the
+        # data, which may not be picklable, and the headers, which may contain credentials.
+        request = dataclasses.replace(self.request, data=None, headers={})
+        return (type(self), (self.reason, request, self.status))
+
+
+async def execute_retrying_read(
+    request: Request, sign: Optional[Callable[[Request], Awaitable[Request]]] = None
+) -> bytes:
+    """Execute the request and read the response body, retrying if reading the body fails.
+
+    If ``sign`` is given, ``request`` should be an unsigned read of a blob, and ``sign`` is used to
+    sign each request we make. This lets us resume a read that fails partway: we keep the bytes we
+    received and request the rest with a narrowed Range header. To make sure the blob hasn't
+    changed in the meantime, we make the request conditional on the ETag (or GCS generation) of the
+    first response. If it has changed, we raise a RequestFailure with status 412.
 
-async def execute_retrying_read(request: Request) -> bytes:
+    """
+    chunks: List[bytes] = []
+
+    def sink(offset: int, chunk: bytes) -> None:
+        if offset == 0:
+            # We're starting over
+            chunks.clear()
+        chunks.append(chunk)
+
+    await _execute_retrying_read(request, sign, sink)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+
+async def execute_retrying_readinto(
+    request: Request,
+    buffer: Union[bytearray, memoryview],
+    sign: Optional[Callable[[Request], Awaitable[Request]]] = None,
+) -> memoryview:
+    """Like ``execute_retrying_read``, but reads the response body into ``buffer``.
+
+    This saves allocating and joining a new bytes object per response, and lets callers read
+    directly into their destination, e.g., an mmap of the file they're downloading to.
+
+    :return: A view of the part of ``buffer`` that was read into.
+
+    """
+    view = memoryview(buffer).cast("B")
+
+    def sink(offset: int, chunk: bytes) -> None:
+        end = offset + len(chunk)
+        if end > len(view):
+            raise ValueError(f"Response to {request} is larger than buffer of size {len(view)}")
+        view[offset:end] = chunk
+
+    received = await _execute_retrying_read(request, sign, sink)
+    return view[:received]
+
+
+async def _execute_retrying_read(
+    request: Request,
+    sign: Optional[Callable[[Request], Awaitable[Request]]],
+    sink: Callable[[int, bytes], None],
+) -> int:
+    """Passes each chunk of the response body to ``sink``, along with its offset in the body.
+
+    If we start over, offsets start over from zero. Returns the size of the body.
+
+    """
     # Retrying aiohttp.ServerTimeoutError is pretty straightforward
     # ClientPayloadError might be an aiohttp bug, see:
     # https://github.com/aio-libs/aiohttp/issues/4581
     # https://github.com/aio-libs/aiohttp/issues/3904#issuecomment-737094416
+    received = 0
+    validator: Optional[Tuple[str, str]] = None
     for attempt, backoff in enumerate(
         exponential_sleep_generator(
             initial=config.backoff_initial,
@@ -153,12 +308,49 @@ async def execute_retrying_read(request: Request) -> bytes:
             jitter_fraction=config.backoff_jitter_fraction,
         )
     ):
+        current = request
+        if received:
+            assert validator is not None
+            resumed = resume_read_request(request, received, validator)
+            assert resumed is not None
+            current = resumed
+        if sign is not None:
+            current = await sign(current)
+        expected: Optional[int] = None
         try:
-            async with request.execute() as resp:
-                return await resp.read()
+            async with current.execute() as resp:
+                if sign is not None and validator is None:
+                    validator = get_read_validator(resp)
+                if resp.content_length is not None:
+                    expected = received + resp.content_length
+                async for chunk in resp.content.iter_any():
+                    sink(received, chunk)
+                    received += len(chunk)
+        except RequestFailure as e:
+            if e.status == 412 and received:
+                raise RequestFailure(
+                    reason="Blob was modified while we were reading it",
+                    request=e.request,
+                    status=412,
+                ) from None
+            raise
         except (aiohttp.ServerTimeoutError, aiohttp.ClientPayloadError) as error:
+            if expected is not None and received >= expected:
+                # We got everything, the error must have been right at the end
+                return received
+            if (
+                sign is None
+                or validator is None
+                or resume_read_request(request, received, validator) is None
+            ):
+                # We can't resume, so start again from scratch
+                received = 0
+
             if attempt >= config.retry_limit:
                 raise
+            budget = get_retry_budget()
+            if budget is not None and not budget.try_retry():
+                raise
 
             if config.debug_mode or attempt + 1 >= 3:
                 print(
@@ -167,46 +359,409 @@ async def execute_retrying_read(request: Request) -> bytes:
                     file=sys.stderr,
                 )
             await asyncio.sleep(backoff)
+            continue
+
+        executor = current_executor()
+        if executor is not None and executor.has_rate_limits():
+            # We don't know how much we'll download until we do, so we count the bytes
+            # afterwards. This still delays us and subsequent requests enough that we keep to
+            # the limit on average.
+            hostname = get_hostname(request.url)
+            await executor.rate_limit(hostname, nbytes=received)
+        return received
     raise AssertionError
 
 
+def get_read_validator(resp: aiohttp.ClientResponse) -> Optional[Tuple[str, str]]:
+    """Returns what identifies the version of the blob being read, if anything."""
+    generation = resp.headers.get("x-goog-generation")
+    if generation is not None:
+        return ("generation", generation)
+    etag = resp.headers.get("ETag")
+    if etag is not None:
+        return ("etag", etag)
+    return None
+
+
+def resume_read_request(
+    request: Request, offset: int, validator: Tuple[str, str]
+) -> Optional[Request]:
+    """Returns a request for the rest of what ``request`` reads, after the first ``offset`` bytes.
+
+    The returned request fails with a 412 if the blob no longer matches ``validator``. Returns None
+    if we can't resume ``request``.
+
+    """
+    range_str = request.headers.get("Range")
+    if range_str is None:
+        start, end = 0, ""
+    else:
+        # We can't resume suffix ranges, since we don't know the size of the blob
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", range_str)
+        if match is None:
+            return None
+        start, end = int(match.group(1)), match.group(2)
+    headers = dict(request.headers)
+    headers["Range"] = f"bytes={start + offset}-{end}"
+    params = dict(request.params)
+    kind, value = validator
+    if kind == "generation":
+        params["ifGenerationMatch"] = value
+    else:
+        headers["If-Match"] = value
+    return dataclasses.replace(request, params=params, headers=headers, success_codes=(206,))
+
+
+# ==============================
+# retry budget and circuit breaker
+# ==============================
+
+
+class CircuitBreakerOpen(RequestFailure):
+    """Raised instead of making a request to a host that is failing too many requests.
+
+    Only raised if ``config.circuit_breaker_fail_fast`` is set, otherwise we wait for the circuit
+    breaker to close.
+
+    """
+
+
+class RetryBudget:
+    """Limits retries to a fraction of the requests made in the last ``window`` seconds.
+
+    Without this, if a service starts failing, every request in flight keeps retrying, adding load
+    to a service that is already struggling. ``min_per_second`` retries are always allowed, so that
+    the occasional failure is retried even if we aren't making many requests.
+
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, window: float = 10.0) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self.requests: Deque[float] = collections.deque()
+        self.retries: Deque[float] = collections.deque()
+
+    def prune(self, now: float) -> None:
+        cutoff = now - self.window
+        while self.requests and self.requests[0] < cutoff:
+            self.requests.popleft()
+        while self.retries and self.retries[0] < cutoff:
+            self.retries.popleft()
+
+    def record_request(self) -> None:
+        now = time.monotonic()
+        self.prune(now)
+        self.requests.append(now)
+
+    def try_retry(self) -> bool:
+        """Returns whether we may retry, and if so, counts the retry against the budget."""
+        now = time.monotonic()
+        self.prune(now)
+        allowed = self.ratio * len(self.requests) + self.min_per_second * self.window
+        if len(self.retries) >= allowed:
+            return False
+        self.retries.append(now)
+        return True
+
+
+class CircuitBreaker:
+    """Tracks how many recent requests to a host failed, and pauses traffic to it if too many do.
+
+    Once at least ``threshold`` of the requests in the last ``window`` seconds have failed (and we
+    have made at least ``min_requests``), the breaker opens for ``cooldown`` seconds. This doubles
+    each time the breaker opens again before requests start succeeding, up to
+    ``config.backoff_max``.
+
+    """
+
+    def __init__(
+        self,
+        host: str,
+        threshold: float,
+        window: float = 10.0,
+        min_requests: int = 20,
+        cooldown: float = 1.0,
+    ) -> None:
+        self.host = host
+        self.threshold = threshold
+        self.window = window
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.outcomes: Deque[Tuple[float, bool]] = collections.deque()
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+
+    def record(self, ok: bool) -> None:
+        now = time.monotonic()
+        cutoff = now - self.window
+        while self.outcomes and self.outcomes[0][0] < cutoff:
+            if not self.outcomes.popleft()[1]:
+                self.failures -= 1
+        self.outcomes.append((now, ok))
+        if not ok:
+            self.failures += 1
+        if len(self.outcomes) < self.min_requests:
+            return
+        if self.failures < self.threshold * len(self.outcomes):
+            self.trips = 0
+        elif now >= self.open_until:
+            self.trip(now)
+
+    def trip(self, now: float) -> None:
+        cooldown = min(self.cooldown * 2**self.trips, config.backoff_max)
+        self.trips += 1
+        self.open_until = now + cooldown
+        # Judge the host afresh once we resume
+        self.outcomes.clear()
+        self.failures = 0
+        print(
+            f"[boostedblob] Too many requests to {self.host} are failing, pausing requests to it "
+            f"for {cooldown:.1f}s",
+            file=sys.stderr,
+        )
+
+    async def wait(self, request: Request) -> None:
+        delay = self.open_until - time.monotonic()
+        if delay <= 0:
+            return
+        if config.circuit_breaker_fail_fast:
+            raise CircuitBreakerOpen(
+                reason=f"Too many requests to {self.host} are failing", request=request
+            )
+        await asyncio.sleep(delay)
+
+
+_retry_budget: Optional[RetryBudget] = None
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_retry_budget() -> Optional[RetryBudget]:
+    """Returns the retry budget shared by all requests, if enabled."""
+    global _retry_budget
+    if config.retry_budget_ratio is None:
+        return None
+    if (
+        _retry_budget is None
+        or _retry_budget.ratio != config.retry_budget_ratio
+        or _retry_budget.min_per_second != config.retry_budget_min_per_second
+    ):
+        _retry_budget = RetryBudget(config.retry_budget_ratio, config.retry_budget_min_per_second)
+    return _retry_budget
+
+
+def get_circuit_breaker(host: str) -> Optional[CircuitBreaker]:
+    """Returns the circuit breaker for ``host``, if enabled."""
+    if config.circuit_breaker_threshold is None:
+        return None
+    breaker = _circuit_breakers.get(host)
+    if breaker is None or breaker.threshold != config.circuit_breaker_threshold:
+        breaker = CircuitBreaker(host, config.circuit_breaker_threshold)
+        _circuit_breakers[host] = breaker
+    return breaker
+
+
+# ==============================
+# throttling
+# ==============================
+
+
+# When requests to each host may resume, see pause_host
+_host_resume_at: Dict[str, float] = {}
+
+
+def pause_host(host: str, delay: float) -> None:
+    """Hold back all requests to ``host`` for ``delay`` seconds."""
+    resume_at = time.monotonic() + delay
+    if resume_at > _host_resume_at.get(host, 0.0):
+        _host_resume_at[host] = resume_at
+
+
+async def wait_for_host(host: str) -> None:
+    # The pause might get extended while we wait
+    while True:
+        delay = _host_resume_at.get(host, 0.0) - time.monotonic()
+        if delay <= 0:
+            return
+        await asyncio.sleep(delay)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Returns how many seconds the service asked us to wait for, if it did."""
+    for header in ("x-ms-retry-after-ms", "retry-after-ms"):
+        value = headers.get(header)
+        if value is not None:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # Retry-After can also be an HTTP date
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+
+
+def get_throttle_delay(resp: aiohttp.ClientResponse, backoff: float) -> Optional[float]:
+    """Returns how long to pause all requests to the host for, if ``resp`` says we're throttled.
+
+    If the service tells us how long to wait for, we use that, otherwise we fall back to
+    ``backoff``. Responses that fail for reasons other than throttling return None.
+
+    """
+    if resp.status not in THROTTLE_CODES:
+        return None
+    delay = parse_retry_after(resp.headers)
+    if delay is None:
+        # A 503 isn't necessarily throttling, unless Azure tells us it is
+        if resp.status != 429 and resp.headers.get("x-ms-error-code") != "ServerBusy":
+            return None
+        delay = backoff
+    return min(max(delay, 0.0), config.backoff_max)
+
+
+# ==============================
+# hedging
+# ==============================
+
+
+class LatencyTracker:
+    """Keeps a sliding window of latencies, so we can tell when a request is straggling."""
+
+    def __init__(self, window: int = 1000, min_samples: int = 20) -> None:
+        self.latencies: Deque[float] = collections.deque(maxlen=window)
+        self.min_samples = min_samples
+        self.sorted: List[float] = []
+        self.stale = 0
+
+    def record(self, latency: float) -> None:
+        self.latencies.append(latency)
+        self.stale += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.latencies) < self.min_samples:
+            return None
+        # Re-sorting on every request would be wasteful, percentiles don't move that fast
+        if self.stale >= max(1, len(self.sorted) // 32):
+            self.sorted = sorted(self.latencies)
+            self.stale = 0
+        return self.sorted[min(len(self.sorted) - 1, int(p * len(self.sorted)))]
+
+
+_latency_trackers: Dict[str, LatencyTracker] = collections.defaultdict(LatencyTracker)
+# Counts of requests that could have been hedged, and those that we did hedge
+_hedge_counts = {"requests": 0, "hedges": 0}
+
+
+async def hedge(kind: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """Call ``fn``, calling it again if the first call is straggling, and return the first result.
+
+    ``fn`` must be safe to call more than once concurrently. Calls are compared against recent
+    calls of the same ``kind``; a call is considered straggling once it takes longer than
+    ``config.hedge_percentile`` of those. To keep the extra load we place on the service bounded,
+    we hedge at most ``config.hedge_max_overhead`` of requests.
+
+    """
+    if config.hedge_percentile is None:
+        return await fn()
+
+    tracker = _latency_trackers[kind]
+    threshold = tracker.percentile(config.hedge_percentile)
+    _hedge_counts["requests"] += 1
+    start = time.monotonic()
+
+    tasks = [asyncio.ensure_future(fn())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=threshold)
+        if (
+            not done
+            and _hedge_counts["hedges"] < config.hedge_max_overhead * _hedge_counts["requests"]
+        ):
+            _hedge_counts["hedges"] += 1
+            if config.debug_mode:
+                print(
+                    f"[boostedblob] Hedging {kind} request after {threshold:.3f}s", file=sys.stderr
+                )
+            tasks.append(asyncio.ensure_future(fn()))
+
+        # Use the first successful result. Only raise if all of our attempts fail.
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    tracker.record(time.monotonic() - start)
+                    return task.result()
+            if not pending:
+                # re-raise the exception from our original attempt
+                return tasks[0].result()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
 # ==============================
 # cloud specific utilities
 # ==============================
 
 
-async def azurify_request(request: Request, auth: Optional[Tuple[str, str]] = None) -> Request:
-    """Return a Request that can be submitted to Azure Blob."""
-    u = urllib.parse.urlparse(request.url)
+@functools.lru_cache(maxsize=4096)
+def _parse_azure_url(url: str) -> Tuple[str, Optional[str]]:
+    """Returns the account and container a request to ``url`` is made against."""
+    u = urllib.parse.urlparse(url)
     account = u.netloc.split(".")[0]
     parts = u.path.split("/", maxsplit=2)
     container = parts[1] if len(parts) >= 2 else None
+    return account, container
+
+
+_ms_date_cache: Tuple[int, str] = (-1, "")
+
+
+def _get_ms_date() -> str:
+    # Formatting the date shows up when profiling uploads, and it only changes once a second
+    global _ms_date_cache
+    now = int(time.time())
+    if _ms_date_cache[0] != now:
+        _ms_date_cache = (now, time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(now)))
+    return _ms_date_cache[1]
+
+
+def _copy_request(request: Request, **changes: Any) -> Request:
+    # Like dataclasses.replace, but without going through __init__, which is slow for frozen
+    # dataclasses. We create a couple Requests for every chunk we transfer.
+    result: Request = object.__new__(Request)
+    result.__dict__.update(request.__dict__, **changes)
+    return result
+
+
+async def azurify_request(request: Request, auth: Optional[Tuple[str, str]] = None) -> Request:
+    """Return a Request that can be submitted to Azure Blob."""
     if auth is None:
-        auth = await config.azure_access_token_manager.get_token(key=(account, container))
+        auth = await config.azure_access_token_manager.get_token(key=_parse_azure_url(request.url))
     assert auth is not None
     kind, token = auth
 
     headers = dict(request.headers)
     # https://docs.microsoft.com/en-us/rest/api/storageservices/previous-azure-storage-service-versions
     headers["x-ms-version"] = "2021-06-08"
-    headers["x-ms-date"] = datetime.datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S GMT")
-
-    from .azure_auth import OAUTH_TOKEN, SHARED_KEY, sign_request_with_shared_key
+    headers["x-ms-date"] = _get_ms_date()
 
     data = request.data
     if data is not None and not isinstance(data, (bytes, bytearray)):
         data = dict_to_xml(data)
 
-    result = Request(
-        method=request.method,
-        url=request.url,
-        params=request.params,
-        headers=headers,
-        data=data,
-        success_codes=request.success_codes,
-        retry_codes=request.retry_codes,
-        failure_exceptions=request.failure_exceptions,
-    )
+    result = _copy_request(request, headers=headers, data=data)
 
     # mutate headers to add the authorization header to result
     if kind == SHARED_KEY:
@@ -232,34 +787,14 @@ async def googlify_request(request: Request, access_token: Optional[str] = None)
     if data is not None and not isinstance(data, (bytes, bytearray)):
         data = json.dumps(data).encode("utf8")
 
-    return Request(
-        method=request.method,
-        url=request.url,
-        params=request.params,
-        headers=headers,
-        data=data,
-        success_codes=request.success_codes,
-        retry_codes=request.retry_codes,
-        failure_exceptions=request.failure_exceptions,
-    )
+    return _copy_request(request, headers=headers, data=data)
 
 
 async def azure_page_iterator(request: Request) -> AsyncIterator[etree.Element]:
     params = dict(request.params)
     while True:
-        request = Request(
-            method=request.method,
-            url=request.url,
-            params=params,
-            data=request.data,
-            headers=request.headers,
-            success_codes=request.success_codes,
-            retry_codes=request.retry_codes,
-            failure_exceptions=request.failure_exceptions,
-        )
-
-        request = await azurify_request(request)
-        body = await execute_retrying_read(request)
+        page_request = await azurify_request(_copy_request(request, params=params))
+        body = await execute_retrying_read(page_request)
 
         result = etree.fromstring(body)
         yield result
@@ -273,17 +808,10 @@ async def azure_page_iterator(request: Request) -> AsyncIterator[etree.Element]:
 async def google_page_iterator(request: Request) -> AsyncIterator[Dict[str, Any]]:
     params = dict(request.params)
     while True:
-        request = Request(
-            method=request.method,
-            url=request.url,
-            params=params,
-            headers=request.headers,
-            success_codes=(200, 404),
-            retry_codes=request.retry_codes,
-            failure_exceptions=request.failure_exceptions,
+        page_request = await googlify_request(
+            _copy_request(request, params=params, data=None, success_codes=(200, 404))
         )
-        request = await googlify_request(request)
-        async with request.execute() as resp:
+        async with page_request.execute() as resp:
             if resp.status == 404:
                 return
             result = await resp.json()
@@ -298,6 +826,25 @@ async def google_page_iterator(request: Request) -> AsyncIterator[Dict[str, Any]
 # ==============================
 
 
+@functools.lru_cache(maxsize=4096)
+def get_hostname(url: str) -> str:
+    return urllib.parse.urlparse(url).hostname or ""
+
+
+def get_partition_key(url: str) -> str:
+    """Return the storage account, bucket or host a request to ``url`` is made against."""
+    u = urllib.parse.urlsplit(url)
+    hostname = u.hostname or ""
+    if hostname.endswith(".blob.core.windows.net"):
+        return "az://" + hostname.split(".")[0]
+    if hostname == "storage.googleapis.com":
+        # e.g. /storage/v1/b/{bucket}/o/{blob} or /upload/storage/v1/b/{bucket}/o
+        parts = u.path.split("/", maxsplit=6)
+        if "b" in parts[:-1]:
+            return "gs://" + urllib.parse.unquote(parts[parts.index("b") + 1])
+    return hostname
+
+
 def exponential_sleep_generator(
     initial: float, maximum: float, jitter_fraction: float, multiplier: float = 2
 ) -> Iterator[float]:
@@ -0,0 +1,164 @@
+"""Split work across several processes, each with its own event loop and session.
+
+A single event loop is limited to one core, and TLS, XML parsing and hashing can saturate it well
+before the network does. ``sharded_map`` runs the listing in the calling process and sends batches
+of work to worker processes. The worker processes split the calling executor's concurrency and
+rate limits between them.
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, TypeVar
+
+from .boost import BoostExecutor, BoostUnderlying, iter_underlying
+from .globals import (
+    TokenManager,
+    _create_session,
+    _loop_sessions,
+    config,
+    set_event_loop_exception_handler,
+)
+
+A = TypeVar("A")
+T = TypeVar("T")
+
+# How long to wait for a batch to fill up before sending it to a worker anyway
+BATCH_MAX_DELAY = 0.1
+
+
+# ==============================
+# worker
+# ==============================
+
+
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+_worker_executor: Optional[BoostExecutor] = None
+
+
+def _init_worker(
+    concurrency: int,
+    max_rps: Optional[float],
+    bwlimit: Optional[float],
+    config_overrides: Dict[str, Any],
+) -> None:
+    global _worker_loop, _worker_executor
+    config.__dict__.update(config_overrides)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def setup() -> BoostExecutor:
+        set_event_loop_exception_handler()
+        _loop_sessions[loop] = _create_session()
+        executor = BoostExecutor(concurrency, max_rps=max_rps, bwlimit=bwlimit)
+        return await executor.__aenter__()
+
+    # The session and executor live for as long as the worker, so connections stay warm across
+    # batches. They're cleaned up when the process exits.
+    _worker_executor = loop.run_until_complete(setup())
+    _worker_loop = loop
+    atexit.register(_shutdown_worker)
+
+
+def _shutdown_worker() -> None:
+    assert _worker_loop is not None and _worker_executor is not None
+    loop = _worker_loop
+    executor = _worker_executor
+
+    async def teardown() -> None:
+        try:
+            await executor.__aexit__(None, None, None)
+        finally:
+            await _loop_sessions.pop(loop).close()
+
+    loop.run_until_complete(teardown())
+    loop.close()
+
+
+def _run_batch(fn: Callable[[A, BoostExecutor], Awaitable[T]], batch: List[A]) -> List[T]:
+    assert _worker_loop is not None and _worker_executor is not None
+    executor = _worker_executor
+
+    async def run() -> List[T]:
+        return [
+            x async for x in executor.map_unordered(lambda item: fn(item, executor), iter(batch))
+        ]
+
+    return _worker_loop.run_until_complete(run())
+
+
+# ==============================
+# sharded_map
+# ==============================
+
+
+async def sharded_map(
+    executor: BoostExecutor,
+    workers: int,
+    fn: Callable[[A, BoostExecutor], Awaitable[T]],
+    iterable: BoostUnderlying[A],
+    batch_size: Optional[int] = None,
+) -> AsyncIterator[T]:
+    """Like ``executor.map_unordered``, but runs ``fn`` in ``workers`` worker processes.
+
+    Yields results as the batches containing them complete. If any call to ``fn`` raises, the
+    remaining batches are cancelled and the exception is raised here.
+
+    :param executor: The executor used to consume ``iterable``. Its concurrency and rate limits
+        are split evenly between the workers.
+    :param workers: The number of worker processes.
+    :param fn: Called in a worker as ``fn(item, worker_executor)``. Both ``fn`` and the items must
+        be picklable, so use module level functions or ``functools.partial`` of them.
+    :param iterable: The items to map over.
+    :param batch_size: How many items to send to a worker at a time. Defaults to a few times the
+        worker concurrency.
+
+    """
+    assert workers > 0
+    concurrency = max(1, executor.concurrency // workers)
+    limiter = executor.request_limiter
+    max_rps = limiter.rate / workers if limiter is not None else None
+    limiter = executor.byte_limiter
+    bwlimit = limiter.rate / workers if limiter is not None else None
+    config_overrides = {
+        k: v
+        for k, v in config.__dict__.items()
+        if k != "session" and not isinstance(v, TokenManager)
+    }
+    if batch_size is None:
+        batch_size = 4 * concurrency
+
+    pool = ProcessPoolExecutor(
+        workers,
+        # Forking a process with a running event loop and other threads isn't safe
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(concurrency, max_rps, bwlimit, config_overrides),
+    )
+    pending: Set[asyncio.Future[List[T]]] = set()
+    try:
+        batches = executor.batch(iterable, max_items=batch_size, max_delay=BATCH_MAX_DELAY)
+        async for batch in iter_underlying(batches):
+            pending.add(asyncio.wrap_future(pool.submit(_run_batch, fn, batch)))
+            # Keep a couple of batches queued per worker, so workers don't wait on us
+            while pending and (len(pending) >= 2 * workers or any(fut.done() for fut in pending)):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    for x in fut.result():
+                        yield x
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                for x in fut.result():
+                    yield x
+    finally:
+        for fut in pending:
+            fut.cancel()
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(pool.shutdown, wait=True)
+        )
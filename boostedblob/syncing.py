@@ -1,15 +1,17 @@
 import asyncio
+import functools
 import os
 import re
 import sys
 from dataclasses import dataclass
-from typing import AsyncIterator, Iterator, List, Optional, Tuple, Union
+from typing import AsyncIterable, AsyncIterator, Iterator, List, Optional, Tuple, Union
 
 from .boost import BoostExecutor
 from .copying import copyfile
 from .delete import remove
 from .listing import DirEntry, scantree
 from .path import BasePath, LocalPath, Stat
+from .sharding import sharded_map
 
 
 @dataclass(frozen=True)
@@ -99,12 +101,37 @@ def sync_files_action_iterator(
 # ==============================
 
 
+async def _sync_action(
+    src: BasePath, dst: BasePath, delete: bool, action: Action, executor: BoostExecutor
+) -> Optional[BasePath]:
+    if isinstance(action, CopyAction):
+        src_file = src / action.relpath
+        dst_file = dst / action.relpath
+        try:
+            await copyfile(src_file, dst_file, executor, size=action.size, overwrite=True)
+            return src_file
+        except FileNotFoundError as e:
+            print(
+                "[boostedblob] File disappeared while syncing, ignoring. Likely due to "
+                f"concurrent deletion: {e}",
+                file=sys.stderr,
+            )
+        return None
+    if isinstance(action, DeleteAction):
+        if delete:
+            dst_file = dst / action.relpath
+            await remove(dst_file)
+            return dst_file
+    return None
+
+
 async def sync(
     src: Union[str, BasePath],
     dst: Union[str, BasePath],
     executor: BoostExecutor,
     delete: bool = False,
     exclude: Optional[str] = None,
+    workers: int = 1,
 ) -> AsyncIterator[BasePath]:
     """Syncs the tree rooted at ``src`` to ``dst``.
 
@@ -114,6 +141,8 @@ async def sync(
     :param dst: The root of the tree to sync to.
     :param executor: An executor.
     :param delete: Whether to delete files present in the destination but missing in the source.
+    :param workers: If more than one, split the copies and deletes across this many worker
+        processes. See ``sharding.sharded_map``.
 
     """
     src_obj = src if isinstance(src, BasePath) else BasePath.from_str(src)
@@ -124,37 +153,14 @@ async def sync(
     if src_obj.is_relative_to(dst_obj) or dst_obj.is_relative_to(src_obj):
         raise ValueError("Cannot sync overlapping directories")
 
-    async def copy_wrapper(relpath: str, size: Optional[int]) -> Optional[BasePath]:
-        src_file = src_obj / relpath
-        dst_file = dst_obj / relpath
-        try:
-            await copyfile(src_file, dst_file, executor, size=size, overwrite=True)
-            return src_file
-        except FileNotFoundError as e:
-            print(
-                "[boostedblob] File disappeared while syncing, ignoring. Likely due to "
-                f"concurrent deletion: {e}",
-                file=sys.stderr,
-            )
-        return None
-
-    async def delete_wrapper(relpath: str) -> BasePath:
-        dst_file = dst_obj / relpath
-        await remove(dst_file)
-        return dst_file
-
-    async def action_wrapper(action: Action) -> Optional[BasePath]:
-        if isinstance(action, CopyAction):
-            return await copy_wrapper(action.relpath, action.size)
-        if isinstance(action, DeleteAction):
-            if delete:
-                return await delete_wrapper(action.relpath)
-        return None
-
-    actions = executor.map_unordered(
-        action_wrapper, await sync_action_iterator(src_obj, dst_obj, exclude=exclude)
-    )
-    async for path in actions:
+    do_action = functools.partial(_sync_action, src_obj, dst_obj, delete)
+    actions = await sync_action_iterator(src_obj, dst_obj, exclude=exclude)
+    results: AsyncIterable[Optional[BasePath]]
+    if workers > 1:
+        results = sharded_map(executor, workers, do_action, actions)
+    else:
+        results = executor.map_unordered(lambda a: do_action(a, executor), actions)
+    async for path in results:
         if path is not None:
             yield path
 
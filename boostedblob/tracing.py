@@ -0,0 +1,166 @@
+"""Record what boostedblob is doing as a timeline, in Chrome Trace Event format.
+
+The resulting file can be opened in https://ui.perfetto.dev or chrome://tracing. It contains:
+
+- a span for every request, with its status and attempt number
+- a span for every task run by a MappingBoostable, named after the function being mapped
+- a counter for how many units of concurrency each executor has active, and its limit
+
+Spans that overlap in time are laid out on separate "lanes", so the number of lanes in use at a
+given time is the number of requests or tasks in flight.
+
+Example usage:
+```
+with tracing.record_trace("trace.json"):
+    await copytree(src, dst, executor)
+```
+
+To keep overhead low enough for very large jobs, events are formatted in batches and streamed to
+the file as we go, rather than kept in memory. Counter events are emitted at most once per
+millisecond per executor.
+
+This module should not import from the rest of boostedblob, since boost.py imports it.
+
+"""
+
+from __future__ import annotations
+
+import contextlib
+import heapq
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+# How often to emit events for a counter, at most
+COUNTER_INTERVAL = 0.001
+
+
+class Tracer:
+    """Writes trace events to ``file``. Use ``record_trace`` instead of constructing this."""
+
+    def __init__(self, file: TextIO, buffer_size: int = 10000) -> None:
+        self.file = file
+        self.buffer_size = buffer_size
+        self.start = time.monotonic()
+        self.pid = os.getpid()
+        # Events are kept as tuples until we flush, since formatting them is the expensive part
+        self.spans: List[Tuple[str, float, float, int, Optional[Dict[str, Any]]]] = []
+        self.counters: List[Tuple[str, float, Dict[str, Any]]] = []
+        # Per category: free lanes, and how many lanes we've used
+        self.free_lanes: Dict[str, List[int]] = {}
+        self.lane_counts: Dict[str, int] = {}
+        self.lane_offsets: Dict[str, int] = {}
+        # Per counter: when we last emitted it, and any value we held back since
+        self.counter_state: Dict[str, Tuple[float, Optional[Tuple[float, Dict[str, Any]]]]] = {}
+        self.names: Dict[str, str] = {}
+        self.closed = False
+        file.write("[\n")
+        self.write_metadata("process_name", 0, "boostedblob")
+
+    def begin(self, category: str) -> Tuple[int, float]:
+        """Start a span in ``category``. Returns the lane and time to pass to ``end``."""
+        free = self.free_lanes.get(category)
+        if free:
+            lane = heapq.heappop(free)
+        else:
+            if category not in self.lane_offsets:
+                # Give each category its own range of thread ids, so they don't mix
+                self.lane_offsets[category] = 1 + 100000 * len(self.lane_offsets)
+                self.free_lanes[category] = []
+            lane = self.lane_offsets[category] + self.lane_counts.get(category, 0)
+            self.lane_counts[category] = self.lane_counts.get(category, 0) + 1
+            self.write_metadata("thread_name", lane, f"{category} {self.lane_counts[category]}")
+        return lane, time.monotonic()
+
+    def end(
+        self,
+        category: str,
+        name: str,
+        lane: int,
+        start: float,
+        args: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """End a span started by ``begin``."""
+        heapq.heappush(self.free_lanes[category], lane)
+        self.spans.append((name, start, time.monotonic(), lane, args))
+        if len(self.spans) >= self.buffer_size:
+            self.flush()
+
+    def counter(self, name: str, values: Dict[str, Any]) -> None:
+        """Record the current values of the counter ``name``."""
+        now = time.monotonic()
+        last, _ = self.counter_state.get(name, (-COUNTER_INTERVAL, None))
+        if now - last < COUNTER_INTERVAL:
+            self.counter_state[name] = (last, (now, values))
+            return
+        self.counter_state[name] = (now, None)
+        self.counters.append((name, now, values))
+        if len(self.counters) >= self.buffer_size:
+            self.flush()
+
+    def ts(self, t: float) -> str:
+        return f"{(t - self.start) * 1e6:.1f}"
+
+    def json_name(self, name: str) -> str:
+        ret = self.names.get(name)
+        if ret is None:
+            ret = self.names[name] = json.dumps(name)
+        return ret
+
+    def write_metadata(self, kind: str, tid: int, name: str) -> None:
+        self.file.write(
+            f'{{"name":"{kind}","ph":"M","pid":{self.pid},"tid":{tid},'
+            f'"args":{{"name":{json.dumps(name)}}}}},\n'
+        )
+
+    def flush(self) -> None:
+        pid = self.pid
+        lines = []
+        for name, start, end, lane, args in self.spans:
+            line = (
+                f'{{"name":{self.json_name(name)},"ph":"X","ts":{self.ts(start)},'
+                f'"dur":{(end - start) * 1e6:.1f},"pid":{pid},"tid":{lane}'
+            )
+            if args:
+                line += f',"args":{json.dumps(args)}'
+            lines.append(line + "},\n")
+        for name, t, values in self.counters:
+            lines.append(
+                f'{{"name":{self.json_name(name)},"ph":"C","ts":{self.ts(t)},"pid":{pid},'
+                f'"args":{json.dumps(values)}}},\n'
+            )
+        self.file.write("".join(lines))
+        self.spans.clear()
+        self.counters.clear()
+
+    def close(self) -> None:
+        for name, (_, pending) in self.counter_state.items():
+            if pending is not None:
+                self.counters.append((name, *pending))
+        self.flush()
+        # Trailing commas aren't valid JSON, so end with an event that doesn't need one
+        self.file.write(f'{{"name":"trace_end","ph":"i","s":"g","ts":{self.ts(time.monotonic())}')
+        self.file.write(f',"pid":{self.pid},"tid":0}}\n]\n')
+        self.closed = True
+
+
+_tracer: Optional[Tracer] = None
+
+
+def current_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+@contextlib.contextmanager
+def record_trace(path: str) -> Iterator[Tracer]:
+    """Record a trace of everything boostedblob does in this process to ``path``."""
+    global _tracer
+    with open(path, "w") as f:
+        tracer = Tracer(f)
+        previous, _tracer = _tracer, tracer
+        try:
+            yield tracer
+        finally:
+            _tracer = previous
+            tracer.close()
@@ -5,12 +5,21 @@ import base64
 import hashlib
 import os
 import random
-from typing import List, Mapping, Optional, Tuple, Union
+from typing import Dict, List, Mapping, Optional, Tuple, Union
 
 from .boost import BoostExecutor, BoostUnderlying, consume, iter_underlying
 from .delete import remove
 from .globals import config
-from .path import AzurePath, BasePath, CloudPath, GooglePath, LocalPath, exists, pathdispatch
+from .path import (
+    AzurePath,
+    BasePath,
+    CloudPath,
+    GooglePath,
+    LocalPath,
+    exists,
+    invalidates_metadata,
+    pathdispatch,
+)
 from .read import ByteRange
 from .request import (
     Request,
@@ -18,11 +27,19 @@ from .request import (
     azurify_request,
     exponential_sleep_generator,
     googlify_request,
+    hedge,
 )
 from .xml import etree
 
 AZURE_BLOCK_COUNT_LIMIT = 50_000
 
+# Preconditions that make a write fail if the blob already exists, so that overwrite=False doesn't
+# need a separate request (and a race) to check
+# https://docs.microsoft.com/en-us/rest/api/storageservices/specifying-conditional-headers-for-blob-service-operations
+AZURE_IF_NOT_EXISTS = {"If-None-Match": "*"}
+# https://cloud.google.com/storage/docs/request-preconditions
+GOOGLE_IF_NOT_EXISTS = {"ifGenerationMatch": "0"}
+
 # ==============================
 # write_single
 # ==============================
@@ -41,37 +58,38 @@ async def write_single(path: Union[BasePath, str], data: bytes, overwrite: bool
 
 
 @write_single.register  # type: ignore
+@invalidates_metadata
 async def _azure_write_single(path: AzurePath, data: bytes, overwrite: bool = False) -> None:
+    headers = {"x-ms-blob-type": "BlockBlob"}
     if not overwrite:
-        if await exists(path):
-            raise FileExistsError(path)
+        headers.update(AZURE_IF_NOT_EXISTS)
 
     request = await azurify_request(
         Request(
             method="PUT",
             url=path.format_url("https://{account}.blob.core.windows.net/{container}/{blob}"),
             data=data,
-            headers={"x-ms-blob-type": "BlockBlob"},
+            headers=headers,
             success_codes=(201,),
+            failure_exceptions=exists_failure_exceptions(path),
         )
     )
     await request.execute_reponseless()
 
 
 @write_single.register  # type: ignore
+@invalidates_metadata
 async def _google_write_single(path: GooglePath, data: bytes, overwrite: bool = False) -> None:
-    if not overwrite:
-        if await exists(path):
-            raise FileExistsError(path)
-
     request = await googlify_request(
         Request(
             method="POST",
             url=path.format_url(
                 "https://storage.googleapis.com/upload/storage/v1/b/{bucket}/o?uploadType=media&name={blob}"
             ),
+            params={} if overwrite else GOOGLE_IF_NOT_EXISTS,
             data=data,
             headers={"Content-Type": "application/octet-stream"},
+            failure_exceptions=exists_failure_exceptions(path),
         )
     )
     await request.execute_reponseless()
@@ -113,6 +131,7 @@ async def write_stream(
 
 
 @write_stream.register  # type: ignore
+@invalidates_metadata
 async def _azure_write_stream(
     path: AzurePath,
     stream: BoostUnderlying[bytes],
@@ -121,14 +140,24 @@ async def _azure_write_stream(
 ) -> None:
     if overwrite:
         await prepare_block_blob_write(path)
-    else:
-        if await exists(path):
-            raise FileExistsError(path)
 
     upload_id = get_upload_id()
-    md5 = hashlib.md5()
     max_block_index = -1
 
+    # Hashing is slow enough that we don't want to do it on the event loop. But we need to hash
+    # chunks in order, and tasks aren't guaranteed to run in the order they were started, so we
+    # keep track of which chunks are ready to hash and hash them in order in a single task.
+    md5 = hashlib.md5()
+    unhashed: Dict[int, bytes] = {}
+    next_hash_index = 0
+    hasher: Optional[asyncio.Task[None]] = None
+
+    async def hash_chunks() -> None:
+        nonlocal next_hash_index
+        while next_hash_index in unhashed:
+            await executor.run_threaded(md5.update, unhashed.pop(next_hash_index))
+            next_hash_index += 1
+
     async def upload_chunk(index_chunk: Tuple[int, bytes]) -> None:
         block_index, chunk = index_chunk
         # https://docs.microsoft.com/en-us/rest/api/storageservices/put-block-list#remarks
@@ -137,32 +166,35 @@ async def _azure_write_stream(
         nonlocal max_block_index
         max_block_index = max(max_block_index, block_index)
 
-        block_id = get_block_id(upload_id, block_index)
-        md5.update(chunk)
+        nonlocal hasher
+        unhashed[block_index] = chunk
+        if hasher is None or hasher.done():
+            hasher = asyncio.create_task(hash_chunks())
 
+        block_id = get_block_id(upload_id, block_index)
         await _azure_put_block(path, block_id, chunk)
 
     await consume(executor.map_ordered(upload_chunk, executor.enumerate(stream)))
+    if hasher is not None:
+        await hasher
+    assert not unhashed
 
     # azure does not calculate md5s for us, we have to do that manually
     # https://blogs.msdn.microsoft.com/windowsazurestorage/2011/02/17/windows-azure-blob-md5-overview/
     headers = {"x-ms-blob-content-md5": base64.b64encode(md5.digest()).decode("utf8")}
     blocklist = [get_block_id(upload_id, i) for i in range(max_block_index + 1)]
-    await azure_put_block_list(path, blocklist, headers=headers)
+    await azure_put_block_list(path, blocklist, headers=headers, overwrite=overwrite)
 
 
 @write_stream.register  # type: ignore
+@invalidates_metadata
 async def _google_write_stream(
     path: GooglePath,
     stream: BoostUnderlying[bytes],
     executor: BoostExecutor,
     overwrite: bool = False,
 ) -> None:
-    if not overwrite:
-        if await exists(path):
-            raise FileExistsError(path)
-
-    upload_url = await _google_start_resumable_upload(path)
+    upload_url = await _google_start_resumable_upload(path, overwrite=overwrite)
 
     offset = 0
     is_finalised = False
@@ -200,12 +232,13 @@ async def _google_write_stream(
                     "Content-Range": f"bytes {start}-{end-1}/{total_size}",
                 },
                 success_codes=(200, 201) if is_finalised else (308,),
+                failure_exceptions=exists_failure_exceptions(path),
             )
         )
         await request.execute_reponseless()
 
     if not is_finalised:
-        await _google_finalise_upload(upload_url, total_size=offset)
+        await _google_finalise_upload(path, upload_url, total_size=offset)
 
 
 @write_stream.register  # type: ignore
@@ -222,11 +255,11 @@ async def _local_write_stream(
     os.makedirs(path.parent, exist_ok=True)
     with open(path, mode="wb") as f:
         async for data in iter_underlying(stream):
-            # Note that this is a blocking write. We used to use loop.run_in_executor, but it
-            # didn't seem to help much, and had some downsides. First, we run into
-            # https://bugs.python.org/issue35279 on Python 3.7. Second, blocking writes provide
-            # natural backpressure.
-            f.write(data)
+            # We used to do a blocking write here, since the default executor runs into
+            # https://bugs.python.org/issue35279 on Python 3.7. The executor's thread pool is
+            # bounded, so that's no longer an issue. Note that we still wait for each write to
+            # finish before asking for more data, which provides natural backpressure.
+            await executor.run_threaded(f.write, data)
 
 
 # ==============================
@@ -254,6 +287,7 @@ async def write_stream_unordered(
 
 
 @write_stream_unordered.register  # type: ignore
+@invalidates_metadata
 async def _azure_write_stream_unordered(
     path: AzurePath,
     stream: BoostUnderlying[Tuple[bytes, ByteRange]],
@@ -263,9 +297,6 @@ async def _azure_write_stream_unordered(
     # TODO: this doesn't upload an md5...
     if overwrite:
         await prepare_block_blob_write(path)
-    else:
-        if await exists(path):
-            raise FileExistsError(path)
 
     upload_id = get_upload_id()
     block_list = []
@@ -284,10 +315,13 @@ async def _azure_write_stream_unordered(
 
     # sort by start byte so the blocklist is ordered correctly
     block_list.sort()
-    await azure_put_block_list(path, [get_block_id(upload_id, index) for _, index in block_list])
+    await azure_put_block_list(
+        path, [get_block_id(upload_id, index) for _, index in block_list], overwrite=overwrite
+    )
 
 
 @write_stream_unordered.register  # type: ignore
+@invalidates_metadata
 async def _google_write_stream_unordered(
     path: GooglePath,
     stream: BoostUnderlying[Tuple[bytes, ByteRange]],
@@ -302,6 +336,11 @@ async def _google_write_stream_unordered(
 # ==============================
 
 
+def exists_failure_exceptions(path: CloudPath) -> Dict[int, Exception]:
+    # Azure uses 409 for If-None-Match: * on an existing blob, GCS uses 412
+    return {409: FileExistsError(path), 412: FileExistsError(path)}
+
+
 def get_upload_id() -> int:
     return random.randint(0, 2**47 - 1)
 
@@ -394,14 +433,19 @@ async def _azure_put_block(path: AzurePath, block_id: str, chunk: bytes) -> None
             success_codes=(201,),
         )
     )
-    await request.execute_reponseless()
+    # Putting the same block twice is harmless, so we can hedge this
+    await hedge("put_block", request.execute_reponseless)
 
 
 async def azure_put_block_list(
-    path: AzurePath, block_list: List[str], headers: Optional[Mapping[str, str]] = None
+    path: AzurePath,
+    block_list: List[str],
+    headers: Optional[Mapping[str, str]] = None,
+    overwrite: bool = True,
 ) -> None:
-    if headers is None:
-        headers = {}
+    headers = dict(headers or {})
+    if not overwrite:
+        headers.update(AZURE_IF_NOT_EXISTS)
     request = await azurify_request(
         Request(
             method="PUT",
@@ -410,6 +454,7 @@ async def azure_put_block_list(
             params=dict(comp="blocklist"),
             data={"BlockList": {"Latest": block_list}},
             success_codes=(201, 400),
+            failure_exceptions=exists_failure_exceptions(path),
         )
     )
 
@@ -442,16 +487,22 @@ async def azure_put_block_list(
             raise RequestFailure(reason=str(resp.reason), request=request, status=resp.status)
 
 
-async def _google_start_resumable_upload(path: GooglePath) -> str:
+async def _google_start_resumable_upload(path: GooglePath, overwrite: bool = True) -> str:
     request = await googlify_request(
         Request(
             method="POST",
             url=path.format_url(
                 "https://storage.googleapis.com/upload/storage/v1/b/{bucket}/o?uploadType=resumable"
             ),
+            # The precondition is checked now, and again when the upload is finalised
+            params={} if overwrite else GOOGLE_IF_NOT_EXISTS,
             data=dict(name=path.blob),
             headers={"Content-Type": "application/json; charset=UTF-8"},
-            failure_exceptions={400: FileNotFoundError(), 404: FileNotFoundError()},
+            failure_exceptions={
+                400: FileNotFoundError(),
+                404: FileNotFoundError(),
+                **exists_failure_exceptions(path),
+            },
         )
     )
     async with request.execute() as resp:
@@ -459,9 +510,15 @@ async def _google_start_resumable_upload(path: GooglePath) -> str:
         return upload_url
 
 
-async def _google_finalise_upload(upload_url: str, total_size: int) -> None:
+async def _google_finalise_upload(path: GooglePath, upload_url: str, total_size: int) -> None:
     headers = {"Content-Type": "application/octet-stream", "Content-Range": f"bytes */{total_size}"}
     request = await googlify_request(
-        Request(method="PUT", url=upload_url, headers=headers, success_codes=(200, 201))
+        Request(
+            method="PUT",
+            url=upload_url,
+            headers=headers,
+            success_codes=(200, 201),
+            failure_exceptions=exists_failure_exceptions(path),
+        )
     )
     await request.execute_reponseless()
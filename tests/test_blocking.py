@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+import boostedblob as bbb
+from boostedblob import blocking
+
+
+def test_blocking(any_dir):
+    try:
+        blocking.write(any_dir / "alpha", b"abc")
+        assert blocking.read(any_dir / "alpha") == b"abc"
+        with pytest.raises(FileExistsError):
+            blocking.write(any_dir / "alpha", b"def")
+        blocking.copy(any_dir / "alpha", any_dir / "beta")
+        assert blocking.stat(any_dir / "beta").size == 3
+        assert sorted(p.name for p in blocking.listdir(any_dir)) == ["alpha", "beta"]
+
+        with bbb.globals.configure(chunk_size=2):
+            chunks = list(blocking.iterate(lambda e: bbb.read.read_stream(any_dir / "alpha", e)))
+        assert b"".join(chunks) == b"abc"
+
+        async def double(x):
+            return x * 2
+
+        it = blocking.iterate(lambda e: e.map_ordered(double, iter(range(100))))
+        assert [next(it) for _ in range(3)] == [0, 2, 4]
+        it.close()
+
+        # many threads share the background loop
+        errors = []
+
+        def worker(i):
+            try:
+                path = any_dir / f"thread{i}"
+                blocking.write(path, str(i).encode())
+                assert blocking.read(path) == str(i).encode()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors
+        assert len(blocking.listdir(any_dir)) == 10
+    finally:
+        blocking.shutdown()
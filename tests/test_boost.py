@@ -1,8 +1,12 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
+import json
 import random
 import sys
+import threading
+import time
 from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, List, cast
 
 import pytest
@@ -308,6 +312,25 @@ async def test_map_unordered_many_random():
         assert sorted(results) == list(range(N))
 
 
+@pytest.mark.asyncio
+async def test_map_unordered_completion_order():
+    N = 500
+    futures = {}
+    results = []
+    async with bbb.BoostExecutor(N * 2) as e:
+        it = e.map_unordered(get_futures_fn(futures), iter(range(N)))
+        task = asyncio.create_task(collect(it, results))
+        while not N - 1 in futures:
+            await pause()
+        # complete everything without yielding, results should come out in order of completion
+        shuffled = list(range(N))
+        random.shuffle(shuffled)
+        for i in shuffled:
+            futures[i].set_result(None)
+        await task
+        assert results == shuffled
+
+
 # ==============================
 # eager async iterator
 # ==============================
@@ -411,14 +434,13 @@ async def test_map_eagerise():
         it = e.map_ordered(identity_wait, e.eagerise(iterator()))
         asyncio.create_task(collect(it, results))
         assert started == []
+        # BoostExecutor is notified as soon as the underlying async iterator is ready, so there's
+        # no need to wait for it to poll
         await pause()
-        assert started == [0]
-        # BoostExecutor currently sleeps for a minimum of 0.01 seconds if the underlying async
-        # iterator is not ready
-        await asyncio.sleep(0.02)
         assert started == list(range(N // 3))
         future.set_result(None)
-        await asyncio.sleep(0.02)
+        while len(started) < N:
+            await pause()
         assert started == list(range(N))
     assert results == list(range(N))
 
@@ -507,9 +529,12 @@ async def test_composition_unordered_unordered():
         asyncio.create_task(collect(outer_it, results))
         await pause()
 
-        while outer_futures or inner_futures:
-            futures = random.choice([fs for fs in (outer_futures, inner_futures) if fs])
-            futures[next(iter(futures))].set_result(None)
+        # note that there may be no futures pending while inner results are being handed to outer
+        while len(results) < N:
+            pending = [fs for fs in (outer_futures, inner_futures) if fs]
+            if pending:
+                futures = random.choice(pending)
+                futures[next(iter(futures))].set_result(None)
             await pause()
         assert sorted(results) == list(range(N))
 
@@ -609,3 +634,434 @@ async def test_map_multiple():
         await asyncio.gather(t1, t2, t3)
         r1.sort()
         assert r1 == r2 == r3
+
+
+# ==============================
+# adaptive concurrency
+# ==============================
+
+
+@pytest.mark.asyncio
+async def test_limit():
+    futures = {}
+    results = []
+    async with bbb.BoostExecutor(10) as e:
+        e.set_limit(3)
+        it = e.map_unordered(get_futures_fn(futures), iter(range(10)))
+        asyncio.create_task(collect(it, results))
+        await pause()
+        assert set(futures) == {0, 1, 2}
+
+        futures[0].set_result(None)
+        await pause()
+        assert results == [0]
+        assert set(futures) == {1, 2, 3}
+
+        e.set_limit(5)
+        await pause()
+        assert set(futures) == {1, 2, 3, 4, 5}
+
+        for i in range(1, 10):
+            if i not in futures:
+                await pause()
+            futures[i].set_result(None)
+            await pause()
+        assert sorted(results) == list(range(10))
+
+
+@pytest.mark.asyncio
+async def test_adaptive_concurrency():
+    e = bbb.BoostExecutor(100, adaptive=True)
+    assert e.adaptive is not None
+    e.adaptive.interval = 1000
+    async with e:
+        adaptive = e.adaptive
+        assert e.limit == 16
+
+        def window(latency, throttled=0, requests=10):
+            for i in range(requests):
+                adaptive.record_request(latency, i < throttled)
+            adaptive.update_limit(adaptive.next_limit(1.0))
+            return e.limit
+
+        # no requests means no signal
+        assert window(0.1, requests=0) == 16
+        # slow start
+        assert window(0.1) == 32
+        assert window(0.1) == 64
+        # throttling ends slow start and causes a multiplicative decrease
+        assert window(0.1, throttled=1) == 44
+        # additive increase
+        assert window(0.1) == 48
+        # increase didn't help throughput
+        assert window(0.1, requests=5) == 44
+        assert window(0.1, requests=5) == 48
+        # latency inflation causes a multiplicative decrease
+        assert window(1.0) == 33
+        # we never go above the executor's concurrency, or below the minimum
+        for _ in range(50):
+            window(0.1)
+        assert e.limit == 100
+        for _ in range(50):
+            window(0.1, throttled=10)
+        assert e.limit == 1
+        assert [limit for _, limit in adaptive.history][:4] == [16, 32, 64, 44]
+
+
+# ==============================
+# partitions
+# ==============================
+
+
+@pytest.mark.asyncio
+async def test_partitions():
+    futures = {}
+    results = []
+    fn = get_futures_fn(futures)
+    async with bbb.BoostExecutor(4) as e:
+        e.set_partition_limit("slow", 1)
+
+        async def request(i):
+            async with e.partition("slow" if i < 4 else "fast"):
+                return await fn(i)
+
+        it = e.map_unordered(request, iter(range(8)))
+        asyncio.create_task(collect(it, results))
+        await pause()
+        # tasks waiting on the slow partition shouldn't stop us from making progress elsewhere
+        assert set(futures) == {0, 4, 5, 6}
+        assert e.active == 4
+
+        for i in [4, 5, 6, 7, 0, 1, 2, 3]:
+            while i not in futures:
+                await pause()
+            futures[i].set_result(None)
+            await pause()
+        assert sorted(results) == list(range(8))
+    assert e.semaphore._value == 3
+
+
+def test_get_partition_key():
+    from boostedblob.request import get_partition_key
+
+    assert get_partition_key("https://acct.blob.core.windows.net/container/blob") == "az://acct"
+    assert get_partition_key("https://storage.googleapis.com/storage/v1/b/bkt/o/b") == "gs://bkt"
+    assert (
+        get_partition_key("https://storage.googleapis.com/upload/storage/v1/b/bkt/o?name=x")
+        == "gs://bkt"
+    )
+    assert (
+        get_partition_key("https://login.microsoftonline.com/tenant") == "login.microsoftonline.com"
+    )
+
+
+# ==============================
+# memory budget
+# ==============================
+
+
+@pytest.mark.asyncio
+async def test_memory_budget():
+    N = 30
+    loop = asyncio.get_running_loop()
+    futures = {i: loop.create_future() for i in range(N)}
+    started = []
+    results = []
+
+    async def fn(i):
+        started.append(i)
+        await futures[i]
+        return b"x" * 40
+
+    async with bbb.BoostExecutor(10, memory_budget=100) as e:
+        it = e.map_ordered(fn, iter(range(N)))
+        task = asyncio.create_task(collect(it, results))
+        await pause()
+        assert started == list(range(10))
+
+        for i in range(1, 4):
+            futures[i].set_result(None)
+            await pause()
+        # results we've buffered and our estimate of in flight results put us over budget
+        assert e.over_memory_budget()
+        num_started = len(started)
+        assert num_started < 14
+        for i in range(4, 10):
+            futures[i].set_result(None)
+        await pause()
+        assert len(started) == num_started
+
+        for i in range(N):
+            if not futures[i].done():
+                futures[i].set_result(None)
+            await pause()
+        await task
+    assert len(results) == N
+    assert e.buffered_bytes == 0
+
+
+def test_default_weight():
+    assert bbb.boost.default_weight(b"abc") == 3
+    assert bbb.boost.default_weight((1, (b"abc", (0, 3)))) == 3
+    assert bbb.boost.default_weight("abc") == 0
+
+
+# ==============================
+# stats
+# ==============================
+
+
+@pytest.mark.asyncio
+async def test_stats():
+    N = 20
+    futures = {}
+    results = []
+    async with bbb.BoostExecutor(5) as e:
+        it = e.map_unordered(get_futures_fn(futures), iter(range(N)))
+        task = asyncio.create_task(collect(it, results))
+        await pause()
+
+        stats = e.stats()
+        assert stats.active == 5
+        assert stats.started == 5
+        assert stats.finished == 0
+        (boostable,) = stats.boostables
+        assert boostable.name.startswith("UnorderedMappingBoostable(")
+        assert boostable.queue_depth == 5
+        assert boostable.started - boostable.finished == 5
+
+        for i in range(N):
+            while i not in futures:
+                await pause()
+            futures[i].set_result(None)
+        await task
+
+    stats = e.stats()
+    assert stats.active == 0
+    assert stats.started == stats.finished == N
+    assert 0 < stats.utilization <= 1
+    assert stats.throughput > 0
+
+
+# ==============================
+# threads
+# ==============================
+
+
+@pytest.mark.asyncio
+async def test_map_threaded():
+    N = 50
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def work(x: int) -> int:
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.005)
+        with lock:
+            running -= 1
+        assert threading.current_thread() is not threading.main_thread()
+        return x * 2
+
+    async with bbb.BoostExecutor(20, thread_concurrency=4) as e:
+        results = [x async for x in e.map_threaded(work, iter(range(N)))]
+        assert results == [x * 2 for x in range(N)]
+        assert 1 < max_running <= 4
+
+        unordered = [x async for x in e.map_threaded(work, iter(range(N)), ordered=False)]
+        assert sorted(unordered) == [x * 2 for x in range(N)]
+
+        assert await e.run_threaded(work, 3) == 6
+
+
+# ==============================
+# rate limits
+# ==============================
+
+
+def test_rate_limiter():
+    limiter = bbb.boost.RateLimiter(10)
+    delays = [limiter.reserve(1) for _ in range(30)]
+    # the first second's worth goes through immediately, after that we're held to the rate
+    assert all(d <= 0 for d in delays[:11])
+    assert delays[20] == pytest.approx(1.0, abs=0.01)
+    assert delays[29] == pytest.approx(1.9, abs=0.01)
+
+    limiter = bbb.boost.RateLimiter(10)
+    # a big use goes through, but the next use pays for it
+    assert limiter.reserve(30) <= 0
+    assert limiter.reserve(1) == pytest.approx(2.0, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_executor_rate_limit():
+    async with bbb.BoostExecutor(10, max_rps=1000, bwlimit=10_000) as e:
+        assert e.has_rate_limits()
+        e.set_host_rate_limit("slow.example.com", max_rps=100)
+
+        start = time.monotonic()
+        for _ in range(10):
+            await e.rate_limit("fast.example.com", requests=1, nbytes=2000)
+        # we transferred 20000 bytes, the first 10000 of which were allowed as a burst
+        assert 0.7 < time.monotonic() - start < 1.5
+
+        e.byte_limiter = None
+        start = time.monotonic()
+        for _ in range(150):
+            await e.rate_limit("slow.example.com", requests=1)
+        assert 0.4 < time.monotonic() - start < 1.0
+
+
+# ==============================
+# batch
+# ==============================
+
+
+@pytest.mark.asyncio
+async def test_batch():
+    async with bbb.BoostExecutor(10) as e:
+        batches = [b async for b in e.batch(iter(range(10)), max_items=3, max_delay=1)]
+        assert batches == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+
+
+@pytest.mark.asyncio
+async def test_batch_max_delay():
+    futures = {}
+    results = []
+    async with bbb.BoostExecutor(10) as e:
+        it = e.batch(e.map_ordered(get_futures_fn(futures), iter(range(5))), 10, max_delay=0.05)
+        task = asyncio.create_task(collect(it, results))
+        while len(futures) < 5:
+            await pause()
+        futures[0].set_result(None)
+        futures[1].set_result(None)
+        await pause()
+        assert results == []
+        await asyncio.sleep(0.1)
+        assert results == [[0, 1]]
+        for i in range(2, 5):
+            futures[i].set_result(None)
+        await task
+    assert results == [[0, 1], [2, 3, 4]]
+
+
+@pytest.mark.asyncio
+async def test_batch_composition():
+    N = 1000
+
+    async def total(batch: List[int]) -> int:
+        assert 0 < len(batch) <= 7
+        return sum(batch)
+
+    async with bbb.BoostExecutor(10) as e:
+        inner = e.map_unordered(identity, iter(range(N)))
+        it = e.map_unordered(total, e.batch(inner, max_items=7, max_delay=0.01))
+        assert sum([x async for x in it]) == sum(range(N))
+
+
+# ==============================
+# concurrency pool
+# ==============================
+
+
+@pytest.mark.asyncio
+async def test_concurrency_pool():
+    N = 100
+    running = 0
+    max_running = 0
+
+    async def work(x: int) -> int:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        return x
+
+    async def run_executor() -> List[int]:
+        async with bbb.BoostExecutor(10, pool=pool) as e:
+            return [x async for x in e.map_unordered(work, iter(range(N)))]
+
+    pool = bbb.boost.ConcurrencyPool(4)
+    results = await asyncio.gather(run_executor(), run_executor(), run_executor())
+    assert all(sorted(r) == list(range(N)) for r in results)
+    # each executor's foreground can run one task without borrowing from the pool
+    assert 4 < max_running <= 4 + 3
+    assert pool.in_use == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrency_pool_nested():
+    N = 10
+    results = []
+    bbb.boost.set_default_pool(bbb.boost.ConcurrencyPool(1))
+    try:
+        async with bbb.BoostExecutor(3) as e:
+            assert e.pool is not None
+
+            async def work_spawner(n):
+                async with bbb.BoostExecutor(3) as inner:
+                    await pause()
+                    return [x async for x in inner.map_unordered(identity, iter(range(n)))]
+
+            it = e.map_unordered(work_spawner, iter(range(N)))
+            await asyncio.wait_for(collect(it, results), timeout=5)
+    finally:
+        bbb.boost.set_default_pool(None)
+    assert sorted(map(len, results)) == list(range(10))
+
+
+# ==============================
+# priority
+# ==============================
+
+
+@pytest.mark.asyncio
+async def test_priority():
+    N = 300
+    started = {"high": 0, "low": 0}
+
+    async def work(name: str) -> None:
+        started[name] += 1
+        await asyncio.sleep(0.005)
+
+    async with bbb.BoostExecutor(11) as e:
+        low = e.map_unordered(work, itertools.repeat("low", N))
+        high = e.map_unordered(work, itertools.repeat("high", N), priority=2)
+        assert e.prioritised
+        low_task = asyncio.create_task(bbb.boost.consume(low))
+        await bbb.boost.consume(high)
+        # priority 2 should get about four times as many boosts as priority 0, but priority 0
+        # shouldn't be starved
+        assert N / 8 < started["low"] < N / 2
+        await low_task
+    assert started == {"high": N, "low": N}
+
+
+@pytest.mark.asyncio
+async def test_tracing(tmp_path):
+    async def work(x):
+        await asyncio.sleep(0.001)
+        return x
+
+    path = str(tmp_path / "trace.json")
+    with bbb.tracing.record_trace(path) as tracer:
+        tracer.buffer_size = 7
+        async with bbb.BoostExecutor(4) as e:
+            assert sorted([x async for x in e.map_unordered(work, iter(range(50)))]) == list(
+                range(50)
+            )
+    with open(path) as f:
+        events = json.load(f)
+
+    spans = [e for e in events if e["ph"] == "X"]
+    counters = [e for e in events if e["ph"] == "C"]
+    assert len(spans) == 50
+    assert all(s["name"] == "UnorderedMappingBoostable(test_tracing.<locals>.work)" for s in spans)
+    # no more lanes than we have concurrency
+    assert len({s["tid"] for s in spans}) <= 5
+    assert counters and all(c["args"]["active"] <= 5 for c in counters)
+    assert bbb.tracing.current_tracer() is None
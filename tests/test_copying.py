@@ -68,6 +68,48 @@ async def test_copytree(any_dir, other_any_dir):
     assert await _listtree(any_dir, any_dir) == await _listtree(other_any_dir, other_any_dir)
 
 
+@pytest.mark.asyncio
+@bbb.ensure_session
+async def test_copytree_sharded():
+    with helpers.tmp_local_dir() as src, helpers.tmp_local_dir() as dst:
+        for i in range(20):
+            helpers.create_file(src / f"d{i % 3}" / f"f{i}", str(i).encode())
+
+        async with bbb.BoostExecutor(8) as e:
+            copied = [p async for p in bbb.copying.copytree_iterator(src, dst, e, workers=2)]
+        assert len(copied) == 20
+        for i in range(20):
+            with open(dst / f"d{i % 3}" / f"f{i}", "rb") as f:
+                assert f.read() == str(i).encode()
+
+    # errors in workers are raised in the parent
+    with helpers.tmp_local_dir() as src, helpers.tmp_local_dir() as dst:
+        helpers.create_file(src / "d" / "f")
+        helpers.create_file(dst / "d")
+        async with bbb.BoostExecutor(8) as e:
+            with pytest.raises(OSError):
+                await bbb.boost.consume(bbb.copying.copytree_iterator(src, dst, e, workers=2))
+
+
+@pytest.mark.asyncio
+@bbb.ensure_session
+async def test_download_copyfile():
+    # _download_copyfile is only used for cloud sources, but read_byte_range_into works locally
+    contents = os.urandom(10 * 1024 + 7)
+    with helpers.tmp_local_dir() as src, helpers.tmp_local_dir() as dst:
+        helpers.create_file(src / "blob", contents)
+        helpers.create_file(src / "empty", b"")
+        async with bbb.BoostExecutor(8) as e:
+            with bbb.globals.configure(chunk_size=1024):
+                await bbb.copying._download_copyfile(src / "blob", dst / "d" / "blob", e)
+                await bbb.copying._download_copyfile(src / "empty", dst / "empty", e)
+                with pytest.raises(FileExistsError):
+                    await bbb.copying._download_copyfile(src / "blob", dst / "d" / "blob", e)
+        with open(dst / "d" / "blob", "rb") as f:
+            assert f.read() == contents
+        assert os.path.getsize(dst / "empty") == 0
+
+
 @pytest.mark.asyncio
 @bbb.ensure_session
 async def test_copyglob():
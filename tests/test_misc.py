@@ -1,6 +1,21 @@
+import asyncio
+import email.utils
+import time
+
 import pytest
 
 import boostedblob as bbb
+from boostedblob.request import (
+    CircuitBreaker,
+    CircuitBreakerOpen,
+    Request,
+    RetryBudget,
+    hedge,
+    parse_retry_after,
+    pause_host,
+    resume_read_request,
+    wait_for_host,
+)
 from boostedblob.xml import dict_to_xml
 
 from . import helpers
@@ -32,3 +47,287 @@ def test_xml():
         b"<?xml version='1.0' encoding='utf-8'?>\n"
         b"<KeyInfo><Start>2022-09-02</Start><Expiry>2022-09-08</Expiry></KeyInfo>"
     )
+
+
+@pytest.mark.asyncio
+async def test_hedge():
+    calls = 0
+
+    async def fn(latency: float) -> int:
+        nonlocal calls
+        calls += 1
+        this_call = calls
+        # the first call to straggle straggles for a long time, the hedge comes back quickly
+        await asyncio.sleep(latency if this_call != 30 else 10)
+        return this_call
+
+    with bbb.globals.configure(hedge_percentile=0.9, hedge_max_overhead=1.0):
+        for _ in range(29):
+            await hedge("test_hedge", lambda: fn(0.001))
+        assert calls == 29
+        # this call straggles, so it gets hedged and we use the result of the hedge
+        assert await asyncio.wait_for(hedge("test_hedge", lambda: fn(0.001)), 1) == 31
+        assert calls == 31
+
+    with bbb.globals.configure(hedge_percentile=0.9, hedge_max_overhead=0.0):
+        calls = 29
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(hedge("test_hedge", lambda: fn(0.001)), 0.1)
+        assert calls == 30
+
+    async def fail() -> int:
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        await hedge("test_hedge", fail)
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.1, min_per_second=0)
+    for _ in range(50):
+        budget.record_request()
+    assert sum(budget.try_retry() for _ in range(10)) == 5
+
+    budget = RetryBudget(ratio=0.1, min_per_second=1, window=2)
+    assert sum(budget.try_retry() for _ in range(10)) == 2
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker():
+    request = Request("GET", "https://example.com")
+    breaker = CircuitBreaker("example.com", threshold=0.6, min_requests=4, cooldown=0.05)
+    for _ in range(3):
+        breaker.record(ok=True)
+        breaker.record(ok=False)
+    assert breaker.trips == 0
+    await asyncio.wait_for(breaker.wait(request), 0.01)
+
+    breaker.record(ok=False)
+    breaker.record(ok=False)
+    assert breaker.trips == 1
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(breaker.wait(request), 0.01)
+    with bbb.globals.configure(circuit_breaker_fail_fast=True):
+        with pytest.raises(CircuitBreakerOpen):
+            await breaker.wait(request)
+    await asyncio.wait_for(breaker.wait(request), 0.1)
+
+    # tripping again before things recover doubles the cooldown
+    for _ in range(4):
+        breaker.record(ok=False)
+    assert breaker.trips == 2
+    assert breaker.open_until - time.monotonic() > 0.05
+
+
+@pytest.mark.asyncio
+async def test_throttling():
+    assert parse_retry_after({}) is None
+    assert parse_retry_after({"Retry-After": "3"}) == 3
+    assert parse_retry_after({"x-ms-retry-after-ms": "250"}) == 0.25
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < parse_retry_after({"Retry-After": date}) <= 30
+    assert parse_retry_after({"Retry-After": "soon"}) is None
+
+    start = time.monotonic()
+    pause_host("example.com", 0.05)
+    # requests to other hosts aren't affected
+    await asyncio.wait_for(wait_for_host("example.org"), 0.01)
+    await asyncio.gather(*[wait_for_host("example.com") for _ in range(10)])
+    assert time.monotonic() - start >= 0.05
+
+
+def test_metrics_histogram():
+    registry = bbb.metrics.MetricsRegistry()
+    for i in range(1, 1001):
+        registry.observe("latency", i / 1000)
+    registry.observe("latency", 0)
+    registry.increment("requests", 3)
+
+    h = registry.histogram("latency")
+    assert h.count == 1001
+    assert h.min == 0 and h.max == 1
+    assert h.percentile(0) == 0
+    assert abs(h.percentile(0.5) - 0.5) < 0.06
+    assert abs(h.percentile(0.99) - 0.99) < 0.11
+    snapshot = registry.snapshot()
+    assert snapshot["counters"] == {"requests": 3}
+    assert snapshot["histograms"]["latency"]["count"] == 1001
+
+
+def test_resume_read_request():
+    request = Request("GET", "https://example.com", headers={"Range": "bytes=100-199"})
+    resumed = resume_read_request(request, 30, ("etag", '"abc"'))
+    assert resumed is not None
+    assert resumed.headers == {"Range": "bytes=130-199", "If-Match": '"abc"'}
+    assert resumed.success_codes == (206,)
+
+    request = Request("GET", "https://example.com", params={"alt": "media"})
+    resumed = resume_read_request(request, 30, ("generation", "123"))
+    assert resumed is not None
+    assert resumed.headers == {"Range": "bytes=30-"}
+    assert resumed.params == {"alt": "media", "ifGenerationMatch": "123"}
+
+    request = Request("GET", "https://example.com", headers={"Range": "bytes=-100"})
+    assert resume_read_request(request, 30, ("etag", '"abc"')) is None
+
+
+@pytest.mark.asyncio
+async def test_azurify_request():
+    import base64
+
+    from boostedblob import azure_auth
+
+    key = base64.b64encode(b"k" * 64).decode()
+    request = Request(
+        method="PUT",
+        url="https://account.blob.core.windows.net/container/some%20blob",
+        params=dict(comp="block", blockid="abc"),
+        data=b"chunk",
+        success_codes=(201,),
+    )
+    signed = await bbb.request.azurify_request(request, auth=(azure_auth.SHARED_KEY, key))
+    assert signed.data == b"chunk"
+    assert signed.params == request.params
+    assert signed.success_codes == (201,)
+    assert "Authorization" not in request.headers
+    date = signed.headers["x-ms-date"]
+    assert abs(email.utils.parsedate_to_datetime(date).timestamp() - time.time()) < 5
+    assert signed.headers["Authorization"] == azure_auth.sign_request_with_shared_key(signed, key)
+    assert signed.headers["Authorization"].startswith("SharedKey account:")
+
+    signed = await bbb.request.azurify_request(request, auth=(azure_auth.OAUTH_TOKEN, "token"))
+    assert signed.headers["Authorization"] == "Bearer token"
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    calls = []
+
+    @bbb.path.single_flight("stat")
+    async def fake_stat(path):
+        calls.append(path)
+        await asyncio.sleep(0.05)
+        if path.path == "missing":
+            raise FileNotFoundError(path)
+        return path.path
+
+    a = bbb.LocalPath("a")
+    # disabled by default
+    await asyncio.gather(fake_stat(a), fake_stat(a))
+    assert len(calls) == 2
+
+    calls.clear()
+    bbb.metrics.registry.reset()
+    with bbb.globals.configure(coalesce_requests=frozenset({"stat"})):
+        results = await asyncio.gather(
+            *[fake_stat(a) for _ in range(5)], fake_stat(bbb.LocalPath("b"))
+        )
+        assert results == ["a"] * 5 + ["b"]
+        assert len(calls) == 2
+        assert bbb.metrics.registry.counters["coalesce.stat.requests"] == 6
+        assert bbb.metrics.registry.counters["coalesce.stat.saved"] == 4
+
+        # once the first call is done, the next one makes a request of its own
+        await fake_stat(a)
+        assert len(calls) == 3
+
+        # exceptions are shared
+        missing = bbb.LocalPath("missing")
+        results = await asyncio.gather(
+            fake_stat(missing), fake_stat(missing), return_exceptions=True
+        )
+        assert all(isinstance(r, FileNotFoundError) for r in results)
+        assert len(calls) == 4
+
+        # cancelling the first caller doesn't affect the others
+        first = asyncio.ensure_future(fake_stat(a))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(fake_stat(a))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "a"
+        assert len(calls) == 5
+
+
+@pytest.mark.asyncio
+async def test_metadata_cache(tmp_path):
+    from boostedblob.path import CachedStat, metadata_cache
+
+    calls = []
+
+    @bbb.path.metadata_cached("stat")
+    async def fake_stat(path):
+        calls.append(path)
+        if path.blob == "missing":
+            raise FileNotFoundError(path)
+        return CachedStat(size=len(calls), mtime=1.0, ctime=1.0, md5=None, version="v")
+
+    @bbb.path.metadata_cached("isdir")
+    async def fake_isdir(path):
+        calls.append(path)
+        return False
+
+    @bbb.path.invalidates_metadata
+    async def fake_write(path):
+        pass
+
+    base = bbb.AzurePath("account", "container", "")
+    blob = base / "a" / "b"
+    metadata_cache.clear()
+    try:
+        # disabled by default
+        await fake_stat(blob)
+        await fake_stat(blob)
+        assert len(calls) == 2
+
+        calls.clear()
+        with bbb.globals.configure(metadata_cache_ttl=60, metadata_cache_size=3):
+            assert (await fake_stat(blob)).size == 1
+            assert (await fake_stat(blob)).size == 1
+            assert len(calls) == 1
+            for _ in range(2):
+                with pytest.raises(FileNotFoundError):
+                    await fake_stat(base / "missing")
+            assert len(calls) == 2
+
+            # writes invalidate the path and whether its parents are directories
+            assert not await fake_isdir(base / "a")
+            assert not await fake_isdir(base / "a/")
+            assert len(calls) == 3
+            await fake_write(blob)
+            assert (await fake_stat(blob)).size == 4
+            assert not await fake_isdir(base / "a")
+            assert len(calls) == 5
+
+            # listings seed the cache, and the least recently used entries are evicted
+            metadata_cache.seed(base / "x", CachedStat(10, 2.0, 2.0, None, "v"))
+            metadata_cache.seed(base / "y", None)
+            assert (await fake_stat(base / "x")).size == 10
+            assert await fake_isdir(base / "y")
+            assert len(calls) == 5
+            assert len(metadata_cache.entries) == 3
+            await fake_stat(blob)
+            assert len(calls) == 6
+
+        # entries expire
+        metadata_cache.clear()
+        with bbb.globals.configure(metadata_cache_ttl=-1):
+            await fake_stat(blob)
+            await fake_stat(blob)
+            assert len(calls) == 8
+
+        # the cache can be persisted
+        cache_file = str(tmp_path / "cache.json")
+        with bbb.globals.configure(metadata_cache_ttl=60, metadata_cache_file=cache_file):
+            await fake_stat(blob)
+            await fake_isdir(base / "y")
+            metadata_cache.save()
+            metadata_cache.clear()
+            metadata_cache.loaded = False
+            calls.clear()
+            stat = await fake_stat(blob)
+            assert (stat.size, stat.mtime, stat.version) == (9, 1.0, "v")
+            assert not await fake_isdir(base / "y")
+            assert not calls
+    finally:
+        metadata_cache.clear()
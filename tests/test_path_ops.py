@@ -49,6 +49,35 @@ async def test_isdir_isfile_exists(any_dir):
         assert (await bbb.exists(GooglePath("also", "missing"))) is False
 
 
+@pytest.mark.asyncio
+@bbb.ensure_session
+async def test_stat_or_isdir(any_dir):
+    assert await bbb.path.stat_or_isdir(any_dir / "alpha") == (None, False)
+
+    # these sort between "alpha" and "alpha/"
+    helpers.create_file(any_dir / "alpha-1", b"x")
+    helpers.create_file(any_dir / "alpha.txt", b"x")
+    assert await bbb.path.stat_or_isdir(any_dir / "alpha") == (None, False)
+
+    helpers.create_file(any_dir / "alpha" / "bravo", b"abc")
+    assert await bbb.path.stat_or_isdir(any_dir / "alpha") == (None, True)
+    stat, is_dir = await bbb.path.stat_or_isdir(any_dir / "alpha" / "bravo")
+    assert stat is not None and stat.size == 3
+    assert not is_dir
+    assert await bbb.path.stat_or_isdir(any_dir / "alph") == (None, False)
+
+
+def test_classify_listed_name():
+    classify = bbb.path._classify_listed_name
+    assert classify("a", "a") == "file"
+    assert classify("a", "a/") == "dir"
+    assert classify("a", "a/b") == "dir"
+    assert classify("a", "a.txt") is None
+    assert classify("a", "ab") == "past"
+    assert classify("a/", "a/") == "file"
+    assert classify("a/", "a/b") == "dir"
+
+
 @pytest.mark.asyncio
 @bbb.ensure_session
 async def test_stat(any_dir):
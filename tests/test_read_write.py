@@ -1,4 +1,5 @@
 import asyncio
+import os
 
 import pytest
 
@@ -28,6 +29,36 @@ async def test_read_write(any_dir):
             raise AssertionError
 
 
+@pytest.mark.asyncio
+@bbb.ensure_session
+async def test_read_stream_chunked(any_dir):
+    contents = os.urandom(10 * 1024 + 7)
+    helpers.create_file(any_dir / "blob", contents)
+    async with bbb.BoostExecutor(10) as e:
+        with bbb.globals.configure(chunk_size=1024):
+            stream = await bbb.read.read_stream(any_dir / "blob", e)
+            chunks = [chunk async for chunk in bbb.boost.iter_underlying(stream)]
+    assert len(chunks) == 11
+    assert b"".join(chunks) == contents
+
+
+@pytest.mark.asyncio
+@bbb.ensure_session
+async def test_read_byte_range_into(any_dir):
+    contents = os.urandom(1000)
+    helpers.create_file(any_dir / "blob", contents)
+    buffer = bytearray(2000)
+    view = await bbb.read.read_byte_range_into(any_dir / "blob", (100, 300), buffer)
+    assert view == contents[100:300]
+    assert buffer[:200] == contents[100:300]
+    assert buffer[200:] == bytes(1800)
+
+    view = await bbb.read.read_byte_range_into(
+        any_dir / "blob", (900, 1000), memoryview(buffer)[500:]
+    )
+    assert buffer[500:600] == contents[900:]
+
+
 @pytest.mark.asyncio
 @bbb.ensure_session
 async def test_concurrent_write(any_dir):
@@ -72,3 +103,19 @@ async def test_azure_write_unordered():
 
             await bbb.write.write_stream_unordered(path, iter(stream), e)
             assert b"".join(contents) == await bbb.read.read_single(path)
+
+
+@pytest.mark.asyncio
+@bbb.ensure_session
+async def test_write_no_overwrite(any_dir):
+    async with bbb.BoostExecutor(10) as e:
+        await bbb.write.write_single(any_dir / "single", b"abc")
+        with pytest.raises(FileExistsError):
+            await bbb.write.write_single(any_dir / "single", b"def")
+        await bbb.write.write_single(any_dir / "single", b"def", overwrite=True)
+        assert await bbb.read.read_single(any_dir / "single") == b"def"
+
+        await bbb.write.write_stream(any_dir / "stream", iter([b"abc"]), e)
+        with pytest.raises(FileExistsError):
+            await bbb.write.write_stream(any_dir / "stream", iter([b"def"]), e)
+        assert await bbb.read.read_single(any_dir / "stream") == b"abc"